@@ -1,5 +1,6 @@
 # main.py (версия с перезапуском меню после закрытия модуля)
 
+import multiprocessing
 import sys
 import tkinter as tk
 from tkinter import messagebox
@@ -91,4 +92,5 @@ def main_menu():
 
 # Запуск приложения
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Пул процессов извлечения текста в собранном exe
     main_menu()
@@ -1,25 +1,130 @@
+import datetime
+import functools
+import hashlib
 import json
-import subprocess
+import multiprocessing
+import os
 import sys
 import time
 import re
+import zipfile
+import xml.etree.ElementTree as ET
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import Dict, List, Optional, Any
+from typing import Callable, Dict, List, Optional, Any, Iterator, Sequence, Tuple
 import threading
+from contextlib import closing, contextmanager, nullcontext
 
 # Импорты для работы с файлами
 import pandas as pd
 import docx
 import fitz  # PyMuPDF
+import openpyxl
 import requests
 
-# Для GUI
-import tkinter as tk
-from tkinter import ttk, scrolledtext, messagebox
+from search_cancel import AbortableAdapter, CancelToken, Cancelled, abort_request
+from search_cache import TextCache, ExtractionCache, IndexCache, ResponseCache
+from search_checkpoint import ResultCheckpoint, checkpoint_file_for, config_fingerprint, write_json_atomic
+from search_corpus import LOCATE_CANDIDATES, CorpusIndex, corpus_file_for
+from search_index import (INDEX_CHUNK_CHARS, INDEX_CHUNK_OVERLAP, INDEX_TOP_K, INDEX_VERSION, ChunkIndex,
+                          select_chunks)
+from search_log import LOG_MAX_LINES, LOG_POLL_MS, QueuedLog
+from search_retrieval import keyword_terms, normalize_word, select_windows, split_chunks
+from search_ollama import OLLAMA_KEEP_ALIVE, OllamaManager
+from search_scheduler import RETRY_STATUSES, RequestScheduler, RetryableError, check_response
+from search_rules import EXCEL_LABEL_CONFIDENCE, apply_rules, resolve_excel_label
+
+# Для GUI; без Tk модуль работает только из командной строки (search_cli.py)
+try:
+    import tkinter as tk
+    from tkinter import ttk, scrolledtext, messagebox
+except ImportError:
+    tk = ttk = scrolledtext = messagebox = None
 
 CONFIG_FILE = Path('config.json')
 OUTPUT_FILE = Path('data.json')
 API_KEY_FILE = Path('api.txt')  # Файл с API-ключом для OpenRouter
+LOG_FILE = Path('search.log')  # Полный лог GUI за сеанс (в окне — только последние строки)
+TEXT_CACHE_MAX_BYTES = 256 * 1024 * 1024  # Бюджет памяти под извлечённые тексты в пределах запуска
+CACHE_DIR = Path('.search_cache')  # Каталог постоянных кэшей поиска
+EXTRACTION_CACHE_MAX_BYTES = 512 * 1024 * 1024  # Предельный размер сжатого кэша извлечённого текста
+EXTRACTOR_VERSION = 4  # Увеличивать при изменении логики извлечения, чтобы сбросить кэш
+EXTRACTION_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))  # Процессов для извлечения текста
+EXTRACTION_TIMEOUT = 120  # Секунд на извлечение одного файла
+CANCEL_POLL_SECONDS = 0.25  # Как часто ожидание пула извлечения проверяет остановку запуска
+PDF_LAZY_MIN_PAGES = 10  # Из PDF длиннее этого модели передаются только страницы с ключевыми словами
+PDF_STEM_LEN = 6  # Длина основы слова для поиска по страницам PDF
+PDF_PAGE_BREAK = '\f'  # Разделитель страниц в извлечённом (и кэшированном) тексте PDF
+SUPPORTED_TYPES = ("word", "excel", "pdf")
+AI_CONCURRENCY = 4  # Одновременных запросов к модели
+ITEM_DEADLINE = 600  # Предел времени на запрос значения элемента к модели, с (None — без предела)
+RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024  # Предельный размер кэша ответов модели
+PROMPT_VERSION = 1  # Увеличивать при изменении шаблонов промптов или разбора ответов
+FREE_MODEL_REQUESTS_PER_MINUTE = 20  # Лимит OpenRouter для бесплатных моделей (":free")
+OLLAMA_STREAM = True  # Потоковые ответы Ollama с остановкой на первой готовой строке ответа
+STREAM_MAX_TOKENS = 1024  # Предел токенов ответа (вместе с <think>) на один запрос
+STREAM_MAX_SECONDS = 120  # Предел времени генерации на один запрос, с (отсчитывается с первого токена)
+STREAM_FIRST_TOKEN_SECONDS = 300  # Ожидание первого токена: обработка длинного промпта на CPU бывает долгой
+BATCH_FIELDS = True  # Запрашивать поля одного файла одним промптом
+BATCH_MAX_FIELDS = 12  # Не больше полей в одном пакетном промпте
+RETRIEVAL_MAX_CHARS = 6000  # Символов контекста на одно поле при отборе фрагментов по ключевым словам
+RETRIEVAL_RADIUS = 600  # Символов по обе стороны от найденного ключевого слова
+INDEX_CACHE_MAX_BYTES = 256 * 1024 * 1024  # Предельный размер кэша индексов частей документов
+INDEX_MEMORY_ENTRIES = 32  # Индексов документов в памяти в пределах запуска
+EMBEDDING_MODEL = None  # Модель эмбеддингов Ollama для отбора частей по смыслу (например, "bge-m3"); None — только BM25
+EMBED_BATCH_SIZE = 32  # Частей документа в одном запросе эмбеддингов
+MODEL_CONTEXT_TOKENS = 8192  # Окно контекста модели Ollama по умолчанию (передаётся как num_ctx)
+OPENROUTER_CONTEXT_TOKENS = 32768  # Окно контекста модели OpenRouter, если /models его не сообщил
+CHARS_PER_TOKEN = 2.5  # Осторожная оценка символов русского текста на токен
+PROMPT_OVERHEAD_TOKENS = 150  # Токенов на шаблон промпта без текста документа
+CHUNK_OVERLAP_CHARS = 400  # Перекрытие соседних частей, чтобы не разрезать значение
+CONTEXT_STEP_TOKENS = 2048  # num_ctx для Ollama подбирается кратным этому шагу
+CHUNK_MIN_CHARS = 1000  # Части меньше этого не делаем, даже если окно контекста мало
+CHUNK_REDUCE = "vote"  # Сведение ответов частей: "vote" — самое частое значение, "first" — первое найденное
+EXCEL_LABELS_MAX_BYTES = 20 * 1024 * 1024  # Книги больше этого размера по ячейкам не разбираем
+EXCEL_CELLS_TYPE = "excel:cells"  # Тип записи кэша извлечения с ячейками книги (для поиска по подписям)
+
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_W_P, _W_TBL, _W_TR, _W_TC = _W + 'p', _W + 'tbl', _W + 'tr', _W + 'tc'
+_MC_FALLBACK = '{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback'
+# Содержимое этих элементов не относится к тексту самого абзаца
+_WORD_SKIP_TAGS = {_W + 'p', _W + 'delText', _W + 'instrText', _W + 'drawing', _W + 'pict',
+                   '{http://schemas.openxmlformats.org/markup-compatibility/2006}AlternateContent'}
+
+
+def _word_paragraph_text(paragraph) -> str:
+    """Текст абзаца document.xml (вложенные абзацы надписей не включаются)"""
+    parts = []
+    stack = list(reversed(paragraph))
+    while stack:
+        elem = stack.pop()
+        tag = elem.tag
+        if tag in _WORD_SKIP_TAGS:
+            continue
+        if tag == _W + 't':
+            parts.append(elem.text or '')
+        elif tag == _W + 'tab':
+            parts.append('\t')
+        elif tag in (_W + 'br', _W + 'cr'):
+            parts.append('\n')
+        else:
+            stack.extend(reversed(elem))
+    return ''.join(parts)
+
+
+def _word_cell_is_continuation(cell) -> bool:
+    """Ячейка продолжает объединение (по вертикали или по старой схеме по горизонтали)"""
+    props = cell.find(_W + 'tcPr')
+    if props is None:
+        return False
+    for merge_tag in ('vMerge', 'hMerge'):
+        merge = props.find(_W + merge_tag)
+        if merge is not None and merge.get(_W + 'val', 'continue') != 'restart':
+            return True
+    return False
 
 
 class DocumentExtractor:
@@ -27,7 +132,74 @@ class DocumentExtractor:
 
     @staticmethod
     def extract_from_word(file_path: Path) -> str:
-        """Извлечение текста из Word документов включая таблицы"""
+        """Извлечение текста из Word документов включая таблицы (в порядке документа)"""
+        try:
+            return DocumentExtractor._extract_from_word_xml(file_path)
+        except Exception:
+            # Документы, которые не удалось разобрать напрямую, обрабатываем через python-docx
+            return DocumentExtractor._extract_from_word_docx(file_path)
+
+    @staticmethod
+    def _extract_from_word_xml(file_path: Path) -> str:
+        """Потоковый разбор word/document.xml без построения объектной модели python-docx.
+
+        Абзацы и таблицы выводятся в порядке документа, строка таблицы — ячейки через « | ».
+        Продолжения объединённых ячеек (vMerge/hMerge) пропускаются, поэтому текст не дублируется.
+        """
+        lines: List[str] = []
+        table_rows: List[str] = []
+        row: List[str] = []
+        cell_parts: List[str] = []
+        table_depth = 0
+        fallback_depth = 0  # Внутри mc:Fallback — копия содержимого (надписи), её не выводим
+
+        with zipfile.ZipFile(file_path) as archive:
+            with archive.open('word/document.xml') as xml_file:
+                for event, elem in ET.iterparse(xml_file, events=('start', 'end')):
+                    tag = elem.tag
+                    if event == 'start':
+                        if tag == _W_TBL:
+                            table_depth += 1
+                            if table_depth == 1:
+                                table_rows = []
+                        elif tag == _W_TR and table_depth == 1:
+                            row = []
+                        elif tag == _W_TC and table_depth == 1:
+                            cell_parts = []
+                        elif tag == _MC_FALLBACK:
+                            fallback_depth += 1
+                        continue
+
+                    if tag == _MC_FALLBACK:
+                        fallback_depth -= 1
+                    elif tag == _W_P:
+                        if not fallback_depth:
+                            text = _word_paragraph_text(elem)
+                            if table_depth:
+                                cell_parts.append(text)
+                            elif text.strip():
+                                lines.append(text)
+                        if not table_depth:
+                            elem.clear()
+                    elif tag == _W_TC and table_depth == 1:
+                        cell_text = ' '.join(cell_parts).strip().replace('\n', ' ').replace('\t', ' ')
+                        if cell_text and not _word_cell_is_continuation(elem):
+                            row.append(cell_text)
+                    elif tag == _W_TR and table_depth == 1:
+                        if row:
+                            table_rows.append(' | '.join(row))
+                        elem.clear()
+                    elif tag == _W_TBL:
+                        table_depth -= 1
+                        if not table_depth:
+                            if table_rows:
+                                lines.append('\n'.join(table_rows))
+                            elem.clear()
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _extract_from_word_docx(file_path: Path) -> str:
+        """Извлечение через python-docx: сначала абзацы, затем таблицы"""
         try:
             doc = docx.Document(file_path)
             text = []
@@ -56,14 +228,61 @@ class DocumentExtractor:
         except Exception as e:
             return f"Ошибка при извлечении из Word файла {file_path}: {e}"
 
+    @staticmethod
+    def _cell_text(value: Any) -> str:
+        """Текстовое представление значения ячейки Excel"""
+        if value is None:
+            return ""
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        if isinstance(value, datetime.datetime) and value.time() == datetime.time(0, 0):
+            return value.date().isoformat()
+        return str(value).strip()
+
+    @staticmethod
+    def iter_excel_rows(file_path: Path) -> Iterator[Tuple[str, int, List[Tuple[int, str]]]]:
+        """Потоковое чтение непустых строк книги: (лист, номер строки, [(номер столбца, текст)])
+
+        Книга открывается один раз в режиме read-only, строки читаются по одной без DataFrame.
+        """
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            for sheet in workbook.worksheets:
+                for row_idx, row in enumerate(sheet.iter_rows(values_only=True), 1):
+                    cells = [(col_idx, DocumentExtractor._cell_text(value))
+                             for col_idx, value in enumerate(row, 1) if value is not None]
+                    cells = [(col_idx, text) for col_idx, text in cells if text]
+                    if cells:
+                        yield sheet.title, row_idx, cells
+        finally:
+            workbook.close()
+
     @staticmethod
     def extract_from_excel(file_path: Path) -> str:
-        """Извлечение текста из Excel файлов"""
+        """Извлечение текста из Excel файлов (строка листа — строка текста, ячейки через « | »)"""
+        if file_path.suffix.lower() not in ('.xlsx', '.xlsm', '.xltx', '.xltm'):
+            return DocumentExtractor._extract_from_excel_pandas(file_path)
+        try:
+            lines = []
+            current_sheet = None
+            for sheet_name, _, cells in DocumentExtractor.iter_excel_rows(file_path):
+                if sheet_name != current_sheet:
+                    current_sheet = sheet_name
+                    lines.append(f"[{sheet_name}]")
+                lines.append(' | '.join(text.replace('\n', ' ') for _, text in cells))
+            return '\n'.join(lines)
+        except Exception:
+            # Книги, которые openpyxl не читает, обрабатываем старым способом
+            return DocumentExtractor._extract_from_excel_pandas(file_path)
+
+    @staticmethod
+    def _extract_from_excel_pandas(file_path: Path) -> str:
+        """Извлечение текста из Excel через pandas (старые .xls и нестандартные книги)"""
         try:
             all_text = []
             with pd.ExcelFile(file_path) as excel_file:
                 for sheet_name in excel_file.sheet_names:
-                    df = pd.read_excel(file_path, sheet_name=sheet_name)
+                    df = excel_file.parse(sheet_name, header=None)
                     sheet_text = df.astype(str).values.flatten()
                     all_text.extend([cell for cell in sheet_text if cell != 'nan'])
             return '\n'.join(all_text)
@@ -72,7 +291,7 @@ class DocumentExtractor:
 
     @staticmethod
     def extract_from_pdf(file_path: Path) -> str:
-        """Извлечение текста из PDF файлов с помощью PyMuPDF"""
+        """Извлечение текста из PDF файлов с помощью PyMuPDF (страницы разделены PDF_PAGE_BREAK)"""
         try:
             texts = []
             with fitz.open(file_path) as doc:
@@ -80,24 +299,249 @@ class DocumentExtractor:
                     page = doc.load_page(page_num)
                     # Используем явный режим "text" для более стабильного потока
                     texts.append(page.get_text("text"))
-            return '\n'.join(texts)
+            return PDF_PAGE_BREAK.join(texts)
         except Exception as e:
             return f"Ошибка при извлечении из PDF файла {file_path}: {e}"
 
+    @staticmethod
+    def select_pdf_pages(text: str, keyword_sets: Optional[Sequence[Sequence[str]]] = None) -> str:
+        """Страницы PDF с ключевыми словами и соседние с ними; разделители страниц — переводы строк.
+
+        Отбираются страницы документов длиннее PDF_LAZY_MIN_PAGES: страница подходит набору
+        ключевых слов, если на ней есть хотя бы половина основ его слов. Если хотя бы для одного
+        набора страниц не нашлось, возвращается весь документ.
+        """
+        pages = text.split(PDF_PAGE_BREAK)
+        # Основы слов: начало длинного слова совпадает во всех падежах
+        stem_sets = [stems for stems in ({term[:PDF_STEM_LEN] for term in keyword_terms(keywords)}
+                                         for keywords in keyword_sets or ()) if stems]
+        if not stem_sets or len(pages) <= PDF_LAZY_MIN_PAGES:
+            return '\n'.join(pages)
+
+        lowered = [normalize_word(page) for page in pages]
+        hit_pages = set()
+        for stems in stem_sets:
+            hits = {n for n, page in enumerate(lowered) if sum(1 for stem in stems if stem in page) * 2 >= len(stems)}
+            if not hits:
+                return '\n'.join(pages)
+            hit_pages |= hits
+
+        selected = sorted({n + d for n in hit_pages for d in (-1, 0, 1) if 0 <= n + d < len(pages)})
+        return '\n'.join(f"[стр. {n + 1}]\n{pages[n]}" for n in selected)
+
+
+def extract_by_type(extractor, file_path: Path, file_type: str) -> str:
+    """Извлечение текста соответствующим методом DocumentExtractor"""
+    if file_type == "word":
+        return extractor.extract_from_word(file_path)
+    elif file_type == "excel":
+        return extractor.extract_from_excel(file_path)
+    elif file_type == "pdf":
+        return extractor.extract_from_pdf(file_path)
+    return ""
+
+
+def _extract_job(extractor, file_path: str, file_type: str) -> str:
+    """Задача для дочернего процесса пула извлечения"""
+    return extract_by_type(extractor, Path(file_path), file_type)
+
+
+def _terminate_pool(executor: ProcessPoolExecutor):
+    """Останавливает пул, принудительно завершая зависшие процессы"""
+    processes = list((getattr(executor, '_processes', None) or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        try:
+            if process.is_alive():
+                process.terminate()
+        except Exception:
+            pass
+
+
+def _run_extraction_pool(jobs: List[Tuple[str, str]], workers: int, timeout: float, extractor,
+                         timings: Optional[Dict[Tuple[str, str], float]] = None,
+                         cancel: Optional[CancelToken] = None) -> Iterator[Tuple[Tuple[str, str], Optional[str]]]:
+    """Прогон задач через пул процессов.
+
+    Выдаёт (задача, текст) в порядке готовности. Текст None означает, что процесс
+    аварийно завершился и виновника в упавшем пуле определить нельзя.
+    В timings записывается время выполнения каждой задачи, с.
+    После отмены cancel процессы пула завершаются и поднимается Cancelled.
+    """
+    pending = deque(jobs)
+    running = {}
+    executor = None
+    try:
+        while pending or running:
+            if executor is None:
+                executor = ProcessPoolExecutor(max_workers=workers)
+
+            # В работе не больше workers задач, поэтому отсчёт таймаута начинается с запуска
+            while pending and len(running) < workers:
+                job = pending.popleft()
+                try:
+                    future = executor.submit(_extract_job, extractor, job[0], job[1])
+                except BrokenProcessPool:
+                    pending.appendleft(job)
+                    break
+                running[future] = (job, time.monotonic() + timeout)
+
+            if not running:
+                # Пул сломан ещё до запуска задач — пересоздаём
+                _terminate_pool(executor)
+                executor = None
+                yield pending.popleft(), None
+                continue
+
+            nearest = min(deadline for _, deadline in running.values())
+            wait_seconds = max(0.0, nearest - time.monotonic())
+            if cancel is not None:
+                wait_seconds = min(wait_seconds, CANCEL_POLL_SECONDS)
+            done, _ = wait(list(running), timeout=wait_seconds, return_when=FIRST_COMPLETED)
+            if cancel is not None:
+                cancel.check()
+
+            broken = False
+            for future in done:
+                job, deadline = running.pop(future)
+                if timings is not None:
+                    timings[(job[0], job[1])] = time.monotonic() - (deadline - timeout)
+                try:
+                    yield job, future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    yield job, None
+                except Exception as e:
+                    yield job, f"Ошибка при извлечении файла {job[0]}: {e}"
+
+            if broken:
+                # Вместе с упавшим процессом потеряны и остальные задачи пула
+                for job, _ in running.values():
+                    yield job, None
+                running.clear()
+                _terminate_pool(executor)
+                executor = None
+                continue
+
+            now = time.monotonic()
+            expired = [f for f, (_, deadline) in running.items() if deadline <= now and not f.done()]
+            if expired:
+                for future in expired:
+                    job, _ = running.pop(future)
+                    yield job, f"Ошибка при извлечении файла {job[0]}: превышено время ожидания ({timeout} с)"
+                # Зависший процесс можно остановить только вместе с пулом — остальные задачи перезапускаем
+                for job, _ in running.values():
+                    pending.appendleft(job)
+                running.clear()
+                _terminate_pool(executor)
+                executor = None
+    finally:
+        if executor is not None:
+            if running:
+                _terminate_pool(executor)
+            else:
+                executor.shutdown(wait=True)
+
+
+def extract_files_parallel(jobs: List[Tuple[str, str]], workers: int, timeout: float, extractor=None,
+                           timings: Optional[Dict[Tuple[str, str], float]] = None,
+                           cancel: Optional[CancelToken] = None) -> Iterator[Tuple[str, str, str]]:
+    """Параллельное извлечение текста из файлов в пуле процессов.
+
+    Выдаёт (путь, тип, текст) в порядке готовности. Каждый файл ограничен таймаутом,
+    а файлы из аварийно завершившегося пула перезапускаются поодиночке, так что
+    один битый документ не роняет и не подвешивает весь запуск.
+    Если передан timings, в него записывается время извлечения каждого файла, с.
+    После отмены cancel процессы извлечения завершаются и поднимается Cancelled.
+    """
+    extractor = extractor if extractor is not None else DocumentExtractor()
+    suspects = []
+    for job, text in _run_extraction_pool(jobs, workers, timeout, extractor, timings, cancel):
+        if text is None:
+            suspects.append(job)
+        else:
+            yield job[0], job[1], text
+
+    for suspect in suspects:
+        for job, text in _run_extraction_pool([suspect], 1, timeout, extractor, timings, cancel):
+            if text is None:
+                text = f"Ошибка при извлечении файла {job[0]}: процесс извлечения аварийно завершился"
+            yield job[0], job[1], text
+
+
+def percentiles(values: List[float]) -> Optional[Dict[str, float]]:
+    """Перцентили p50/p90/p99, среднее и максимум (None для пустого списка)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def rank(p: int) -> float:
+        # Метод ближайшего ранга
+        return ordered[max(0, -(-len(ordered) * p // 100) - 1)]
+
+    return {
+        'p50': rank(50), 'p90': rank(90), 'p99': rank(99),
+        'mean': round(sum(ordered) / len(ordered), 1), 'max': ordered[-1],
+    }
+
+
+def metrics_file_for(output_file: Path) -> Path:
+    """Файл сводки метрик рядом с файлом результатов: data.json -> data.metrics.json"""
+    return output_file.with_name(f"{output_file.stem}.metrics.json")
+
 
 class AIInterface:
     """Класс для взаимодействия с AI (Ollama или OpenRouter)"""
 
-    def __init__(self, provider: str = "ollama", api_key: str = None, model: Optional[str] = None):
+    def __init__(self, provider: str = "ollama", api_key: str = None, model: Optional[str] = None,
+                 max_concurrency: int = AI_CONCURRENCY, use_response_cache: bool = True,
+                 stream: bool = OLLAMA_STREAM, context_tokens: Optional[int] = None,
+                 requests_per_minute: Optional[float] = None):
+        """requests_per_minute: лимит частоты запросов; None — по провайдеру и модели, 0 — без лимита.
+
+        context_tokens: окно контекста модели; None — по провайдеру и модели (для OpenRouter
+        берётся из списка моделей при start).
+        """
         self.provider = provider
         self.api_key = api_key
         self.base_url = "http://localhost:11434" if provider == "ollama" else "https://openrouter.ai/api/v1"
         self.model = model if model else ("qwen3:14b" if provider == "ollama" else "deepseek/deepseek-r1:free")
         self.ollama_process = None
+        self.lifecycle: Optional[OllamaManager] = None
+        # Время до первого токена каждого потокового ответа, с (для отчёта)
+        self.first_token_times: List[float] = []
+        # Метрики запросов записываются в список, заданный для текущего потока (см. recording)
+        self._recording = threading.local()
+        # Токен отмены запросов текущего потока (см. cancellation)
+        self._cancel = threading.local()
 
         if provider == "openrouter" and not api_key:
             raise ValueError("API-ключ для OpenRouter не предоставлен")
 
+        # Одна сессия с пулом соединений на все запросы: без повторных TCP/TLS-рукопожатий
+        self.max_concurrency = max(1, max_concurrency)
+        self.session = requests.Session()
+        # Адаптер позволяет оборвать запрос потока при отмене (см. cancellation)
+        adapter = AbortableAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # Ограничение частоты и числа одновременных запросов, повторы при 429/5xx и сетевых ошибках
+        if requests_per_minute is None and provider == "openrouter" and self.model.endswith(":free"):
+            requests_per_minute = FREE_MODEL_REQUESTS_PER_MINUTE
+        self.scheduler = RequestScheduler(self.max_concurrency, requests_per_minute)
+        # Потоковый режим Ollama: генерация прерывается, как только готов ответ или исчерпан бюджет
+        self.stream = stream
+        self.stream_max_tokens = STREAM_MAX_TOKENS
+        self.stream_max_seconds = STREAM_MAX_SECONDS
+        self.stream_first_token_seconds = STREAM_FIRST_TOKEN_SECONDS
+        # Окно контекста: текст длиннее бюджета запрашивается по частям (см. text_budget)
+        self.context_limit = context_tokens
+        self.context_tokens = context_tokens or (MODEL_CONTEXT_TOKENS if provider == "ollama"
+                                                 else OPENROUTER_CONTEXT_TOKENS)
+        # Ответы на неизменённые промпты берём с диска без обращения к модели
+        self.response_cache = ResponseCache(CACHE_DIR / 'responses', RESPONSE_CACHE_MAX_BYTES) \
+            if use_response_cache else None
+
     def clean_model_response(self, response: str) -> str:
         """Очистка ответа модели от лишнего текста (логика сохранена по требованию)"""
         if not response:
@@ -139,54 +583,145 @@ class AIInterface:
         return clean_line
 
     def start(self, logger=None) -> bool:
-        """Запуск провайдера (только для Ollama)"""
+        """Запуск провайдера: для Ollama — ожидание готовности сервера и проверка модели,
+        для OpenRouter — окно контекста выбранной модели"""
         if self.provider != "ollama":
+            if self.context_limit is None:
+                self._load_openrouter_context(logger)
             return True
 
-        def log(msg):
-            if logger:
-                logger(msg)
+        self.lifecycle = OllamaManager(self.session, self.base_url, self.model)
+        if not self.lifecycle.start(logger=logger):
+            return False
+        self.ollama_process = self.lifecycle.process
+        if self.lifecycle.has_model() is False and logger:
+            logger(f"⚠️ Модель {self.model} не найдена в Ollama (загрузите её: ollama pull {self.model})")
+        return True
 
+    def _load_openrouter_context(self, logger=None):
+        """Окно контекста модели из списка моделей OpenRouter (context_length)"""
         try:
-            response = requests.get(f"{self.base_url}/api/tags", timeout=5)
-            if response.status_code == 200:
-                log("Ollama уже запущена")
-                return True
-        except requests.exceptions.RequestException as e:
-            log(f"Ollama не обнаружена по HTTP: {e}")
-
+            response = self.session.get(f"{self.base_url}/models", timeout=10)
+            response.raise_for_status()
+            models = response.json().get('data', [])
+            context = next((m.get('context_length') for m in models if m.get('id') == self.model), None)
+        except (requests.RequestException, ValueError, AttributeError) as e:
+            context = None
+            if logger:
+                logger(f"⚠️ Не удалось получить окно контекста {self.model} из OpenRouter: {e}")
+        if isinstance(context, int) and context > 0:
+            self.context_tokens = context
+        if logger:
+            logger(f"Окно контекста {self.model}: {self.context_tokens} токенов")
+
+    def prepare(self, prompt_chars: Optional[int], logger=None):
+        """Загрузка и прогрев модели до первого запроса.
+
+        num_ctx подбирается по наибольшему ожидаемому промпту (prompt_chars символов, None — неизвестно),
+        чтобы модель не перезагружалась с другим окном и не держала в памяти лишний контекст.
+        """
+        if self.provider != "ollama" or self.lifecycle is None or not self.lifecycle.ready:
+            return
+        if prompt_chars:
+            needed = (int(prompt_chars / CHARS_PER_TOKEN) + 1 + PROMPT_OVERHEAD_TOKENS
+                      + max(self.answer_tokens(BATCH_MAX_FIELDS), self.stream_max_tokens))
+            steps = -(-needed // CONTEXT_STEP_TOKENS)
+            limit = self.context_limit or MODEL_CONTEXT_TOKENS
+            self.context_tokens = min(limit, max(CONTEXT_STEP_TOKENS, steps * CONTEXT_STEP_TOKENS))
+
+        if logger:
+            logger(f"🔥 Загрузка модели {self.model} (num_ctx={self.context_tokens}, "
+                   f"keep_alive={self.lifecycle.keep_alive})...")
+        with self._abortable():
+            first_token = self.lifecycle.warm_up(self.context_tokens, logger=logger)
+        if first_token is not None and logger:
+            load = f", загрузка {self.lifecycle.load_seconds:.1f} с" if self.lifecycle.load_seconds else ""
+            logger(f"🔥 Модель готова: время до первого токена {first_token:.1f} с{load}")
+
+    @contextmanager
+    def recording(self, calls: List[Dict[str, Any]]):
+        """Запись метрик запросов к модели из текущего потока в calls (по словарю на запрос)"""
+        previous = getattr(self._recording, 'calls', None)
+        self._recording.calls = calls
         try:
-            self.ollama_process = subprocess.Popen(
-                ["ollama", "serve"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-
-            max_attempts = 30
-            for attempt in range(1, max_attempts + 1):
-                try:
-                    response = requests.get(f"{self.base_url}/api/tags", timeout=2)
-                    if response.status_code == 200:
-                        log("Ollama успешно запущена")
-                        return True
-                    else:
-                        log(f"Ожидание Ollama... код {response.status_code}")
-                except requests.exceptions.RequestException:
-                    log(f"Ожидание Ollama... попытка {attempt}/{max_attempts}")
-                time.sleep(2)
+            yield calls
+        finally:
+            self._recording.calls = previous
 
-            log("Не удалось дождаться запуска Ollama в отведенное время")
-            return False
+    @contextmanager
+    def cancellation(self, token: Optional[CancelToken]):
+        """Запросы к модели из текущего потока отменяются токеном token.
 
-        except Exception as e:
-            if logger:
-                logger(f"Ошибка запуска Ollama: {e}")
-            return False
-
-    def query_model(self, text: str, keywords: List[str], logger=None) -> str:
-        """Запрос к модели для поиска значений"""
-        keywords_str = ", ".join(keywords)
-        prompt = f"""Представь что ты робот-парсер твоя задача найти "{keywords_str}" в тексте: "{text}". Строжайше выводи только то значение которое у тебя запрашивают так как твои значения используются в программе и лишний текст будет ей мешать. """
+        При отмене ожидание слота и паузы перед повтором прерываются, а выполняющийся
+        HTTP-запрос обрывается; вызывающий код получает Cancelled.
+        """
+        previous = getattr(self._cancel, 'token', None)
+        self._cancel.token = token
+        try:
+            yield token
+        finally:
+            self._cancel.token = previous
+
+    @contextmanager
+    def _abortable(self):
+        """HTTP-запрос внутри блока обрывается при отмене токена текущего потока"""
+        token = getattr(self._cancel, 'token', None)
+        if token is None:
+            yield
+            return
+        with token.on_cancel(functools.partial(abort_request, threading.get_ident())):
+            yield
+
+    def _schedule(self, send, logger):
+        """send() через планировщик запросов; повторы учитываются в метриках текущего запроса"""
+        return self.scheduler.run(send, logger=logger, cancel=getattr(self._cancel, 'token', None),
+                                  on_retry=self._count_retry)
+
+    def _count_retry(self):
+        self._recording.retries = getattr(self._recording, 'retries', 0) + 1
+
+    def generate(self, prompt: str, logger=None, max_tokens: int = 500, json_mode: bool = False) -> Optional[str]:
+        """Ответ модели на промпт (из кэша ответов, если он уже был). None при ошибке"""
+        started = time.monotonic()
+        self._recording.first_token = None
+        self._recording.retries = 0
+        cache_hit = False
+        token = getattr(self._cancel, 'token', None)
+        if self.response_cache is None:
+            answer = self._request(prompt, logger, max_tokens, json_mode)
+            if token is not None:
+                token.check()
+        else:
+            key = self.response_cache.key(self.provider, self.model, PROMPT_VERSION, prompt,
+                                          max_tokens=max_tokens, json_mode=json_mode)
+            answer = self.response_cache.get(key)
+            cache_hit = answer is not None
+            if not cache_hit:
+                answer = self._request(prompt, logger, max_tokens, json_mode)
+                # Ответ, оборванный отменой, неполон — не кэшируем и не используем
+                if token is not None:
+                    token.check()
+                # Ошибки не кэшируем — при следующем запуске запрос повторится
+                if answer is not None:
+                    self.response_cache.put(key, answer, provider=self.provider, model=self.model)
+
+        calls = getattr(self._recording, 'calls', None)
+        if calls is not None:
+            first_token = self._recording.first_token
+            calls.append({
+                'prompt_chars': len(prompt),
+                'prompt_tokens': self.estimate_tokens(prompt),
+                'model_ms': round((time.monotonic() - started) * 1000, 1),
+                'first_token_ms': round(first_token * 1000, 1) if first_token is not None else None,
+                'response_cache_hit': cache_hit,
+                # Повторы HTTP-запроса планировщиком (429, 5xx, сетевые ошибки)
+                'retries': self._recording.retries,
+                'error': answer is None,
+            })
+        return answer
+
+    def _request(self, prompt: str, logger=None, max_tokens: int = 500, json_mode: bool = False) -> Optional[str]:
+        """Отправка промпта модели. Возвращает сырой ответ или None при ошибке"""
 
         def log(msg):
             if logger:
@@ -198,31 +733,43 @@ class AIInterface:
                     "model": self.model,
                     "prompt": prompt,
                     "stream": False,
+                    # Модель остаётся загруженной между элементами
+                    "keep_alive": OLLAMA_KEEP_ALIVE,
                     "options": {
                         "temperature": 0.1,
                         "top_p": 0.9,
-                        "think": False
+                        "think": False,
+                        # Без явного num_ctx Ollama молча обрезает длинный промпт до окна по умолчанию
+                        "num_ctx": self.context_tokens
                     }
                 }
-
-                response = requests.post(
-                    f"{self.base_url}/api/generate",
-                    json=payload,
-                    timeout=300
-                )
+                if json_mode:
+                    payload["format"] = "json"
+                if self.stream:
+                    return self._stream_ollama(payload, json_mode, log)
+
+                def send():
+                    with self._abortable():
+                        response = self.session.post(
+                            f"{self.base_url}/api/generate",
+                            json=payload,
+                            timeout=300
+                        )
+                    check_response(response)
+                    return response
+
+                response = self._schedule(send, logger)
 
                 if response.status_code == 200:
                     result = response.json()
-                    raw_answer = result.get("response", "").strip()
-                    cleaned_answer = self.clean_model_response(raw_answer)
-                    return cleaned_answer if cleaned_answer else "null"
+                    return result.get("response", "").strip()
                 else:
                     log(f"ОШИБКА Ollama: status={response.status_code}, body={response.text[:300]}")
-                    return "null"
+                    return None
 
             except Exception as e:
                 log(f"Исключение при запросе к Ollama: {e}")
-                return "null"
+                return None
 
         elif self.provider == "openrouter":
             try:
@@ -236,48 +783,326 @@ class AIInterface:
                     "model": self.model,
                     "messages": [{"role": "user", "content": prompt}],
                     "temperature": 0.1,
-                    "max_tokens": 500
+                    "max_tokens": max_tokens
                 }
 
-                response = requests.post(
-                    f"{self.base_url}/chat/completions",
-                    headers=headers,
-                    json=payload,
-                    timeout=300
-                )
+                def send():
+                    with self._abortable():
+                        response = self.session.post(
+                            f"{self.base_url}/chat/completions",
+                            headers=headers,
+                            json=payload,
+                            timeout=300
+                        )
+                    check_response(response)
+                    if response.status_code == 200:
+                        # OpenRouter может вернуть ошибку провайдера модели в теле ответа 200
+                        error = response.json().get("error")
+                        if isinstance(error, dict) and error.get("code") in RETRY_STATUSES:
+                            raise RetryableError(f"code={error.get('code')}, {error.get('message', '')}"[:300],
+                                                 throttled=error.get("code") == 429)
+                    return response
+
+                response = self._schedule(send, logger)
 
                 if response.status_code == 200:
                     result = response.json()
-                    raw_answer = result["choices"][0]["message"]["content"].strip()
-                    cleaned_answer = self.clean_model_response(raw_answer)
-                    return cleaned_answer if cleaned_answer else "null"
+                    return result["choices"][0]["message"]["content"].strip()
                 else:
                     log(f"ОШИБКА OpenRouter: status={response.status_code}, body={response.text[:300]}")
-                    return "null"
+                    return None
             except Exception as e:
                 log(f"Исключение при запросе к OpenRouter: {e}")
-                return "null"
+                return None
+
+        return None
+
+    def embed(self, texts: List[str], model: str, logger=None) -> Optional[List[List[float]]]:
+        """Векторы текстов от модели эмбеддингов Ollama. None — провайдер не Ollama или ошибка"""
+
+        def log(msg):
+            if logger:
+                logger(msg)
+
+        if self.provider != "ollama":
+            return None
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), EMBED_BATCH_SIZE):
+            payload = {"model": model, "input": texts[start:start + EMBED_BATCH_SIZE], "keep_alive": OLLAMA_KEEP_ALIVE}
+
+            def send():
+                with self._abortable():
+                    response = self.session.post(f"{self.base_url}/api/embed", json=payload, timeout=300)
+                check_response(response)
+                return response
 
-    def stop(self):
-        """Остановка провайдера (только для Ollama)"""
-        if self.provider == "ollama" and self.ollama_process:
             try:
-                self.ollama_process.terminate()
-                self.ollama_process.wait(timeout=10)
-            except Exception:
-                pass
-            finally:
-                self.ollama_process = None
+                response = self.scheduler.run(send, logger=logger, cancel=getattr(self._cancel, 'token', None))
+                if response.status_code != 200:
+                    log(f"ОШИБКА эмбеддингов Ollama: status={response.status_code}, body={response.text[:300]}")
+                    return None
+                embeddings = response.json().get("embeddings")
+            except Exception as e:
+                log(f"Исключение при запросе эмбеддингов Ollama: {e}")
+                return None
+            if not isinstance(embeddings, list) or len(embeddings) != len(payload["input"]):
+                log(f"ОШИБКА эмбеддингов Ollama: неожиданный ответ модели {model}")
+                return None
+            vectors.extend(embeddings)
+        return vectors
+
+    @staticmethod
+    def answer_complete(text: str, json_mode: bool = False) -> bool:
+        """Готов ли в частичном ответе модели результат, который выберет clean_model_response"""
+        text = re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL)
+        if '<think>' in text:
+            return False
+
+        if json_mode:
+            start = text.find('{')
+            if start == -1:
+                return False
+            depth, in_string, escaped = 0, False, False
+            for ch in text[start:]:
+                if in_string:
+                    if escaped:
+                        escaped = False
+                    elif ch == '\\':
+                        escaped = True
+                    elif ch == '"':
+                        in_string = False
+                elif ch == '"':
+                    in_string = True
+                elif ch == '{':
+                    depth += 1
+                elif ch == '}':
+                    depth -= 1
+                    if depth == 0:
+                        return True
+            return False
+
+        # Последняя строка может быть недописана — смотрим только завершённые
+        for line in text.split('\n')[:-1]:
+            line = line.strip()
+            if line and not line.startswith('<') and not line.startswith('Объяснение'):
+                return True
+        return False
+
+    def _stream_ollama(self, payload: Dict[str, Any], json_mode: bool, log) -> Optional[str]:
+        """Потоковый запрос к Ollama с досрочной остановкой.
+
+        Токены читаются по мере генерации; соединение закрывается (и Ollama прекращает генерацию),
+        как только готова первая строка ответа, либо исчерпан бюджет токенов или времени.
+        Ответ, оборванный до готовой строки (например, внутри <think>), — None: значение не найдено.
+        """
+        payload = dict(payload, stream=True)
+        payload["options"] = dict(payload.get("options", {}), num_predict=self.stream_max_tokens)
+
+        def send() -> Optional[str]:
+            started = time.monotonic()
+            deadline = started + self.stream_max_seconds
+            chunks: List[str] = []
+            tokens = 0
+            cut = False
+            # Таймаут чтения ограничивает ожидание первого токена; время генерации — deadline
+            with self._abortable(), \
+                    self.session.post(f"{self.base_url}/api/generate", json=payload, stream=True,
+                                      timeout=(10, self.stream_first_token_seconds)) as response:
+                check_response(response)
+                if response.status_code != 200:
+                    log(f"ОШИБКА Ollama: status={response.status_code}, body={response.text[:300]}")
+                    return None
+
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    if data.get("error"):
+                        log(f"ОШИБКА Ollama: {data['error']}")
+                        return None
+                    chunk = data.get("response", "")
+                    if not tokens:
+                        self._recording.first_token = time.monotonic() - started
+                        self.first_token_times.append(self._recording.first_token)
+                        deadline = time.monotonic() + self.stream_max_seconds
+                    chunks.append(chunk)
+                    tokens += 1
+                    if data.get("done"):
+                        break
+                    if ('\n' in chunk or '}' in chunk) and self.answer_complete(''.join(chunks), json_mode):
+                        break
+                    if tokens >= self.stream_max_tokens:
+                        log(f"  ⏱ Ответ прерван: достигнут предел {self.stream_max_tokens} токенов")
+                        cut = True
+                        break
+                    if time.monotonic() > deadline:
+                        log(f"  ⏱ Ответ прерван: превышено время генерации {self.stream_max_seconds} с")
+                        cut = True
+                        break
+            text = ''.join(chunks).strip()
+            # Из оборванного рассуждения строкой ответа стала бы первая строка <think>
+            if cut and not self.answer_complete(text, json_mode):
+                log("  ⏱ Ответ оборван до готовой строки ответа — значение не найдено")
+                return None
+            return text
+
+        return self._schedule(send, log)
+
+    def query_model(self, text: str, keywords: List[str], logger=None) -> str:
+        """Запрос к модели для поиска значений"""
+        keywords_str = ", ".join(keywords)
+        prompt = f"""Представь что ты робот-парсер твоя задача найти "{keywords_str}" в тексте: "{text}". Строжайше выводи только то значение которое у тебя запрашивают так как твои значения используются в программе и лишний текст будет ей мешать. """
+
+        raw_answer = self.generate(prompt, logger=logger, max_tokens=self.answer_tokens())
+        if raw_answer is None:
+            return "null"
+        cleaned_answer = self.clean_model_response(raw_answer)
+        return cleaned_answer if cleaned_answer else "null"
+
+    def parse_batch_response(self, response: Optional[str], count: int) -> List[Optional[str]]:
+        """Разбор JSON-ответа на пакетный запрос.
+
+        Для каждого поля возвращает очищенное значение, "null" если модель явно не нашла значение,
+        или None, если значение поля из ответа разобрать не удалось.
+        """
+        values: List[Optional[str]] = [None] * count
+        if not response:
+            return values
+
+        response = re.sub(r'<think>.*?</think>', '', response, flags=re.DOTALL)
+        start, end = response.find('{'), response.rfind('}')
+        if start == -1 or end <= start:
+            return values
+        try:
+            data = json.loads(response[start:end + 1])
+        except ValueError:
+            return values
+        if not isinstance(data, dict):
+            return values
+
+        for n in range(count):
+            key = str(n + 1)
+            if key not in data:
+                continue
+            value = data[key]
+            if value is None or (isinstance(value, str) and value.strip().lower() in ("", "null", "none")):
+                values[n] = "null"
+            elif isinstance(value, (str, int, float)):
+                values[n] = self.clean_model_response(str(value))
+        return values
+
+    def query_batch(self, text: str, fields: List[List[str]], logger=None) -> List[Optional[str]]:
+        """Один запрос к модели на несколько полей одного документа.
+
+        Возвращает значения в порядке fields; None — значение не удалось разобрать из ответа.
+        """
+        fields_str = "\n".join(f'{n}. "{", ".join(keywords)}"' for n, keywords in enumerate(fields, 1))
+        prompt = f"""Представь что ты робот-парсер твоя задача найти в тексте значения следующих полей:
+{fields_str}
+Текст: "{text}". Строжайше выводи только JSON-объект вида {{"1": "значение", "2": null}}, где ключ — номер поля, а значение — найденное значение или null, если его нет в тексте. Твой ответ разбирает программа, и лишний текст будет ей мешать. """
+
+        raw_answer = self.generate(prompt, logger=logger, max_tokens=self.answer_tokens(len(fields)), json_mode=True)
+        return self.parse_batch_response(raw_answer, len(fields))
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """Грубая оценка числа токенов текста (без токенизатора модели)"""
+        return int(len(text) / CHARS_PER_TOKEN) + 1
+
+    def answer_tokens(self, count: int = 1) -> int:
+        """Предел токенов ответа на запрос одного (count=1) или нескольких полей"""
+        return 500 if count == 1 else 200 + 150 * count
+
+    def text_budget(self, fields: List[List[str]]) -> int:
+        """Сколько символов текста документа помещается в один промпт с полями fields"""
+        answer = self.answer_tokens(len(fields))
+        if self.provider == "ollama" and self.stream:
+            answer = max(answer, self.stream_max_tokens)
+        keywords_tokens = sum(self.estimate_tokens(", ".join(keywords)) for keywords in fields)
+        tokens = self.context_tokens - answer - PROMPT_OVERHEAD_TOKENS - keywords_tokens
+        return max(CHUNK_MIN_CHARS, int(tokens * CHARS_PER_TOKEN))
+
+    def stop(self):
+        """Остановка провайдера (процесс Ollama) и закрытие HTTP-сессии"""
+        if self.response_cache is not None:
+            self.response_cache.flush()
+        if self.lifecycle is not None:
+            self.lifecycle.stop()
+        self.ollama_process = None
+        self.session.close()
 
 
 class DocumentProcessor:
     """Основной класс для обработки документов"""
 
-    def __init__(self, gui_log):
+    def __init__(self, gui_log, text_cache_max_bytes: int = TEXT_CACHE_MAX_BYTES,
+                 use_disk_cache: bool = True, extraction_workers: int = EXTRACTION_WORKERS,
+                 extraction_timeout: float = EXTRACTION_TIMEOUT, batch_fields: bool = BATCH_FIELDS,
+                 retrieval_max_chars: Optional[int] = RETRIEVAL_MAX_CHARS, use_rules: bool = True,
+                 incremental: bool = False, use_excel_labels: bool = True, pdf_lazy_pages: bool = True,
+                 collect_metrics: bool = False, resume: bool = False,
+                 item_deadline: Optional[float] = ITEM_DEADLINE, use_index: bool = True,
+                 embedding_model: Optional[str] = EMBEDDING_MODEL, locate_files: bool = True):
         self.extractor = DocumentExtractor()
         self.ai = None
         self.not_found_items = []
         self.gui_log = gui_log
+        # Один и тот же файл обычно указан у многих элементов — извлекаем его один раз за запуск
+        self.text_cache = TextCache(text_cache_max_bytes)
+        # Между запусками неизменённые документы берём из кэша на диске
+        self.extraction_cache = None
+        if use_disk_cache:
+            self.extraction_cache = ExtractionCache(
+                CACHE_DIR / 'extract', EXTRACTION_CACHE_MAX_BYTES, version=EXTRACTOR_VERSION
+            )
+        # Уникальные файлы извлекаются в пуле процессов (даже один файл — ради таймаута и изоляции
+        # падений); 0 — извлечение в этом процессе, без таймаута и защиты от зависших файлов
+        self.extraction_workers = extraction_workers
+        self.extraction_timeout = extraction_timeout
+        # Поля одного файла запрашиваются у модели одним промптом
+        self.batch_fields = batch_fields
+        self.batch_max_fields = BATCH_MAX_FIELDS
+        # В промпт идут только фрагменты вокруг ключевых слов (None — всегда весь текст)
+        self.retrieval_max_chars = retrieval_max_chars
+        # Фрагменты отбираются по индексу частей документа (BM25 и, если задана модель, эмбеддинги);
+        # индекс строится один раз на документ и хранится рядом с кэшем извлечения
+        self.use_index = use_index
+        self.embedding_model = embedding_model
+        self.index_cache = IndexCache(CACHE_DIR / 'index', INDEX_CACHE_MAX_BYTES) if use_disk_cache else None
+        self._indexes: "OrderedDict[str, ChunkIndex]" = OrderedDict()
+        self._index_locks: Dict[str, threading.Lock] = {}
+        self._index_guard = threading.Lock()
+        self._keyword_vectors: Dict[Tuple[str, Tuple[str, ...]], List[float]] = {}
+        self._embedding_failed = False
+        # ИНН, ОГРН, КПП, телефоны и банковские реквизиты сначала ищем регулярными выражениями
+        self.use_rules = use_rules
+        # Переобрабатывать только новые/изменённые/ненайденные элементы относительно прошлого data.json
+        self.incremental = incremental
+        # Значения из Excel по подписи в соседней ячейке без запроса к модели
+        self.use_excel_labels = use_excel_labels
+        self._excel_rows_cache: Dict[Path, List[Any]] = {}
+        # Большие PDF извлекаются только по страницам с ключевыми словами
+        self.pdf_lazy_pages = pdf_lazy_pages
+        # Корневая папка вместо root из config (задаётся из командной строки)
+        self.root: Optional[Path] = None
+        # Вызывается по готовности каждого элемента: on_result(индекс в config, результат)
+        self.on_result: Optional[Callable[[int, Dict[str, Any]], None]] = None
+        # Метрики элементов (result['metrics']) и сводка запуска рядом с data.json
+        self.collect_metrics = collect_metrics
+        self.run_summary: Optional[Dict[str, Any]] = None
+        self._file_metrics: Dict[Tuple[Path, str], Dict[str, Any]] = {}
+        # Готовые элементы сразу дописываются в data.checkpoint.jsonl; resume — продолжить прерванный
+        # запуск с той же конфигурацией, не обрабатывая заново уже готовые элементы
+        self.resume = resume
+        self.checkpoint: Optional[ResultCheckpoint] = None
+        # Предел времени на запрос значения к модели, с; поля одного пакетного запроса делят его
+        self.item_deadline = item_deadline
+        # Последний запуск остановлен (process_documents(cancel)) — результаты частичные
+        self.stopped = False
+        # Для элементов без файла (или с несуществующим файлом) документ ищется по индексу всех
+        # документов root; индекс обновляется после извлечения файлов элементов, пока модель отвечает по ним
+        self.locate_files = locate_files
+        self.locate_candidates = LOCATE_CANDIDATES
 
     def set_ai_interface(self, ai_interface: AIInterface):
         self.ai = ai_interface
@@ -317,32 +1142,514 @@ class DocumentProcessor:
         except Exception:
             return None
 
+    def _cached_text(self, file_path: Path, file_type: str) -> Optional[str]:
+        """Текст из кэша в памяти или на диске, если файл уже извлекался"""
+        cache_key = (str(file_path.resolve()), file_type)
+        text = self.text_cache.get(cache_key)
+        if text is None and self.extraction_cache is not None:
+            text = self.extraction_cache.get_text(file_path, file_type)
+            if text is not None:
+                self.text_cache.put(cache_key, text)
+        return text
+
+    def _store_text(self, file_path: Path, file_type: str, text: str):
+        """Сохраняет извлечённый текст в кэши"""
+        # Ошибки извлечения на диск не сохраняем — файл могут починить до следующего запуска
+        if self.extraction_cache is not None and text.strip() and not text.startswith("Ошибка при извлечении"):
+            self.extraction_cache.put_text(file_path, file_type, text)
+        # Ошибки извлечения в памяти кэшируем: повторная попытка в том же запуске даст тот же результат
+        self.text_cache.put((str(file_path.resolve()), file_type), text)
+
+    def _excel_rows(self, file_path: Path) -> List[Any]:
+        """Непустые ячейки книги с координатами.
+
+        Читаются один раз за запуск и хранятся в кэше извлечения рядом с текстом книги
+        (по тому же хешу содержимого), поэтому неизменённая книга повторно не разбирается.
+        """
+        if file_path not in self._excel_rows_cache:
+            rows: Optional[List[Any]] = None
+            cached = None
+            if self.extraction_cache is not None:
+                # Ячейки — служебная запись: в статистику кэша извлечения не входят
+                cached = self.extraction_cache.get_text(file_path, EXCEL_CELLS_TYPE, record=False)
+            if cached is not None:
+                try:
+                    rows = [(sheet, row, [(col, text) for col, text in cells])
+                            for sheet, row, cells in json.loads(cached)]
+                except (TypeError, ValueError):
+                    rows = None
+            if rows is None:
+                rows = []
+                try:
+                    if file_path.stat().st_size <= EXCEL_LABELS_MAX_BYTES:
+                        rows = list(DocumentExtractor.iter_excel_rows(file_path))
+                    if self.extraction_cache is not None:
+                        self.extraction_cache.put_text(file_path, EXCEL_CELLS_TYPE,
+                                                       json.dumps(rows, ensure_ascii=False))
+                except Exception as e:
+                    self.gui_log(f"  ⚠️ Не удалось прочитать ячейки {file_path.name}: {e}")
+            self._excel_rows_cache[file_path] = rows
+        return self._excel_rows_cache[file_path]
+
+    def _file_fingerprint(self, file_path: Path) -> Optional[str]:
+        """Отпечаток содержимого файла: хеш из кэша извлечения или размер и mtime"""
+        if self.extraction_cache is not None:
+            info = self.extraction_cache.fingerprint(file_path)
+            return info['sha256'] if info else None
+        try:
+            stat = file_path.stat()
+        except OSError:
+            return None
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def _load_previous_results(self) -> Dict[str, Dict[str, Any]]:
+        """Результаты прошлого запуска из data.json по наименованию данных"""
+        if not OUTPUT_FILE.exists():
+            return {}
+        try:
+            with OUTPUT_FILE.open('r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            self.gui_log(f"Не удалось загрузить прошлые результаты из {OUTPUT_FILE}: {e}")
+            return {}
+        if not isinstance(data, list):
+            return {}
+        return {r.get('data_name', ''): r for r in data if isinstance(r, dict)}
+
+    @staticmethod
+    def _is_unchanged(item: Dict[str, Any], prev: Optional[Dict[str, Any]], fingerprint: Optional[str]) -> bool:
+        """Можно ли перенести прошлый результат: найден, те же файл и ключевые слова, файл не изменился"""
+        return bool(
+            prev
+            and fingerprint
+            and prev.get('status') == 'found'
+            and prev.get('file') == item.get('file', '')
+            and prev.get('type') == item.get('type', '')
+            and prev.get('keywords') == item.get('keywords', [])
+            and prev.get('file_fingerprint') == fingerprint
+        )
+
     def extract_text_from_file(self, file_path: Path, file_type: str) -> str:
         """Извлечение текста из файла в зависимости от типа"""
         if not file_path.exists():
             self.gui_log(f"Файл не найден: {file_path}")
             return ""
 
-        if file_type == "word":
-            return self.extractor.extract_from_word(file_path)
-        elif file_type == "excel":
-            return self.extractor.extract_from_excel(file_path)
-        elif file_type == "pdf":
-            return self.extractor.extract_from_pdf(file_path)
+        text = self._cached_text(file_path, file_type)
+        if text is None:
+            if file_type not in SUPPORTED_TYPES:
+                self.gui_log(f"Неподдерживаемый тип файла: {file_type}")
+                return ""
+            text = extract_by_type(self.extractor, file_path, file_type)
+            self._store_text(file_path, file_type, text)
+        return DocumentExtractor.select_pdf_pages(text) if file_type == "pdf" else text
+
+    def _extraction_stage(self, files: List[Tuple[Path, str]],
+                          keywords: Optional[Dict[Tuple[Path, str], List[Tuple[str, ...]]]] = None,
+                          cancel: Optional[CancelToken] = None,
+                          metrics: bool = True) -> Iterator[Tuple[Path, str, str]]:
+        """Извлекает уникальные файлы и выдаёт (путь, тип, текст) по мере готовности.
+
+        PDF извлекается и кэшируется целиком, а выдаются только страницы с ключевыми словами
+        из keywords (DocumentExtractor.select_pdf_pages).
+        При отмене cancel поднимается Cancelled: процессы извлечения завершаются сразу,
+        а извлечение в этом процессе (extraction_workers=0) — после текущего файла.
+        metrics=False — файлы не попадают в метрики запуска (индексирование папки).
+        """
+        note = self._note_extraction if metrics else lambda *args, **kwargs: None
+        keywords = keywords or {}
+
+        def pages(file_path: Path, file_type: str, text: str) -> str:
+            if file_type != "pdf":
+                return text
+            keyword_sets = keywords.get((file_path, file_type)) if self.pdf_lazy_pages else None
+            return DocumentExtractor.select_pdf_pages(text, keyword_sets)
+
+        jobs = []
+        for file_path, file_type in files:
+            started = time.monotonic()
+            cached = self._cached_text(file_path, file_type)
+            if cached is not None:
+                note(file_path, file_type, time.monotonic() - started, cache_hit=True)
+                yield file_path, file_type, pages(file_path, file_type, cached)
+            elif file_type not in SUPPORTED_TYPES:
+                self.gui_log(f"Неподдерживаемый тип файла: {file_type}")
+                yield file_path, file_type, ""
+            else:
+                jobs.append((file_path, file_type))
+
+        if self.extraction_workers > 0 and jobs:
+            workers = min(self.extraction_workers, len(jobs))
+            self.gui_log(f"Извлечение текста из {len(jobs)} файлов в {workers} процессах...")
+            parallel_jobs = [(str(file_path), file_type) for file_path, file_type in jobs]
+            timings: Dict[Tuple[str, str], float] = {}
+            for path_str, file_type, text in extract_files_parallel(
+                    parallel_jobs, workers, self.extraction_timeout, self.extractor, timings, cancel):
+                file_path = Path(path_str)
+                note(file_path, file_type, timings.get((path_str, file_type)), cache_hit=False)
+                if text.startswith("Ошибка при извлечении"):
+                    self.gui_log(f"  ⚠️ {text}")
+                self._store_text(file_path, file_type, text)
+                yield file_path, file_type, pages(file_path, file_type, text)
         else:
-            self.gui_log(f"Неподдерживаемый тип файла: {file_type}")
-            return ""
+            for file_path, file_type in jobs:
+                if cancel is not None:
+                    cancel.check()
+                started = time.monotonic()
+                text = extract_by_type(self.extractor, file_path, file_type)
+                note(file_path, file_type, time.monotonic() - started, cache_hit=False)
+                self._store_text(file_path, file_type, text)
+                yield file_path, file_type, pages(file_path, file_type, text)
+
+    def _note_extraction(self, file_path: Path, file_type: str, seconds: Optional[float], cache_hit: bool):
+        if self.collect_metrics:
+            self._file_metrics[(file_path, file_type)] = {
+                'extraction_ms': round(seconds * 1000, 1) if seconds is not None else None,
+                'extraction_cache': 'hit' if cache_hit else 'miss',
+            }
 
-    def process_documents(self) -> List[Dict[str, Any]]:
-        """Основная функция обработки всех документов"""
-        # Сбрасываем список не найденных элементов перед запуском
+    @staticmethod
+    def _make_result(item: Dict[str, Any], value: str, status: str, reason: str = '',
+                     source: str = 'model', **extra: Any) -> Dict[str, Any]:
+        """Запись результата по элементу (одна запись на элемент).
+
+        source — откуда взято найденное значение: 'model' (нейросеть), 'rule' (правила)
+        или 'excel' (ячейка рядом с подписью в таблице).
+        """
+        result = {
+            'data_name': item.get('data_name', ''),
+            'file': item.get('file', ''),
+            'type': item.get('type', ''),
+            'keywords': item.get('keywords', []),
+            'extracted_value': value,
+            'status': status
+        }
+        if status == 'found':
+            result['source'] = source
+            result.update(extra)
+        elif reason:
+            result['reason'] = reason
+        return result
+
+    def _check_item(self, item: Dict[str, Any], text: str,
+                    log) -> Optional[Tuple[Dict[str, Any], Optional[Dict[str, Any]]]]:
+        """Проверки элемента до запроса к модели.
+
+        Возвращает (результат, запись для отчёта о ненайденных), если запрашивать модель не нужно.
+        """
+        data_name = item.get('data_name', '')
+        relative_file_path = item.get('file', '')
+        keywords = item.get('keywords', [])
+
+        if not text.strip() or text.startswith("Ошибка при извлечении"):
+            log(f"  ❌ Не удалось извлечь текст из: {relative_file_path}")
+            reason = 'Не удалось извлечь текст'
+            return self._make_result(item, "null", 'not_found', reason), {
+                'data_name': data_name,
+                'file': relative_file_path,
+                'reason': reason,
+                'keywords': keywords
+            }
+
+        if not keywords:
+            log(f"  ❌ Ключевые слова не указаны")
+            reason = 'Ключевые слова не указаны'
+            return self._make_result(item, "null", 'not_found', reason), {
+                'data_name': data_name,
+                'file': relative_file_path,
+                'reason': reason
+            }
+
+        return None
+
+    def _item_outcome(self, item: Dict[str, Any], ai_result: str,
+                      log) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        """Запись результата по ответу модели и запись для отчёта о ненайденных (или None)"""
+        if ai_result == "null" or not ai_result:
+            log(f"  ❌ Значение не найдено")
+            reason = 'Нейросеть не нашла значение'
+            return self._make_result(item, "null", 'not_found', reason), {
+                'data_name': item.get('data_name', ''),
+                'file': item.get('file', ''),
+                'keywords': item.get('keywords', []),
+                'reason': reason
+            }
+
+        log(f"  ✅ Найдено: {ai_result[:100]}...")
+        return self._make_result(item, ai_result, 'found'), None
+
+    def _query_group(self, relative_file_path: str, keys: List[Tuple[str, ...]], text: str,
+                     cancel: Optional[CancelToken] = None) -> Tuple[List[str], List[str], Dict[str, Any]]:
+        """Запрос значений для набора ключевых слов одного документа.
+
+        Выполняется в рабочем потоке, поэтому возвращает строки лога, а не пишет в gui_log.
+        Несколько полей запрашиваются одним промптом; поля, которые не удалось разобрать
+        из пакетного ответа, запрашиваются повторно по отдельности.
+        Третий элемент — метрики запросов группы (пустой словарь, если метрики не собираются).
+        При отмене cancel поднимается Cancelled.
+        """
+        lines: List[str] = []
+        values: List[Optional[str]] = [None] * len(keys)
+        calls: Optional[List[Dict[str, Any]]] = [] if self.collect_metrics else None
+        retries = 0
+        if len(keys) > 1:
+            lines.append(f"\n📦 Пакетный запрос: {len(keys)} полей из {relative_file_path}")
+            context = self._select_context(text, keys, lines.append)
+            fields = [list(k) for k in keys]
+            values = self._query_chunked(context, fields, lines.append,
+                                         lambda chunk: self.ai.query_batch(chunk, fields, logger=lines.append),
+                                         calls, cancel)
+
+        for n, keywords in enumerate(keys):
+            if values[n] is None:
+                if len(keys) > 1:
+                    lines.append(f"  ↻ Поле не разобрано из пакетного ответа, запрос отдельно: {list(keywords)}")
+                    retries += 1
+                context = self._select_context(text, [keywords], lines.append)
+                values[n] = self._query_chunked(
+                    context, [list(keywords)], lines.append,
+                    lambda chunk: [self.ai.query_model(chunk, list(keywords), logger=lines.append)],
+                    calls, cancel)[0] or "null"
+        return values, lines, self._group_metrics(calls, len(keys), retries) if calls is not None else {}
+
+    def _recorded(self, calls: Optional[List[Dict[str, Any]]], query, chunk: str,
+                  cancel: Optional[CancelToken] = None):
+        """query(chunk) с записью метрик запросов к модели в calls и отменой по cancel"""
+        if cancel is not None:
+            cancel.check()
+        recording = getattr(self.ai, 'recording', None)
+        with recording(calls) if calls is not None and recording else nullcontext(), \
+                self._cancellation(cancel):
+            return query(chunk)
+
+    def _cancellation(self, cancel: Optional[CancelToken]):
+        """Отмена запросов к модели из текущего потока токеном cancel (если AI это поддерживает)"""
+        cancellation = getattr(self.ai, 'cancellation', None)
+        return cancellation(cancel) if cancel is not None and cancellation else nullcontext()
+
+    @staticmethod
+    def _group_metrics(calls: List[Dict[str, Any]], fields: int, retries: int) -> Dict[str, Any]:
+        """Сводные метрики запросов группы полей (общие для всех её элементов).
+
+        retries — повторные запросы полей, не разобранных из пакетного ответа; к ним добавляются
+        повторы HTTP-запросов планировщиком.
+        """
+        first_tokens = [c['first_token_ms'] for c in calls if c.get('first_token_ms') is not None]
+        return {
+            'fields_in_prompt': fields,
+            'requests': len(calls),
+            'retries': retries + sum(c.get('retries', 0) for c in calls),
+            'response_cache_hits': sum(1 for c in calls if c.get('response_cache_hit')),
+            'prompt_chars': sum(c['prompt_chars'] for c in calls),
+            'prompt_tokens': sum(c['prompt_tokens'] for c in calls),
+            'model_ms': round(sum(c['model_ms'] for c in calls), 1),
+            'first_token_ms': first_tokens[0] if first_tokens else None,
+            'calls': calls,
+        }
+
+    def _query_chunked(self, text: str, fields: List[List[str]], log, query,
+                       calls: Optional[List[Dict[str, Any]]] = None,
+                       cancel: Optional[CancelToken] = None) -> List[Optional[str]]:
+        """query(текст) для всего текста или, если он не помещается в контекст модели, по частям.
+
+        Части с перекрытием запрашиваются параллельно, ответы по каждому полю сводятся
+        правилом CHUNK_REDUCE. Возвращает значения в порядке fields (None — не разобрано).
+        """
+        text_budget = getattr(self.ai, 'text_budget', None)
+        budget = text_budget(fields) if text_budget else None
+        if not budget or len(text) <= budget:
+            return self._recorded(calls, query, text, cancel)
+
+        chunks = split_chunks(text, budget, CHUNK_OVERLAP_CHARS)
+        log(f"  🧩 Текст не помещается в контекст модели (~{AIInterface.estimate_tokens(text)} токенов), "
+            f"запрос по {len(chunks)} частям")
+        workers = min(len(chunks), getattr(self.ai, 'max_concurrency', 1))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            answers = list(executor.map(lambda chunk: self._recorded(calls, query, chunk, cancel), chunks))
+        return [self._reduce_chunk_answers([answer[n] for answer in answers]) for n in range(len(fields))]
+
+    @staticmethod
+    def _reduce_chunk_answers(answers: List[Optional[str]], rule: str = CHUNK_REDUCE) -> Optional[str]:
+        """Сведение ответов частей документа по одному полю (в порядке частей).
+
+        "first" — первое найденное значение; "vote" — значение, найденное в большем числе частей
+        (при равенстве — раньше встретившееся). "null", если ни в одной части значения нет;
+        None, если ни один ответ не разобран.
+        """
+        found = [answer for answer in answers if answer is not None and answer != "null"]
+        if not found:
+            return "null" if any(answer == "null" for answer in answers) else None
+        if rule == "first":
+            return found[0]
+        counts: Dict[str, int] = {}
+        for answer in found:
+            key = ' '.join(answer.split()).lower()
+            counts[key] = counts.get(key, 0) + 1
+        best = max(counts.values())
+        return next(answer for answer in found if counts[' '.join(answer.split()).lower()] == best)
+
+    def _estimate_prompt_chars(self, files: Dict[Tuple[Path, str], List[int]], items: List[Dict[str, Any]],
+                               batch_size: int) -> Optional[int]:
+        """Наибольший ожидаемый объём текста документа в одном промпте, символов.
+
+        Длина текста берётся из кэша извлечения (измерена при прошлом запуске), а для файлов,
+        которых там нет, — предел отбора фрагментов. None — оценить нельзя.
+        """
+        largest = 0
+        for (file_path, file_type), indices in files.items():
+            fields = min(batch_size, len({tuple(items[i].get('keywords', [])) for i in indices}))
+            bound = self.retrieval_max_chars * fields if self.retrieval_max_chars else None
+            size = None
+            if self.extraction_cache is not None:
+                size = self.extraction_cache.text_size(file_path, file_type)
+            known = [value for value in (size, bound) if value is not None]
+            if not known:
+                return None
+            largest = max(largest, min(known))
+        return largest
+
+    def _select_context(self, text: str, keys: List[Tuple[str, ...]], log) -> str:
+        """Фрагменты текста вокруг ключевых слов в пределах бюджета; весь текст, если фрагментов нет"""
+        if not self.retrieval_max_chars or len(text) <= self.retrieval_max_chars * len(keys):
+            return text
+        if self.use_index:
+            index = self._document_index(text, log)
+            model = self.embedding_model if self.embedding_model in index.vectors else None
+            vectors = self._query_vectors(keys, model, log) if model else None
+            context = select_chunks(text, index, keys, self.retrieval_max_chars, INDEX_TOP_K, vectors,
+                                    model if vectors else None)
+        else:
+            context = select_windows(text, keys, self.retrieval_max_chars, radius=RETRIEVAL_RADIUS)
+        if not context:
+            log(f"  ⚠️ Ключевые слова в тексте не найдены, отправляется весь текст")
+            return text
+        log(f"  ✂️ В промпт отобрано {len(context)} из {len(text)} символов")
+        return context
+
+    def _embed(self, texts: List[str], log) -> Optional[List[List[float]]]:
+        """Эмбеддинги моделью embedding_model; после первой ошибки в запуске больше не запрашиваются"""
+        embed = getattr(self.ai, 'embed', None)
+        if not self.embedding_model or embed is None or self._embedding_failed:
+            return None
+        vectors = embed(texts, self.embedding_model, logger=log)
+        if vectors is None:
+            self._embedding_failed = True
+            log(f"  ⚠️ Эмбеддинги {self.embedding_model} недоступны, части отбираются только по BM25")
+        return vectors
+
+    def _document_index(self, text: str, log) -> ChunkIndex:
+        """Индекс частей текста: из памяти, из кэша на диске или построенный заново.
+
+        Один документ индексируется один раз, даже если его поля запрашиваются параллельно.
+        """
+        text_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        with self._index_guard:
+            lock = self._index_locks.setdefault(text_hash, threading.Lock())
+        with lock:
+            with self._index_guard:
+                index = self._indexes.get(text_hash)
+                if index is not None:
+                    self._indexes.move_to_end(text_hash)
+            if index is not None and (not self.embedding_model or self._embedding_failed
+                                      or self.embedding_model in index.vectors):
+                return index
+
+            changed = False
+            disk_key = None
+            if self.index_cache is not None:
+                disk_key = self.index_cache.key(text_hash, INDEX_VERSION, chunk=INDEX_CHUNK_CHARS,
+                                                overlap=INDEX_CHUNK_OVERLAP)
+            if index is None and disk_key is not None:
+                stored = self.index_cache.get_index(disk_key)
+                index = ChunkIndex.from_dict(stored) if stored is not None else None
+            if index is None:
+                index = ChunkIndex.build(text)
+                changed = True
+            if self.embedding_model and self.embedding_model not in index.vectors:
+                vectors = self._embed(index.chunk_texts(text), log)
+                if vectors is not None:
+                    index.set_vectors(self.embedding_model, vectors)
+                    changed = True
+            if changed and disk_key is not None:
+                self.index_cache.put_index(disk_key, index.to_dict(), chunks=len(index.spans))
+
+            with self._index_guard:
+                self._indexes[text_hash] = index
+                while len(self._indexes) > INDEX_MEMORY_ENTRIES:
+                    evicted, _ = self._indexes.popitem(last=False)
+                    self._index_locks.pop(evicted, None)
+            return index
+
+    def _query_vectors(self, keys: List[Tuple[str, ...]], model: str, log) -> Optional[List[List[float]]]:
+        """Эмбеддинги ключевых фраз (запрашиваются один раз за запуск на фразу)"""
+        missing = [k for k in dict.fromkeys(keys) if (model, k) not in self._keyword_vectors]
+        if missing:
+            vectors = self._embed([", ".join(k) for k in missing], log)
+            if vectors is None:
+                return None
+            for k, vector in zip(missing, vectors):
+                self._keyword_vectors[(model, k)] = vector
+        return [self._keyword_vectors[(model, k)] for k in keys]
+
+    def _update_corpus(self, root_path: Path, cancel: Optional[CancelToken] = None) -> CorpusIndex:
+        """Индекс всех документов root: с диска, с извлечением только новых и изменённых файлов.
+
+        Вызывается после извлечения файлов элементов: их тексты берутся из кэша извлечения,
+        поэтому повторно не разбираются. При отмене сохраняется то, что успели проиндексировать.
+        """
+        path = corpus_file_for(CACHE_DIR / 'corpus', root_path) if self.extraction_cache is not None else None
+        corpus = CorpusIndex(path, root_path).load()
+        changed, removed = corpus.scan()
+        if changed:
+            self.gui_log(f"🗂 Индексирование документов папки: {len(changed)} новых или изменённых файлов...")
+            relative = {(file_path, file_type): name for name, file_path, file_type in changed}
+            try:
+                for file_path, file_type, text in self._extraction_stage(list(relative), None, cancel, metrics=False):
+                    corpus.add(relative[(file_path, file_type)], file_path, file_type, text)
+            finally:
+                corpus.save()
+        elif removed:
+            corpus.save()
+        self.gui_log(f"🗂 Индекс документов папки: {len(corpus)} файлов "
+                     f"(обновлено {len(changed)}, удалено {removed})")
+        return corpus
+
+    def process_documents(self, cancel: Optional[CancelToken] = None) -> List[Dict[str, Any]]:
+        """Основная функция обработки всех документов.
+
+        После cancel.cancel() извлечение и запросы к модели прерываются (выполняющиеся
+        HTTP-запросы обрываются), а необработанные элементы возвращаются как ненайденные
+        с причиной «Обработка остановлена»; self.stopped становится True.
+        Если файл элемента не указан или не существует, значение ищется в лучших по индексу папки
+        документах (search_corpus); документ, из которого оно взято, — в result['located_file'].
+        """
+        cancel = cancel if cancel is not None else CancelToken()
+        self.stopped = False
+        # Сбрасываем список не найденных элементов и кэш текстов перед запуском
         self.not_found_items = []
+        self.text_cache.clear()
+        self._excel_rows_cache.clear()
+        self._file_metrics.clear()
+        self._indexes.clear()
+        self._index_locks.clear()
+        self._keyword_vectors.clear()
+        self._embedding_failed = False
+        self.run_summary = None
+        if self.checkpoint is not None:
+            self.checkpoint.close()
+            self.checkpoint = None
+        run_started = time.monotonic()
+        started_at = datetime.datetime.now().isoformat(timespec='seconds')
+        if self.extraction_cache is not None:
+            self.extraction_cache.reset_stats()
+        if getattr(self.ai, 'response_cache', None) is not None:
+            self.ai.response_cache.reset_stats()
 
         config = self.load_config()
         if not config:
             return []
 
-        root_value = config.get('root', '')
+        root_value = self.root or config.get('root', '')
         if not root_value:
             self.gui_log("В конфигурации не указан корневой путь 'root'")
             return []
@@ -357,99 +1664,454 @@ class DocumentProcessor:
             self.gui_log("AI интерфейс не установлен")
             return []
 
-        results = []
         items = config.get('items', [])
+        results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        not_found: Dict[int, Dict[str, Any]] = {}
+        # Элементы группируются по файлу: каждый файл извлекается один раз
+        files: Dict[Tuple[Path, str], List[int]] = {}
+        fingerprints: Dict[Path, Optional[str]] = {}
+        previous = self._load_previous_results() if self.incremental else {}
+        carried = 0
+
+        # Контрольная точка привязана к конфигурации: после её изменения запуск начинается заново
+        self.checkpoint = ResultCheckpoint(checkpoint_file_for(OUTPUT_FILE), config_fingerprint(root_value, items))
+        restored: Dict[int, Dict[str, Any]] = {}
+        if self.resume:
+            loaded = self.checkpoint.load()
+            if loaded is None and self.checkpoint.path.exists():
+                self.gui_log(f"Контрольная точка {self.checkpoint.path} записана для другой конфигурации — "
+                             f"обработка начнётся заново")
+            restored = loaded or {}
+        try:
+            self.checkpoint.open(resume=bool(restored))
+        except OSError as e:
+            self.gui_log(f"Не удалось открыть контрольную точку {self.checkpoint.path}: {e}")
+            self.checkpoint = None
+        resumed = 0
+
+        run_calls: List[Dict[str, Any]] = []
+        run_groups: List[Dict[str, Any]] = []
+
+        def finish(i: int, result: Dict[str, Any], file_key: Optional[Tuple[Path, str]] = None,
+                   group: Optional[Dict[str, Any]] = None, record: bool = True):
+            # Отпечаток исходного файла нужен для инкрементального запуска и продолжения после сбоя
+            if file_key is not None and fingerprints.get(file_key[0]):
+                result['file_fingerprint'] = fingerprints[file_key[0]]
+            if self.collect_metrics:
+                metrics = dict(self._file_metrics.get(file_key, {}))
+                metrics.update(group or {})
+                result['metrics'] = metrics
+            results[i] = result
+            if record and self.checkpoint is not None:
+                try:
+                    self.checkpoint.append(i, result)
+                except OSError as e:
+                    self.gui_log(f"Не удалось записать контрольную точку, запись отключена: {e}")
+                    self.checkpoint.close()
+                    self.checkpoint = None
+            if self.on_result:
+                self.on_result(i, result)
 
         self.gui_log(f"Обработка {len(items)} элементов...")
 
-        for i, item in enumerate(items, 1):
-            data_name = item.get('data_name', '')
-            relative_file_path = item.get('file', '')
-            file_type = item.get('type', '')
-            keywords = item.get('keywords', [])
+        def reuse(i: int, item: Dict[str, Any], source: Path) -> bool:
+            """Перенос готового результата, если исходный файл source не менялся"""
+            nonlocal resumed, carried
+            if source not in fingerprints:
+                fingerprints[source] = self._file_fingerprint(source)
+            done = restored.get(i)
+            if done and fingerprints[source] and done.get('file_fingerprint') == fingerprints[source]:
+                # Продолжение после сбоя: элемент уже готов в контрольной точке, файл не менялся
+                restored_result = dict(done)
+                restored_result.pop('metrics', None)
+                finish(i, restored_result, record=False)
+                if restored_result.get('status') != 'found':
+                    not_found[i] = {
+                        'data_name': item.get('data_name', ''),
+                        'file': item.get('file', ''),
+                        'reason': restored_result.get('reason', ''),
+                        'keywords': item.get('keywords', [])
+                    }
+                resumed += 1
+                return True
+            prev = previous.get(item.get('data_name', ''))
+            if self._is_unchanged(item, prev, fingerprints[source]):
+                # Инкрементальный режим: элемент и исходный файл не менялись — переносим результат
+                carried_result = dict(prev)
+                # Метрики прошлого запуска к этому не относятся
+                carried_result.pop('metrics', None)
+                finish(i, carried_result)
+                carried += 1
+                return True
+            return False
 
-            self.gui_log(f"\n[{i}/{len(items)}] Обработка: {data_name}")
+        def located_source(result: Optional[Dict[str, Any]]) -> Optional[Path]:
+            """Файл, найденный по индексу документов в прошлом запуске, если он ещё существует"""
+            located = result.get('located_file') if result else None
+            path = self._safe_join_under_root(root_path, located) if located else None
+            return path if path is not None and path.is_file() else None
 
+        # Элементы без файла, для которых документ ищется по индексу документов папки
+        unlocated: List[int] = []
+        for i, item in enumerate(items):
+            relative_file_path = item.get('file', '')
             full_file_path = None
             if relative_file_path:
                 full_file_path = self._safe_join_under_root(root_path, relative_file_path)
-                if full_file_path is None:
-                    self.gui_log(f"  ❌ Недопустимый путь (вылазка за root): {relative_file_path}")
-            else:
+
+            if full_file_path and full_file_path.exists() and full_file_path.is_file():
+                if not reuse(i, item, full_file_path):
+                    files.setdefault((full_file_path, item.get('type', '')), []).append(i)
+                continue
+
+            if self.locate_files and item.get('keywords') and (not relative_file_path or full_file_path):
+                sources = [located_source(restored.get(i)), located_source(previous.get(item.get('data_name', '')))]
+                if not any(source and reuse(i, item, source) for source in dict.fromkeys(sources)):
+                    unlocated.append(i)
+                continue
+
+            self.gui_log(f"\n[{i + 1}/{len(items)}] Обработка: {item.get('data_name', '')}")
+            if not relative_file_path:
                 self.gui_log(f"  ❌ Файл не указан")
+            elif full_file_path is None:
+                self.gui_log(f"  ❌ Недопустимый путь (вылазка за root): {relative_file_path}")
+            reason = 'Файл не указан или не найден'
+            finish(i, self._make_result(item, "null", 'not_found', reason))
+            not_found[i] = {
+                'data_name': item.get('data_name', ''),
+                'file': relative_file_path,
+                'reason': reason,
+                'keywords': item.get('keywords', [])
+            }
 
-            status = 'not_found'
-            ai_result = "null"
-            reason = ''
-
-            if not full_file_path or not (full_file_path.exists() and full_file_path.is_file()):
-                reason = 'Файл не указан или не найден'
-                self.not_found_items.append({
-                    'data_name': data_name,
-                    'file': relative_file_path,
-                    'reason': reason,
-                    'keywords': keywords
-                })
-            else:
-                text = self.extract_text_from_file(full_file_path, file_type)
-                if not text.strip() or text.startswith("Ошибка при извлечении"):
-                    self.gui_log(f"  ❌ Не удалось извлечь текст из: {relative_file_path}")
-                    reason = 'Не удалось извлечь текст'
-                    self.not_found_items.append({
-                        'data_name': data_name,
-                        'file': relative_file_path,
+        if unlocated:
+            self.gui_log(f"🗂 Файл не указан или не найден у {len(unlocated)} элементов — "
+                         f"документы для них будут найдены по индексу папки")
+        # Элемент -> кандидаты (путь, тип) в порядке убывания оценки, их относительные пути и ответы по ним
+        locating: Dict[int, Dict[str, Any]] = {}
+
+        def log_item(i: int):
+            self.gui_log(f"\n[{i + 1}/{len(items)}] Обработка: {items[i].get('data_name', '')}")
+
+        def settle(i: int, result: Dict[str, Any], missing: Optional[Dict[str, Any]],
+                   file_key: Tuple[Path, str], group: Optional[Dict[str, Any]] = None):
+            attempt = locating.get(i)
+            if attempt is None:
+                finish(i, result, file_key, group)
+                if missing:
+                    not_found[i] = missing
+                return
+            # Элемент без файла: берём значение из лучшего по индексу документа, в котором оно найдено
+            if results[i] is not None:
+                return
+            attempt['outcomes'][file_key] = (result, missing, group)
+            for key in attempt['candidates']:
+                if key not in attempt['outcomes']:
+                    # Ждём ответа по документу с большей оценкой
+                    return
+                result, missing, group = attempt['outcomes'][key]
+                if result.get('status') == 'found':
+                    result['located_file'] = attempt['names'][key]
+                    self.gui_log(f"  📂 {items[i].get('data_name', '')}: значение взято из {attempt['names'][key]}")
+                    finish(i, result, key, group)
+                    return
+            names = ', '.join(attempt['names'][key] for key in attempt['candidates'])
+            reason = f'Значение не найдено в подходящих документах: {names}'
+            self.gui_log(f"  ❌ {items[i].get('data_name', '')}: {reason}")
+            finish(i, self._make_result(items[i], "null", 'not_found', reason))
+            not_found[i] = {
+                'data_name': items[i].get('data_name', ''),
+                'file': items[i].get('file', ''),
+                'keywords': items[i].get('keywords', []),
+                'reason': reason
+            }
+
+        def locate(corpus: Optional[CorpusIndex]) -> Dict[Tuple[Path, str], List[int]]:
+            """Кандидаты из индекса документов для элементов без файла: (путь, тип) -> элементы"""
+            candidate_files: Dict[Tuple[Path, str], List[int]] = {}
+            for i in unlocated:
+                candidates = []
+                names = {}
+                found = corpus.search(items[i].get('keywords', []), self.locate_candidates) if corpus is not None else []
+                for name, file_type, score in found:
+                    file_path = self._safe_join_under_root(root_path, name)
+                    if file_path is None or not file_path.is_file():
+                        continue
+                    if file_path not in fingerprints:
+                        fingerprints[file_path] = self._file_fingerprint(file_path)
+                    candidates.append((file_path, file_type))
+                    names[(file_path, file_type)] = name
+                    candidate_files.setdefault((file_path, file_type), []).append(i)
+                log_item(i)
+                if not candidates:
+                    self.gui_log(f"  ❌ Файл не указан или не найден, подходящих документов в папке нет")
+                    reason = 'Файл не указан или не найден'
+                    finish(i, self._make_result(items[i], "null", 'not_found', reason))
+                    not_found[i] = {
+                        'data_name': items[i].get('data_name', ''),
+                        'file': items[i].get('file', ''),
                         'reason': reason,
-                        'keywords': keywords
-                    })
+                        'keywords': items[i].get('keywords', [])
+                    }
+                    continue
+                self.gui_log(f"  🗂 Файл не указан или не найден, кандидаты по индексу документов: "
+                             f"{', '.join(names.values())}")
+                locating[i] = {'candidates': candidates, 'names': names, 'outcomes': {}}
+            return candidate_files
+
+        def fail_group(keys: List[Tuple[str, ...]], queries: Dict[Tuple[str, ...], List[int]],
+                       file_key: Tuple[Path, str], reason: str, mark: str):
+            for keywords in keys:
+                for i in queries[keywords]:
+                    log_item(i)
+                    self.gui_log(f"  {mark} {reason}")
+                    settle(i, self._make_result(items[i], "null", 'not_found', reason), {
+                        'data_name': items[i].get('data_name', ''),
+                        'file': items[i].get('file', ''),
+                        'keywords': items[i].get('keywords', []),
+                        'reason': reason
+                    }, file_key)
+
+        def collect(future, queries: Dict[Tuple[str, ...], List[int]], file_key: Tuple[Path, str],
+                    keys: List[Tuple[str, ...]]):
+            try:
+                keys, values, lines, group = future.result()
+            except Cancelled:
+                raise
+            except Exception as e:
+                # Ошибка одной группы (индекс, выбор контекста, разбор ответа) не останавливает запуск
+                fail_group(keys, queries, file_key, f'Ошибка при запросе к модели: {e}', "❌")
+                return
+            if values is None:
+                # Истёк предел времени группы
+                fail_group(keys, queries, file_key,
+                           f'Превышен предел времени на запрос к модели ({self.item_deadline:g} с)', "⏱")
+                return
+            if group:
+                run_calls.extend(group.pop('calls'))
+                run_groups.append(group)
+            # Строки группы выводятся вместе, не перемешиваясь с параллельными
+            for line in lines:
+                self.gui_log(line)
+            for keywords, value in zip(keys, values):
+                for i in queries[keywords]:
+                    log_item(i)
+                    self.gui_log(f"  🔍 Поиск ключевых слов: {list(keywords)}")
+                    result, missing = self._item_outcome(items[i], value, self.gui_log)
+                    settle(i, result, missing, file_key, group)
+
+        def run_group(relative_file_path: str, keys: List[Tuple[str, ...]], text: str):
+            # Предел времени отсчитывается с начала запросов группы, а не с постановки в очередь
+            with cancel.child(self.item_deadline) as token:
+                try:
+                    values, lines, group = self._query_group(relative_file_path, keys, text, token)
+                except Cancelled:
+                    if cancel.cancelled:
+                        raise
+                    return keys, None, [], {}
+            return keys, values, lines, group
+
+        # Файлы обрабатываются в порядке готовности извлечения, запросы к модели идут параллельно,
+        # результаты — в порядке config
+        concurrency = max(1, getattr(self.ai, 'max_concurrency', 1))
+        batch_size = self.batch_max_fields if self.batch_fields else 1
+        # Для PDF передаём ключевые слова элементов: из текста берутся только нужные страницы
+        file_keywords = {
+            key: sorted({tuple(items[i].get('keywords', [])) for i in indices if items[i].get('keywords')})
+            for key, indices in files.items() if key[1] == "pdf"
+        }
+        pending: Dict[Any, Tuple[Dict[Tuple[str, ...], List[int]], Tuple[Path, str], List[Tuple[str, ...]]]] = {}
+
+        def handle_file(pool, file_path: Path, file_type: str, text: str, indices: List[int],
+                        relative_file_path: str):
+            # Одинаковые пары (файл, ключевые слова) запрашиваются один раз
+            queries: Dict[Tuple[str, ...], List[int]] = {}
+            for i in indices:
+                lines: List[str] = []
+                checked = self._check_item(items[i], text, lines.append)
+                if checked:
+                    log_item(i)
+                    for line in lines:
+                        self.gui_log(line)
+                    settle(i, *checked, (file_path, file_type))
+                    continue
+
+                # В таблицах Excel значение обычно стоит в ячейке рядом с подписью; ячейки проверяем
+                # раньше правил — подпись в таблице точнее указывает, чей это реквизит
+                cell_hit = None
+                if self.use_excel_labels and file_type == 'excel':
+                    cell_hit = resolve_excel_label(self._excel_rows(file_path), items[i].get('keywords', []))
+                if cell_hit and cell_hit[1] >= EXCEL_LABEL_CONFIDENCE:
+                    value, confidence, cell = cell_hit
+                    log_item(i)
+                    self.gui_log(f"  ⚡ Найдено в ячейке {cell} (уверенность {confidence:.2f}) "
+                                 f"без запроса к модели: {value[:100]}")
+                    settle(i, self._make_result(items[i], value, 'found', source='excel',
+                                                cell=cell, confidence=confidence), None, (file_path, file_type))
+                    continue
+
+                # Реквизиты с известным форматом находим правилами, модель — только если они не сработали
+                rule_hit = None
+                if self.use_rules:
+                    rule_hit = apply_rules(items[i].get('data_name', ''), items[i].get('keywords', []), text)
+                if rule_hit:
+                    rule_name, value = rule_hit
+                    log_item(i)
+                    self.gui_log(f"  ⚡ Найдено правилом ({rule_name}) без запроса к модели: {value}")
+                    settle(i, self._make_result(items[i], value, 'found', source='rule', rule=rule_name), None,
+                           (file_path, file_type))
                 else:
-                    if keywords:
-                        self.gui_log(f"  🔍 Поиск ключевых слов: {keywords}")
-                        ai_result = self.ai.query_model(text, keywords, logger=self.gui_log)
-                        if ai_result == "null" or not ai_result:
-                            self.gui_log(f"  ❌ Значение не найдено")
-                            reason = 'Нейросеть не нашла значение'
-                            self.not_found_items.append({
-                                'data_name': data_name,
-                                'file': relative_file_path,
-                                'keywords': keywords,
-                                'reason': reason
-                            })
-                        else:
-                            self.gui_log(f"  ✅ Найдено: {ai_result[:100]}...")
-                            status = 'found'
-                    else:
-                        self.gui_log(f"  ❌ Ключевые слова не указаны")
-                        reason = 'Ключевые слова не указаны'
-                        self.not_found_items.append({
-                            'data_name': data_name,
-                            'file': relative_file_path,
-                            'reason': reason
-                        })
-
-            # Сохраняем результат по элементу (одна запись на элемент)
-            result = {
-                'data_name': data_name,
-                'file': relative_file_path,
-                'type': file_type,
-                'keywords': keywords,
-                'extracted_value': ai_result,
-                'status': status
-            }
-            if status != 'found' and reason:
-                result['reason'] = reason
-            results.append(result)
+                    queries.setdefault(tuple(items[i].get('keywords', [])), []).append(i)
+            # Файл больше не встретится в этом проходе
+            self._excel_rows_cache.pop(file_path, None)
+
+            keys = list(queries)
+            for start in range(0, len(keys), batch_size):
+                group_keys = keys[start:start + batch_size]
+                future = pool.submit(run_group, relative_file_path, group_keys, text)
+                pending[future] = (queries, (file_path, file_type), group_keys)
+
+            for future in [f for f in pending if f.done()]:
+                collect(future, *pending.pop(future))
 
+        try:
+            # Модель загружается заранее с окном контекста по размерам документов
+            prepare = getattr(self.ai, 'prepare', None)
+            if prepare and (files or unlocated):
+                with self._cancellation(cancel):
+                    prepare(self._estimate_prompt_chars(files, items, batch_size) if files else None,
+                            logger=self.gui_log)
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                with closing(self._extraction_stage(list(files), file_keywords, cancel)) as stage:
+                    for file_path, file_type, text in stage:
+                        cancel.check()
+                        indices = files[(file_path, file_type)]
+                        handle_file(pool, file_path, file_type, text, indices, items[indices[0]].get('file', ''))
+
+                if unlocated:
+                    # Индекс папки обновляется, пока модель отвечает по уже извлечённым файлам.
+                    # Файлы элементов к этому времени в кэше извлечения и повторно не извлекаются
+                    try:
+                        corpus = self._update_corpus(root_path, cancel)
+                    except Exception as e:
+                        self.gui_log(f"⚠️ Не удалось построить индекс документов папки: {e}")
+                        corpus = None
+                    candidate_files = locate(corpus)
+                    # Кандидаты извлекаются целиком: их тексты уже в кэше после индексирования
+                    names = {key: attempt['names'][key] for attempt in locating.values() for key in attempt['names']}
+                    with closing(self._extraction_stage(list(candidate_files), None, cancel)) as stage:
+                        for file_path, file_type, text in stage:
+                            cancel.check()
+                            handle_file(pool, file_path, file_type, text, candidate_files[(file_path, file_type)],
+                                        names[(file_path, file_type)])
+
+                for future in as_completed(list(pending)):
+                    cancel.check()
+                    collect(future, *pending.pop(future))
+        except Cancelled:
+            self.stopped = True
+            # Группы, успевшие получить ответ до остановки, сохраняем
+            for future, (queries, file_key, keys) in pending.items():
+                if future.done() and not future.cancelled() and future.exception() is None:
+                    collect(future, queries, file_key, keys)
+            reason = 'Обработка остановлена'
+            for i, result in enumerate(results):
+                if result is None:
+                    # В контрольную точку не пишем: при продолжении запуска элемент обработается
+                    finish(i, self._make_result(items[i], "null", 'not_found', reason), record=False)
+                    not_found[i] = {
+                        'data_name': items[i].get('data_name', ''),
+                        'file': items[i].get('file', ''),
+                        'keywords': items[i].get('keywords', []),
+                        'reason': reason
+                    }
+            done = sum(1 for r in results if r.get('reason') != reason)
+            self.gui_log(f"\n⏹ Обработка остановлена: готово {done} из {len(items)} элементов")
+
+        if resumed:
+            self.gui_log(f"\n⏯ Восстановлено из {checkpoint_file_for(OUTPUT_FILE)}: {resumed} элементов")
+        if carried:
+            self.gui_log(f"\n♻️ Перенесено из {OUTPUT_FILE} без изменений: {carried} элементов")
+        if self.checkpoint is not None:
+            self.checkpoint.close()
+
+        if self.extraction_cache is not None:
+            self.extraction_cache.flush()
+        if self.index_cache is not None:
+            self.index_cache.flush()
+        if getattr(self.ai, 'response_cache', None) is not None:
+            self.ai.response_cache.flush()
+
+        self.not_found_items = [not_found[i] for i in sorted(not_found)]
+        if self.collect_metrics:
+            self.run_summary = self._run_summary(results, run_groups, run_calls, carried, started_at,
+                                                 time.monotonic() - run_started)
         # ВНИМАНИЕ: больше не добавляем self.not_found_items в results повторно — дубликатов не будет
         return results
 
+    def _run_summary(self, results: List[Dict[str, Any]], groups: List[Dict[str, Any]],
+                     calls: List[Dict[str, Any]], carried: int, started_at: str, seconds: float) -> Dict[str, Any]:
+        """Сводка запуска: итоги и перцентили времени извлечения и запросов к модели"""
+        files = list(self._file_metrics.values())
+        extraction_ms = [m['extraction_ms'] for m in files if m.get('extraction_ms') is not None]
+        sources: Dict[str, int] = {}
+        for r in results:
+            if r.get('status') == 'found':
+                sources[r.get('source', 'model')] = sources.get(r.get('source', 'model'), 0) + 1
+        return {
+            'started': started_at,
+            'seconds': round(seconds, 2),
+            'items': len(results),
+            'found': sum(1 for r in results if r.get('status') == 'found'),
+            'found_by_source': sources,
+            'carried_forward': carried,
+            'items_per_second': round(len(results) / seconds, 2) if seconds > 0 else None,
+            'extraction': {
+                'files': len(files),
+                'cache_hits': sum(1 for m in files if m.get('extraction_cache') == 'hit'),
+                'cache_misses': sum(1 for m in files if m.get('extraction_cache') == 'miss'),
+                'total_ms': round(sum(extraction_ms), 1),
+                'ms': percentiles(extraction_ms),
+            },
+            'model': {
+                'provider': getattr(self.ai, 'provider', None),
+                'model': getattr(self.ai, 'model', None),
+                'concurrency': getattr(self.ai, 'max_concurrency', None),
+                'requests': len(calls),
+                'errors': sum(1 for c in calls if c.get('error')),
+                'response_cache_hits': sum(1 for c in calls if c.get('response_cache_hit')),
+                'retries': sum(group.get('retries', 0) for group in groups),
+                'prompt_chars': sum(c['prompt_chars'] for c in calls),
+                'prompt_tokens': sum(c['prompt_tokens'] for c in calls),
+                'latency_ms': percentiles([c['model_ms'] for c in calls]),
+                'first_token_ms': percentiles([c['first_token_ms'] for c in calls
+                                               if c.get('first_token_ms') is not None]),
+            },
+        }
+
     def save_results(self, results: List[Dict[str, Any]]):
-        """Сохранение результатов в JSON файл"""
+        """Сохранение результатов в JSON файл (и сводки метрик рядом, если она собрана)"""
         try:
-            with OUTPUT_FILE.open('w', encoding='utf-8') as f:
-                json.dump(results, f, ensure_ascii=False, indent=4)
+            write_json_atomic(OUTPUT_FILE, results, ensure_ascii=False, indent=4)
             self.gui_log(f"\n✅ Результаты сохранены в {OUTPUT_FILE}")
         except Exception as e:
             self.gui_log(f"❌ Ошибка при сохранении результатов: {e}")
+        else:
+            if self.stopped and self.checkpoint is not None:
+                self.gui_log(f"⏯ Готовые элементы остались в {self.checkpoint.path}: "
+                             f"запуск можно продолжить с того же места")
+            elif self.checkpoint is not None:
+                # Результаты сохранены целиком — контрольная точка запуска больше не нужна
+                self.checkpoint.remove()
+                self.checkpoint = None
+
+        if self.run_summary is not None:
+            summary_file = metrics_file_for(OUTPUT_FILE)
+            try:
+                write_json_atomic(summary_file, self.run_summary, ensure_ascii=False, indent=4)
+                self.gui_log(f"📈 Сводка метрик сохранена в {summary_file}")
+            except Exception as e:
+                self.gui_log(f"❌ Ошибка при сохранении метрик: {e}")
 
     def print_report(self, results: List[Dict[str, Any]]):
         """Вывод отчета о результатах"""
@@ -463,6 +2125,31 @@ class DocumentProcessor:
         self.gui_log(f"Всего обработано: {total}")
         self.gui_log(f"Найдено значений: {found}")
         self.gui_log(f"Не найдено значений: {not_found}")
+        by_rules = sum(1 for r in results if r.get('source') == 'rule')
+        if by_rules:
+            self.gui_log(f"Найдено правилами без запроса к модели: {by_rules}")
+        by_cells = sum(1 for r in results if r.get('source') == 'excel')
+        if by_cells:
+            self.gui_log(f"Найдено по ячейкам Excel без запроса к модели: {by_cells}")
+        located = sum(1 for r in results if r.get('located_file'))
+        if located:
+            self.gui_log(f"Найдено в документах, подобранных по индексу папки: {located}")
+        if self.extraction_cache is not None:
+            self.gui_log(f"Кэш извлечения: попаданий {self.extraction_cache.hits}, "
+                         f"промахов {self.extraction_cache.misses}")
+        response_cache = getattr(self.ai, 'response_cache', None)
+        if response_cache is not None:
+            self.gui_log(f"Кэш ответов модели: попаданий {response_cache.hits}, "
+                         f"промахов {response_cache.misses}")
+        scheduler = getattr(self.ai, 'scheduler', None)
+        if scheduler is not None and scheduler.retries:
+            self.gui_log(f"Повторов запросов к модели: {scheduler.retries} "
+                         f"(из-за ограничения частоты: {scheduler.throttled})")
+        first_token_times = getattr(self.ai, 'first_token_times', None)
+        if first_token_times:
+            self.gui_log(f"Время до первого токена: первый запрос {first_token_times[0]:.1f} с, "
+                         f"среднее {sum(first_token_times) / len(first_token_times):.1f} с, "
+                         f"максимум {max(first_token_times):.1f} с")
 
         if self.not_found_items:
             self.gui_log(f"\n❌ НЕ НАЙДЕННЫЕ ЗНАЧЕНИЯ ({len(self.not_found_items)}):")
@@ -482,9 +2169,14 @@ class GUIApp:
     def __init__(self):
         self.root = tk.Tk()
         self.root.title("Document AI Parser")
-        self.root.geometry("700x550")
+        self.root.geometry("700x800")
 
+        # Лог пишут рабочие потоки, а в окно его выводит только поток Tk (см. _drain_log)
+        self.log = QueuedLog(LOG_FILE)
         self.processor = DocumentProcessor(self.print_to_log)
+        self.cancel_token: Optional[CancelToken] = None
+        self.worker: Optional[threading.Thread] = None
+        self.closing = False
 
         # Выбор провайдера
         ttk.Label(self.root, text="Выберите AI-провайдера:").pack(pady=10)
@@ -506,17 +2198,56 @@ class GUIApp:
         self.model_var = tk.StringVar()
         ttk.Entry(self.root, textvariable=self.model_var).pack(fill='x', padx=10)
 
+        # Модель эмбеддингов для отбора фрагментов по смыслу (только Ollama)
+        ttk.Label(self.root, text="Модель эмбеддингов Ollama (опционально, например bge-m3):").pack(pady=5)
+        self.embedding_model_var = tk.StringVar(value=EMBEDDING_MODEL or "")
+        ttk.Entry(self.root, textvariable=self.embedding_model_var).pack(fill='x', padx=10)
+
+        # Число одновременных запросов к модели
+        ttk.Label(self.root, text="Параллельных запросов к модели:").pack(pady=5)
+        self.concurrency_var = tk.IntVar(value=AI_CONCURRENCY)
+        ttk.Spinbox(self.root, from_=1, to=32, textvariable=self.concurrency_var, width=5).pack()
+
+        self.batch_var = tk.BooleanVar(value=BATCH_FIELDS)
+        ttk.Checkbutton(self.root, text="Запрашивать поля одного файла одним запросом",
+                        variable=self.batch_var).pack(pady=5)
+
+        self.incremental_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.root, text="Только новые и изменённые элементы (инкрементально)",
+                        variable=self.incremental_var).pack()
+
+        self.resume_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.root, text="Продолжить прерванный запуск (data.checkpoint.jsonl)",
+                        variable=self.resume_var).pack(pady=(5, 0))
+
+        self.locate_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(self.root, text="Искать документ по индексу папки, если файл не указан или не найден",
+                        variable=self.locate_var).pack()
+
+        self.metrics_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.root, text="Сохранять метрики времени (data.metrics.json)",
+                        variable=self.metrics_var).pack(pady=5)
+
         # Устанавливаем модель по умолчанию для начального провайдера
         self.update_default_model()
 
-        # Кнопка запуска
-        self.start_button = ttk.Button(self.root, text="Запустить обработку", command=self.start_processing)
-        self.start_button.pack(pady=20)
+        # Кнопки запуска, остановки и сброса кэша ответов модели
+        buttons = ttk.Frame(self.root)
+        buttons.pack(pady=20)
+        self.start_button = ttk.Button(buttons, text="Запустить обработку", command=self.start_processing)
+        self.start_button.pack(side='left', padx=5)
+        self.stop_button = ttk.Button(buttons, text="Остановить", command=self.stop_processing, state='disabled')
+        self.stop_button.pack(side='left', padx=5)
+        self.clear_cache_button = ttk.Button(buttons, text="Очистить кэш ответов",
+                                             command=self.clear_response_cache)
+        self.clear_cache_button.pack(side='left', padx=5)
 
         # Область логов
         self.log_text = scrolledtext.ScrolledText(self.root, height=20, width=85)
         self.log_text.pack(pady=10, padx=10, fill='both', expand=True)
 
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
+        self.root.after(LOG_POLL_MS, self._drain_log)
         self.root.mainloop()
 
     def update_default_model(self):
@@ -532,25 +2263,110 @@ class GUIApp:
             self.model_var.set(default_model)
 
     def print_to_log(self, text: str):
-        """Вывод в лог GUI"""
+        """Вывод в лог GUI (из любого потока: строка выводится при следующем проходе _drain_log)"""
+        self.log.write(text)
+
+    def _drain_log(self):
+        """Вывод накопившихся строк лога одной вставкой; окно хранит не больше LOG_MAX_LINES строк"""
+        lines = self.log.drain()
+        if lines:
+            try:
+                # Прокручиваем вниз, только если пользователь не листает лог выше
+                follow = self.log_text.yview()[1] >= 1.0
+                self.log_text.insert(tk.END, "\n".join(lines) + "\n")
+                total = int(self.log_text.index('end-1c').split('.')[0])
+                if total > LOG_MAX_LINES:
+                    self.log_text.delete('1.0', f'{total - LOG_MAX_LINES}.0')
+                if follow:
+                    self.log_text.see(tk.END)
+            except tk.TclError:
+                # На случай, если GUI уже закрыт
+                return
+        self.root.after(1 if self.log.pending() else LOG_POLL_MS, self._drain_log)
+
+    def close(self):
+        """Закрытие окна: обработка останавливается, остаток лога дописывается в файл.
+
+        Поток обработки — фоновый (daemon), и после destroy() интерпретатор завершился бы,
+        не дав ему сохранить готовые результаты. Поэтому окно закрывается только после того,
+        как поток отменён и закончил save_results; до тех пор цикл Tk продолжает работать.
+        """
+        if self.closing:
+            return
+        self.closing = True
+        if self.worker is not None and self.worker.is_alive():
+            self.print_to_log("⏹ Остановка обработки и сохранение результатов перед закрытием...")
+            self.cancel_token.cancel()
+            self.start_button.config(state='disabled')
+            self.stop_button.config(state='disabled')
+        self._close_when_finished()
+
+    def _close_when_finished(self):
+        if self.worker is not None and self.worker.is_alive():
+            self.root.after(LOG_POLL_MS, self._close_when_finished)
+            return
+        self.log.close()
+        self.root.destroy()
+
+    def clear_response_cache(self):
+        """Сброс кэша ответов модели: следующий запуск заново опросит модель по всем элементам"""
+        if str(self.start_button['state']) == 'disabled':
+            self.print_to_log("Кэш ответов нельзя очистить во время обработки")
+            return
         try:
-            self.log_text.insert(tk.END, text + "\n")
-            self.log_text.see(tk.END)
-            self.root.update_idletasks()
-        except Exception:
-            # На случай, если GUI уже закрыт
-            pass
+            cache = ResponseCache(CACHE_DIR / 'responses', RESPONSE_CACHE_MAX_BYTES)
+            count = len(cache)
+            cache.clear()
+            self.print_to_log(f"🗑 Кэш ответов модели очищен (записей: {count})")
+        except Exception as e:
+            self.print_to_log(f"❌ Не удалось очистить кэш ответов: {e}")
 
     def start_processing(self):
         """Запуск обработки в отдельном потоке"""
         self.start_button.config(state='disabled')
-        threading.Thread(target=self.run_processing, daemon=True).start()
+        self.cancel_token = CancelToken()
+        self.stop_button.config(state='normal')
+        self.worker = threading.Thread(target=self._processing_thread, daemon=True)
+        self.worker.start()
+
+    def _processing_thread(self):
+        try:
+            self.run_processing()
+        finally:
+            # Виджеты Tk меняются только из главного потока
+            self._on_tk_thread(self._processing_finished)
+
+    def _processing_finished(self):
+        self.start_button.config(state='normal')
+        self.stop_button.config(state='disabled')
+
+    def _on_tk_thread(self, callback, *args):
+        """Выполнение callback в главном потоке Tk (вызывается из потока обработки)"""
+        try:
+            self.root.after(0, callback, *args)
+        except (RuntimeError, tk.TclError):
+            # На случай, если GUI уже закрыт
+            pass
+
+    def _show_error(self, message: str):
+        self._on_tk_thread(messagebox.showerror, "Ошибка", message)
+
+    def stop_processing(self):
+        """Остановка обработки: готовые результаты сохраняются, запросы к модели обрываются"""
+        if self.cancel_token is not None and not self.cancel_token.cancelled:
+            self.print_to_log("⏹ Остановка обработки...")
+            self.cancel_token.cancel()
+        self.stop_button.config(state='disabled')
 
     def run_processing(self):
         """Логика обработки"""
         provider = self.provider_var.get()
         api_key = None
         model = self.model_var.get() or None
+        try:
+            concurrency = max(1, int(self.concurrency_var.get()))
+        except (tk.TclError, ValueError):
+            concurrency = AI_CONCURRENCY
         ai = None
 
         if provider == "openrouter":
@@ -558,11 +2374,7 @@ class GUIApp:
             if not API_KEY_FILE.exists():
                 msg = f"Файл {API_KEY_FILE} не найден. Создайте его с API-ключом."
                 self.print_to_log(f"Ошибка: {msg}")
-                try:
-                    messagebox.showerror("Ошибка", msg)
-                except Exception:
-                    pass
-                self.start_button.config(state='normal')
+                self._show_error(msg)
                 return
 
             try:
@@ -571,52 +2383,46 @@ class GUIApp:
                 if not api_key:
                     msg = f"Файл {API_KEY_FILE} пустой. Добавьте API-ключ."
                     self.print_to_log(f"Ошибка: {msg}")
-                    try:
-                        messagebox.showerror("Ошибка", msg)
-                    except Exception:
-                        pass
-                    self.start_button.config(state='normal')
+                    self._show_error(msg)
                     return
             except Exception as e:
                 msg = f"Не удалось прочитать {API_KEY_FILE}: {str(e)}"
                 self.print_to_log(msg)
-                try:
-                    messagebox.showerror("Ошибка", msg)
-                except Exception:
-                    pass
-                self.start_button.config(state='normal')
+                self._show_error(msg)
                 return
 
         try:
-            ai = AIInterface(provider=provider, api_key=api_key, model=model)
+            ai = AIInterface(provider=provider, api_key=api_key, model=model, max_concurrency=concurrency)
             if not ai.start(logger=self.print_to_log):
                 self.print_to_log("Не удалось запустить AI-провайдера")
-                try:
-                    messagebox.showerror("Ошибка", "Не удалось запустить AI-провайдера")
-                except Exception:
-                    pass
-                self.start_button.config(state='normal')
+                self._show_error("Не удалось запустить AI-провайдера")
                 return
 
             self.processor.set_ai_interface(ai)
+            self.processor.batch_fields = self.batch_var.get()
+            self.processor.incremental = self.incremental_var.get()
+            self.processor.resume = self.resume_var.get()
+            self.processor.embedding_model = self.embedding_model_var.get().strip() or None
+            self.processor.locate_files = self.locate_var.get()
+            self.processor.collect_metrics = self.metrics_var.get()
             self.print_to_log("🚀 Запуск обработки...")
 
-            results = self.processor.process_documents()
+            results = self.processor.process_documents(self.cancel_token)
             self.processor.save_results(results)
             self.processor.print_report(results)
 
-            self.print_to_log("✅ Обработка завершена")
+            if self.processor.stopped:
+                self.print_to_log("⏹ Обработка остановлена, готовые результаты сохранены")
+            else:
+                self.print_to_log("✅ Обработка завершена")
         except Exception as e:
             self.print_to_log(f"❌ Ошибка: {str(e)}")
-            try:
-                messagebox.showerror("Ошибка", str(e))
-            except Exception:
-                pass
+            self._show_error(str(e))
         finally:
             if ai:
                 ai.stop()
-            self.start_button.config(state='normal')
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     GUIApp()
@@ -0,0 +1,439 @@
+# search_bench.py
+"""Офлайн-бенчмарк конвейера поиска (search.py) без живой Ollama или OpenRouter.
+
+Состоит из трёх частей:
+- generate_corpus — синтетический проект из DOCX/XLSX/PDF с config.json и известными ответами;
+- MockLLMServer — локальный HTTP-сервер, отвечающий по протоколам Ollama (/api/generate, /api/tags)
+  и OpenRouter (/chat/completions) с настраиваемой задержкой; значения он берёт из текста промпта;
+- run_benchmark — прогон DocumentProcessor: элементов в секунду, скорость извлечения, пиковая память.
+
+Пример:
+    python search_bench.py --files 60 --pages 20 --latency 0.2 --concurrency 4 --provider ollama
+"""
+
+import argparse
+import json
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+try:
+    import resource  # Только Unix: пиковая память дочерних процессов извлечения
+except ImportError:
+    resource = None
+
+try:
+    import psutil  # Необязательно: память процесса и дочерних процессов на любой ОС, в том числе Windows
+except ImportError:
+    psutil = None
+
+import docx
+import fitz  # PyMuPDF
+from openpyxl import Workbook
+
+import search
+from search import EXTRACTION_WORKERS, AIInterface, DocumentProcessor, extract_files_parallel
+
+# Поля синтетических документов: подпись (она же ключевые слова) и генератор значения
+FIELDS = [
+    ("Наименование организации", lambda rnd, n: f"ООО «Объект {n}»"),
+    ("Юридический адрес", lambda rnd, n: f"г. Москва, ул. Строителей, д. {rnd.randint(1, 200)}"),
+    ("Генеральный директор", lambda rnd, n: f"{rnd.choice(['Иванов', 'Петров', 'Сидоров'])} "
+                                            f"{rnd.choice('АБВГД')}.{rnd.choice('ЕЖЗИК')}."),
+    ("Номер договора", lambda rnd, n: f"{n}-{rnd.randint(100, 999)}/П"),
+    ("Дата договора", lambda rnd, n: f"{rnd.randint(1, 28):02d}.{rnd.randint(1, 12):02d}.2024"),
+    ("Объект строительства", lambda rnd, n: f"Жилой дом корпус {rnd.randint(1, 30)}"),
+]
+FILLER = ("Стороны обязуются выполнять условия настоящего договора добросовестно и в установленные сроки. "
+          "Приёмка работ оформляется актом, подписанным уполномоченными представителями сторон.")
+FILE_TYPES = ("word", "excel", "pdf")
+SUFFIXES = {"word": ".docx", "excel": ".xlsx", "pdf": ".pdf"}
+
+
+def generate_corpus(directory: Path, files: int = 30, fields_per_file: int = 4, pages: int = 5,
+                    types=FILE_TYPES, seed: int = 1) -> Dict[str, Any]:
+    """Создаёт проект directory/project с документами и directory/config.json.
+
+    pages — объём документа: страницы PDF, а для DOCX/XLSX столько же блоков текста-заполнителя.
+    Возвращает {'config': путь, 'root': путь, 'expected': {data_name: значение}}.
+    """
+    rnd = random.Random(seed)
+    root = Path(directory, "project")
+    root.mkdir(parents=True, exist_ok=True)
+    items = []
+    expected = {}
+    for n in range(files):
+        file_type = types[n % len(types)]
+        name = f"{file_type}_{n:04d}{SUFFIXES[file_type]}"
+        values = [(label, make(rnd, n)) for label, make in rnd.sample(FIELDS, min(fields_per_file, len(FIELDS)))]
+        # Значения разбросаны по документу, а не собраны в начале
+        positions = sorted(rnd.sample(range(pages), len(values))) if pages >= len(values) else [0] * len(values)
+        blocks: List[List[str]] = [[FILLER] * 6 for _ in range(pages)]
+        for (label, value), page in zip(values, positions):
+            blocks[page].insert(rnd.randint(0, len(blocks[page])), f"{label}: {value}")
+        _write_document(root / name, file_type, blocks)
+        for label, value in values:
+            data_name = f"{label} ({name})"
+            items.append({"data_name": data_name, "file": name, "type": file_type, "keywords": [label.lower()]})
+            expected[data_name] = value
+
+    config_path = Path(directory, "config.json")
+    config_path.write_text(json.dumps({"root": str(root), "items": items}, ensure_ascii=False, indent=4),
+                           encoding='utf-8')
+    return {'config': config_path, 'root': root, 'expected': expected}
+
+
+def _write_document(path: Path, file_type: str, blocks: List[List[str]]):
+    if file_type == "word":
+        document = docx.Document()
+        for block in blocks:
+            for line in block:
+                document.add_paragraph(line)
+        document.save(path)
+    elif file_type == "excel":
+        workbook = Workbook()
+        sheet = workbook.active
+        for block in blocks:
+            for line in block:
+                label, sep, value = line.partition(": ")
+                sheet.append([label, value] if sep else [line])
+        workbook.save(path)
+    else:
+        font = fitz.Font("cjk")
+        with fitz.open() as doc:
+            for block in blocks:
+                page = doc.new_page()
+                writer = fitz.TextWriter(page.rect)
+                writer.fill_textbox(fitz.Rect(50, 50, page.rect.width - 50, page.rect.height - 50),
+                                    "\n".join(block), font=font, fontsize=10)
+                writer.write_text(page)
+            # Встраиваем только использованные символы шрифта, иначе каждый файл весит мегабайты
+            doc.subset_fonts()
+            doc.save(path, garbage=3, deflate=True)
+
+
+def answer_from_prompt(prompt: str) -> str:
+    """Ответ «идеальной модели»: значение после подписи в тексте промпта (JSON для пакетного запроса)"""
+    def lookup(keywords: str) -> Optional[str]:
+        match = re.search(re.escape(keywords) + r'\s*[:|]\s*([^\n|"]+)', prompt, re.IGNORECASE)
+        return match.group(1).strip() if match else None
+
+    fields = re.findall(r'^(\d+)\. "(.+)"$', prompt, re.MULTILINE)
+    if fields:
+        return json.dumps({number: lookup(keywords) for number, keywords in fields}, ensure_ascii=False)
+    single = re.search(r'найти "(.+?)" в тексте', prompt)
+    value = lookup(single.group(1)) if single else None
+    return value if value else "null"
+
+
+class MockLLMServer:
+    """Локальная замена Ollama и OpenRouter с задержкой latency до первого токена и token_delay на токен"""
+
+    def __init__(self, latency: float = 0.0, token_delay: float = 0.0, host: str = '127.0.0.1', port: int = 0):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/').endswith('/api/tags'):
+                    self._json({"models": [{"name": "mock:latest"}]})
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                with server._lock:
+                    server.requests += 1
+                if self.path.endswith('/api/generate'):
+                    answer = answer_from_prompt(payload.get('prompt', ''))
+                    if payload.get('stream', True):
+                        self._stream(answer)
+                    else:
+                        time.sleep(server.latency + server.token_delay * len(server._tokens(answer)))
+                        self._json({"response": answer, "done": True})
+                elif self.path.endswith('/chat/completions'):
+                    messages = payload.get('messages') or [{}]
+                    answer = answer_from_prompt(messages[-1].get('content', ''))
+                    time.sleep(server.latency + server.token_delay * len(server._tokens(answer)))
+                    self._json({"choices": [{"message": {"role": "assistant", "content": answer}}]})
+                else:
+                    self.send_error(404)
+
+            def _json(self, data: Dict[str, Any]):
+                body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _stream(self, answer: str):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.end_headers()
+                time.sleep(server.latency)
+                try:
+                    for token in server._tokens(answer + "\n"):
+                        self.wfile.write(json.dumps({"response": token, "done": False},
+                                                    ensure_ascii=False).encode('utf-8') + b"\n")
+                        self.wfile.flush()
+                        if server.token_delay:
+                            time.sleep(server.token_delay)
+                    self.wfile.write(b'{"response": "", "done": true}\n')
+                except (BrokenPipeError, ConnectionResetError):
+                    # Клиент закрыл поток, получив готовый ответ
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    @staticmethod
+    def _tokens(text: str) -> List[str]:
+        return [text[i:i + 4] for i in range(0, len(text), 4)] or [""]
+
+    def start(self) -> 'MockLLMServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+PROC_STATM = '/proc/self/statm'
+
+
+def rss_source() -> Optional[str]:
+    """Чем измеряется резидентная память: psutil (любая ОС), procfs (только Linux) или None"""
+    if psutil is not None:
+        return 'psutil'
+    if Path(PROC_STATM).exists():
+        return 'procfs'
+    return None
+
+
+class RssSampler:
+    """Пиковая резидентная память процесса (и дочерних процессов при psutil) за время работы"""
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.source = rss_source()
+        self.peak = 0
+        self.child_peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._page = resource.getpagesize() if resource is not None else 4096
+        self._process = psutil.Process() if self.source == 'psutil' else None
+
+    def _sample(self) -> Optional[int]:
+        if self._process is not None:
+            try:
+                children = 0
+                for child in self._process.children(recursive=True):
+                    try:
+                        children += child.memory_info().rss
+                    except psutil.Error:
+                        pass  # процесс пула уже завершился
+                self.child_peak = max(self.child_peak, children)
+                return self._process.memory_info().rss
+            except psutil.Error:
+                return None
+        try:
+            with open(PROC_STATM) as f:
+                return int(f.read().split()[1]) * self._page
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = self._sample()
+            if rss is None:
+                return
+            self.peak = max(self.peak, rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    @property
+    def peak_mb(self) -> Optional[float]:
+        return round(self.peak / 1024 / 1024, 1) if self.peak else None
+
+    @property
+    def child_peak_mb(self) -> Optional[float]:
+        """Пик суммарной памяти дочерних процессов; getrusage точнее, но есть только в Unix"""
+        if resource is not None:
+            # ru_maxrss в килобайтах (Linux)
+            return round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+        return round(self.child_peak / 1024 / 1024, 1) if self.child_peak else None
+
+
+def benchmark_extraction(corpus: Dict[str, Any], workers: int = EXTRACTION_WORKERS) -> Dict[str, Any]:
+    """Скорость извлечения текста из всех файлов корпуса (без кэшей и модели)"""
+    config = json.loads(Path(corpus['config']).read_text(encoding='utf-8'))
+    jobs = sorted({(str(Path(corpus['root'], item['file'])), item['type']) for item in config['items']})
+    source_bytes = sum(Path(path).stat().st_size for path, _ in jobs)
+    started = time.perf_counter()
+    chars = sum(len(text) for _, _, text in extract_files_parallel(jobs, workers, search.EXTRACTION_TIMEOUT))
+    seconds = time.perf_counter() - started
+    return {
+        'files': len(jobs),
+        'seconds': round(seconds, 3),
+        'files_per_second': round(len(jobs) / seconds, 2),
+        'source_mb_per_second': round(source_bytes / 1024 / 1024 / seconds, 2),
+        'chars_per_second': int(chars / seconds),
+    }
+
+
+def run_benchmark(corpus: Dict[str, Any], server: MockLLMServer, provider: str = "ollama",
+                  concurrency: int = search.AI_CONCURRENCY, workers: int = EXTRACTION_WORKERS,
+                  batch_fields: bool = True, cache_dir: Optional[Path] = None, trace_memory: bool = False,
+                  log=None) -> Dict[str, Any]:
+    """Полный прогон DocumentProcessor по корпусу с моделью-заглушкой.
+
+    Кэши извлечения и ответов создаются в cache_dir (по умолчанию — во временном каталоге),
+    поэтому прогон всегда «холодный», если не передать один и тот же cache_dir повторно.
+    trace_memory включает tracemalloc (пик памяти Python-объектов); он замедляет разбор
+    текста в разы, поэтому время такого прогона с обычным не сравнивают. Если резидентную
+    память измерить нечем (Windows без psutil), tracemalloc включается сам, а memory_source
+    в отчёте перечисляет использованные способы измерения.
+    """
+    old_paths = search.CONFIG_FILE, search.OUTPUT_FILE, search.CACHE_DIR
+    temp_dir = tempfile.mkdtemp()
+    search.CONFIG_FILE = Path(corpus['config'])
+    search.OUTPUT_FILE = Path(temp_dir, "data.json")
+    search.CACHE_DIR = Path(cache_dir) if cache_dir else Path(temp_dir, "cache")
+    ai = None
+    try:
+        # У заглушки нет лимита частоты — ограничиваем только числом одновременных запросов
+        ai = AIInterface(provider=provider, api_key="bench", model="mock", max_concurrency=concurrency,
+                         requests_per_minute=0)
+        ai.base_url = server.url if provider == "ollama" else f"{server.url}/api/v1"
+        if not ai.start(logger=log):
+            raise RuntimeError("Заглушка модели не отвечает")
+        processor = DocumentProcessor(log or (lambda msg: None), extraction_workers=workers,
+                                      batch_fields=batch_fields, collect_metrics=True)
+        processor.set_ai_interface(ai)
+
+        requests_before = server.requests
+        peak = None
+        trace_memory = trace_memory or rss_source() is None
+        if trace_memory:
+            tracemalloc.start()
+        with RssSampler() as rss:
+            started = time.perf_counter()
+            results = processor.process_documents()
+            seconds = time.perf_counter() - started
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    finally:
+        if ai:
+            ai.stop()
+        search.CONFIG_FILE, search.OUTPUT_FILE, search.CACHE_DIR = old_paths
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    expected = corpus['expected']
+    correct = sum(1 for r in results if expected.get(r['data_name']) == r['extracted_value'])
+    summary = processor.run_summary or {}
+    return {
+        'provider': provider,
+        'items': len(results),
+        'seconds': round(seconds, 3),
+        'items_per_second': round(len(results) / seconds, 2) if seconds else None,
+        'found': sum(1 for r in results if r['status'] == 'found'),
+        'correct': correct,
+        'found_by_source': summary.get('found_by_source'),
+        'model_requests': server.requests - requests_before,
+        'model_latency_ms': summary.get('model', {}).get('latency_ms'),
+        'extraction_ms': summary.get('extraction', {}).get('ms'),
+        'peak_rss_mb': rss.peak_mb,
+        'peak_child_rss_mb': rss.child_peak_mb,
+        'peak_python_mb': round(peak / 1024 / 1024, 1) if peak is not None else None,
+        'memory_source': [source for source in (rss.source, 'tracemalloc' if trace_memory else None) if source],
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк конвейера поиска с моделью-заглушкой")
+    parser.add_argument("--files", type=int, default=30, help="число документов в корпусе")
+    parser.add_argument("--fields", type=int, default=4, help="полей (элементов config) на документ")
+    parser.add_argument("--pages", type=int, default=5, help="объём документа в страницах")
+    parser.add_argument("--types", default=",".join(FILE_TYPES), help="типы файлов через запятую")
+    parser.add_argument("--provider", choices=("ollama", "openrouter"), default="ollama")
+    parser.add_argument("--latency", type=float, default=0.1, help="задержка модели до первого токена, с")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="задержка на каждый токен ответа, с")
+    parser.add_argument("--concurrency", type=int, default=search.AI_CONCURRENCY)
+    parser.add_argument("--workers", type=int, default=EXTRACTION_WORKERS, help="процессов извлечения")
+    parser.add_argument("--no-batch", action="store_true")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="пик памяти Python-объектов через tracemalloc (замедляет прогон)")
+    parser.add_argument("--keep", type=Path, help="сохранить корпус в этот каталог")
+    parser.add_argument("--json", action="store_true", help="вывести результат одной строкой JSON")
+    args = parser.parse_args(argv)
+
+    directory = args.keep or Path(tempfile.mkdtemp())
+    try:
+        started = time.perf_counter()
+        corpus = generate_corpus(directory, args.files, args.fields, args.pages,
+                                 tuple(t.strip() for t in args.types.split(',') if t.strip()))
+        generated = time.perf_counter() - started
+        with MockLLMServer(args.latency, args.token_delay) as server:
+            report = {
+                'corpus': {'files': args.files, 'items': len(corpus['expected']), 'pages': args.pages,
+                           'generated_seconds': round(generated, 2)},
+                'extraction': benchmark_extraction(corpus, args.workers),
+                'pipeline': run_benchmark(corpus, server, args.provider, args.concurrency, args.workers,
+                                          batch_fields=not args.no_batch, trace_memory=args.trace_memory),
+            }
+    finally:
+        if args.keep is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+        return
+    for section, values in report.items():
+        print(f"[{section}]")
+        for key, value in values.items():
+            print(f"  {key}: {value}")
+
+
+if __name__ == "__main__":
+    import multiprocessing
+    multiprocessing.freeze_support()
+    main()
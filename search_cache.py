@@ -0,0 +1,343 @@
+# search_cache.py
+"""Кэши для конвейера поиска (search.py)"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Hashable, Optional
+
+
+class TextCache:
+    """LRU-кэш извлечённого текста в пределах одного запуска с ограничением по памяти"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size_of(text: str) -> int:
+        return sys.getsizeof(text)
+
+    def get(self, key: Hashable) -> Optional[str]:
+        with self._lock:
+            text = self._entries.get(key)
+            if text is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return text
+
+    def put(self, key: Hashable, text: str):
+        size = self._size_of(text)
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._size_of(self._entries.pop(key))
+            # Текст больше всего бюджета не кэшируем, чтобы не вытеснять остальное
+            if size > self.max_bytes:
+                return
+            self._entries[key] = text
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= self._size_of(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+
+class DiskCache:
+    """Каталог со сжатыми (zlib) записями и индексом index.json, ограниченный по размеру (LRU).
+
+    Индекс пишется на диск не при каждой записи, а раз в FLUSH_EVERY записей и в flush()
+    в конце запуска.
+    """
+
+    INDEX_NAME = 'index.json'
+    FLUSH_EVERY = 64
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._unflushed_puts = 0
+        self._index: Dict[str, Dict[str, Any]] = self._load_index()
+        self.current_bytes = sum(meta.get('bytes', 0) for meta in self._index.values())
+
+    def _load_index(self) -> Dict[str, Dict[str, Any]]:
+        index_path = self.directory / self.INDEX_NAME
+        if not index_path.exists():
+            return {}
+        try:
+            with index_path.open('r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except Exception:
+            # Повреждённый индекс не должен ломать запуск — начинаем с пустого
+            return {}
+
+    def _entry_path(self, key: str) -> Path:
+        return self.directory / f"{key}.z"
+
+    def get(self, key: str, record: bool = True) -> Optional[str]:
+        """Запись по ключу; record=False — не учитывать обращение в hits/misses"""
+        with self._lock:
+            meta = self._index.get(key)
+            path = self._entry_path(key)
+            if meta is None or not path.exists():
+                self.misses += record
+                return None
+            try:
+                text = zlib.decompress(path.read_bytes()).decode('utf-8')
+            except Exception:
+                self._remove(key)
+                self.misses += record
+                return None
+            meta['used'] = time.time()
+            self._dirty = True
+            self.hits += record
+            return text
+
+    def put(self, key: str, text: str, **meta: Any):
+        data = zlib.compress(text.encode('utf-8'), 6)
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                self._entry_path(key).write_bytes(data)
+            except OSError:
+                return
+            old = self._index.get(key)
+            if old is not None:
+                self.current_bytes -= old.get('bytes', 0)
+            self._index[key] = dict(meta, bytes=len(data), used=time.time())
+            self.current_bytes += len(data)
+            self._evict()
+            self._dirty = True
+            self._unflushed_puts += 1
+            if self._unflushed_puts >= self.FLUSH_EVERY:
+                self.flush()
+
+    def _remove(self, key: str):
+        meta = self._index.pop(key, None)
+        if meta is not None:
+            self.current_bytes -= meta.get('bytes', 0)
+        try:
+            self._entry_path(key).unlink()
+        except OSError:
+            pass
+        self._dirty = True
+
+    def _evict(self):
+        if self.current_bytes <= self.max_bytes:
+            return
+        for key, _ in sorted(self._index.items(), key=lambda kv: kv[1].get('used', 0)):
+            if self.current_bytes <= self.max_bytes:
+                break
+            self._remove(key)
+
+    def flush(self):
+        """Сохраняет индекс на диск (время последнего обращения для LRU)"""
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                tmp_path = self.directory / (self.INDEX_NAME + '.tmp')
+                with tmp_path.open('w', encoding='utf-8') as f:
+                    json.dump(self._index, f, ensure_ascii=False)
+                os.replace(tmp_path, self.directory / self.INDEX_NAME)
+                self._dirty = False
+                self._unflushed_puts = 0
+            except OSError:
+                pass
+
+    def clear(self):
+        """Полностью очищает кэш на диске"""
+        with self._lock:
+            for key in list(self._index):
+                self._remove(key)
+            self.flush()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+
+class ExtractionCache(DiskCache):
+    """Постоянный кэш извлечённого текста, адресуемый по содержимому файла.
+
+    Хеш содержимого пересчитывается, только если у файла изменились размер или mtime,
+    поэтому неизменённые документы загружаются из кэша без чтения целиком. Файлы, от
+    содержимого которых в кэше не осталось записей, при загрузке забываются.
+    """
+
+    FILES_NAME = 'files.json'
+
+    def __init__(self, directory: Path, max_bytes: int, version: int = 1):
+        super().__init__(directory, max_bytes)
+        self.version = version
+        self._files: Dict[str, Dict[str, Any]] = self._load_files()
+
+    def _load_files(self) -> Dict[str, Dict[str, Any]]:
+        files_path = self.directory / self.FILES_NAME
+        if not files_path.exists():
+            return {}
+        try:
+            with files_path.open('r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception:
+            return {}
+        if not isinstance(data, dict):
+            return {}
+        hashes = {meta.get('sha256') for meta in self._index.values()}
+        files = {path: info for path, info in data.items()
+                 if isinstance(info, dict) and info.get('sha256') in hashes}
+        if len(files) < len(data):
+            self._dirty = True
+        return files
+
+    @staticmethod
+    def _hash_file(file_path: Path) -> str:
+        digest = hashlib.sha256()
+        with file_path.open('rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def fingerprint(self, file_path: Path) -> Optional[Dict[str, Any]]:
+        """Возвращает {path, size, mtime, sha256} файла, пересчитывая хеш только при изменениях"""
+        try:
+            stat = file_path.stat()
+        except OSError:
+            return None
+        path_key = str(file_path.resolve())
+        with self._lock:
+            known = self._files.get(path_key)
+            if known and known.get('size') == stat.st_size and known.get('mtime') == stat.st_mtime_ns:
+                return known
+        try:
+            content_hash = self._hash_file(file_path)
+        except OSError:
+            return None
+        info = {'path': path_key, 'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': content_hash}
+        with self._lock:
+            self._files[path_key] = info
+            self._dirty = True
+        return info
+
+    def _key(self, content_hash: str, file_type: str) -> str:
+        return hashlib.sha256(f"{self.version}|{file_type}|{content_hash}".encode('utf-8')).hexdigest()
+
+    def get_text(self, file_path: Path, file_type: str, record: bool = True) -> Optional[str]:
+        info = self.fingerprint(file_path)
+        if info is None:
+            self.misses += record
+            return None
+        return self.get(self._key(info['sha256'], file_type), record)
+
+    def put_text(self, file_path: Path, file_type: str, text: str):
+        info = self.fingerprint(file_path)
+        if info is None:
+            return
+        self.put(self._key(info['sha256'], file_type), text, path=info['path'], type=file_type, chars=len(text),
+                 sha256=info['sha256'])
+
+    def text_size(self, file_path: Path, file_type: str) -> Optional[int]:
+        """Длина сохранённого текста файла в символах без чтения записи (None — файла нет в кэше)"""
+        info = self.fingerprint(file_path)
+        if info is None:
+            return None
+        with self._lock:
+            meta = self._index.get(self._key(info['sha256'], file_type))
+        return meta.get('chars') if meta else None
+
+    def flush(self):
+        with self._lock:
+            dirty = self._dirty
+            super().flush()
+            if not dirty:
+                return
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                tmp_path = self.directory / (self.FILES_NAME + '.tmp')
+                with tmp_path.open('w', encoding='utf-8') as f:
+                    json.dump(self._files, f, ensure_ascii=False)
+                os.replace(tmp_path, self.directory / self.FILES_NAME)
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._files = {}
+            super().clear()
+            try:
+                (self.directory / self.FILES_NAME).unlink()
+            except OSError:
+                pass
+
+
+class ResponseCache(DiskCache):
+    """Постоянный кэш ответов модели.
+
+    Ключ — провайдер, модель, версия шаблона промпта, параметры генерации и хеш точного текста
+    промпта, поэтому любой изменённый промпт или другая модель дают промах.
+    """
+
+    def key(self, provider: str, model: str, prompt_version: int, prompt: str, **params: Any) -> str:
+        prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        params_str = json.dumps(params, sort_keys=True)
+        raw_key = f"{provider}|{model}|{prompt_version}|{params_str}|{prompt_hash}"
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+
+class IndexCache(DiskCache):
+    """Постоянный кэш индексов частей документов (search_index.ChunkIndex).
+
+    Ключ — хеш извлечённого текста и параметры разбиения, поэтому индекс переиспользуется,
+    пока не изменились документ, логика извлечения или формат индекса.
+    """
+
+    def key(self, text_hash: str, version: int, **params: Any) -> str:
+        params_str = json.dumps(params, sort_keys=True)
+        return hashlib.sha256(f"{version}|{params_str}|{text_hash}".encode('utf-8')).hexdigest()
+
+    def get_index(self, key: str) -> Optional[Dict[str, Any]]:
+        raw = self.get(key)
+        if raw is None:
+            return None
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+
+    def put_index(self, key: str, data: Dict[str, Any], **meta: Any):
+        self.put(key, json.dumps(data, ensure_ascii=False, separators=(',', ':')), **meta)
@@ -0,0 +1,176 @@
+# search_cancel.py
+"""Отмена запуска поиска (search.py): общий признак остановки, пределы времени и обрыв HTTP-запросов"""
+
+import itertools
+import socket
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+STOPPED = "stopped"  # Остановлено пользователем
+DEADLINE = "deadline"  # Истёк предел времени
+
+
+class Cancelled(BaseException):
+    """Запуск или запрос отменён.
+
+    Наследуется от BaseException (как KeyboardInterrupt): обработчики `except Exception`
+    в запросах к модели и извлечении не превращают отмену в обычную ошибку.
+    """
+
+    def __init__(self, reason: str = STOPPED):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class CancelToken:
+    """Признак отмены, общий для потоков конвейера.
+
+    При отмене вызываются зарегистрированные обработчики (см. on_cancel) — ими обрываются
+    HTTP-запросы и будятся ожидающие потоки. Дочерний токен (child) отменяется вместе
+    с родительским или по истечении своего предела времени.
+    """
+
+    def __init__(self):
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: Dict[int, Callable[[], None]] = {}
+        self._ids = itertools.count()
+        self._timer: Optional[threading.Timer] = None
+        self._unlink: Optional[Callable[[], None]] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = STOPPED):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Ожидание отмены не дольше timeout секунд; True — отменено"""
+        return self._event.wait(timeout)
+
+    def check(self):
+        """Поднимает Cancelled, если токен отменён"""
+        if self._event.is_set():
+            raise Cancelled(self.reason)
+
+    def _add(self, callback: Callable[[], None]) -> Optional[int]:
+        with self._lock:
+            if not self._event.is_set():
+                key = next(self._ids)
+                self._callbacks[key] = callback
+                return key
+        callback()
+        return None
+
+    def _remove(self, key: Optional[int]):
+        if key is not None:
+            with self._lock:
+                self._callbacks.pop(key, None)
+
+    @contextmanager
+    def on_cancel(self, callback: Callable[[], None]):
+        """callback() будет вызван при отмене внутри блока (сразу, если токен уже отменён)"""
+        key = self._add(callback)
+        try:
+            yield
+        finally:
+            self._remove(key)
+
+    def child(self, timeout: Optional[float] = None) -> 'CancelToken':
+        """Токен, отменяемый вместе с этим или через timeout секунд (None/0 — без предела).
+
+        Используется как контекстный менеджер: при выходе таймер и связь с родителем снимаются.
+        """
+        token = CancelToken()
+        key = self._add(lambda: token.cancel(self.reason or STOPPED))
+        token._unlink = lambda: self._remove(key)
+        if timeout:
+            token._timer = threading.Timer(timeout, token.cancel, args=(DEADLINE,))
+            token._timer.daemon = True
+            token._timer.start()
+        return token
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._unlink is not None:
+            self._unlink()
+            self._unlink = None
+
+    def __enter__(self) -> 'CancelToken':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Соединение, занятое запросом каждого потока (см. AbortableAdapter)
+_active: Dict[int, object] = {}
+_active_lock = threading.Lock()
+
+
+class _TrackingPoolMixin:
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        with _active_lock:
+            _active[threading.get_ident()] = conn
+        return conn
+
+    def _put_conn(self, conn):
+        with _active_lock:
+            for ident in [ident for ident, active in _active.items() if active is conn]:
+                del _active[ident]
+        super()._put_conn(conn)
+
+
+class _TrackingHTTPConnectionPool(_TrackingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class _TrackingHTTPSConnectionPool(_TrackingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class AbortableAdapter(HTTPAdapter):
+    """HTTP-адаптер requests, запоминающий соединение запроса каждого потока.
+
+    abort_request(поток) закрывает сокет этого соединения: заблокированное чтение ответа
+    сразу завершается ошибкой, а Ollama прекращает генерацию для закрытого соединения.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TrackingHTTPConnectionPool,
+            'https': _TrackingHTTPSConnectionPool,
+        }
+
+
+def abort_request(thread_ident: int):
+    """Обрывает HTTP-запрос, выполняемый потоком thread_ident через AbortableAdapter"""
+    with _active_lock:
+        conn = _active.get(thread_ident)
+    sock = getattr(conn, 'sock', None)
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
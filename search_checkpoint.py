@@ -0,0 +1,119 @@
+# search_checkpoint.py
+"""Контрольная точка запуска поиска (search.py): результаты по мере готовности в JSONL.
+
+Первая строка файла — заголовок с отпечатком конфигурации, дальше по строке на готовый элемент.
+Строки дописываются и сбрасываются на диск сразу, поэтому после падения приложения, остановки
+Ollama или закрытия окна готовые элементы не теряются и запуск можно продолжить.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+CHECKPOINT_VERSION = 1
+
+
+def checkpoint_file_for(output_file: Path) -> Path:
+    """Контрольная точка рядом с файлом результатов: data.json -> data.checkpoint.jsonl"""
+    return output_file.with_name(f"{output_file.stem}.checkpoint.jsonl")
+
+
+def config_fingerprint(root: str, items: Any) -> str:
+    """Отпечаток конфигурации: корневая папка и элементы в каноническом JSON"""
+    canonical = json.dumps({'root': str(root), 'items': items}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def write_json_atomic(path: Path, data: Any, **dump_kwargs: Any):
+    """Запись JSON через временный файл и os.replace: файл либо старый, либо целиком новый"""
+    tmp_path = path.with_name(path.name + '.tmp')
+    try:
+        with tmp_path.open('w', encoding='utf-8') as f:
+            json.dump(data, f, **dump_kwargs)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+        raise
+
+
+class ResultCheckpoint:
+    """Журнал готовых элементов одного запуска с отпечатком конфигурации"""
+
+    def __init__(self, path: Path, fingerprint: str):
+        self.path = path
+        self.fingerprint = fingerprint
+        self._file = None
+        self._lock = threading.Lock()
+
+    def load(self) -> Optional[Dict[int, Dict[str, Any]]]:
+        """Результаты из контрольной точки по индексу элемента.
+
+        None — контрольной точки нет или она записана для другой конфигурации.
+        Оборванная при падении последняя строка пропускается.
+        """
+        try:
+            f = self.path.open('r', encoding='utf-8')
+        except OSError:
+            return None
+        records: Dict[int, Dict[str, Any]] = {}
+        with f:
+            header = None
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if not isinstance(record, dict):
+                    continue
+                if header is None:
+                    header = record
+                    if header.get('version') != CHECKPOINT_VERSION or header.get('config') != self.fingerprint:
+                        return None
+                    continue
+                if isinstance(record.get('index'), int) and isinstance(record.get('result'), dict):
+                    records[record['index']] = record['result']
+        return records if header is not None else None
+
+    def open(self, resume: bool):
+        """Открывает журнал: дописывает к существующему (resume) или начинает новый"""
+        if resume and self.path.exists():
+            self._file = self.path.open('a', encoding='utf-8')
+            # Строка, оборванная при падении, не должна склеиться со следующей
+            if self._file.tell() > 0:
+                self._file.write("\n")
+            return
+        self._file = self.path.open('w', encoding='utf-8')
+        self._write({'version': CHECKPOINT_VERSION, 'config': self.fingerprint})
+
+    def append(self, index: int, result: Dict[str, Any]):
+        """Дописывает готовый элемент и сбрасывает его на диск"""
+        if self._file is not None:
+            self._write({'index': index, 'result': result})
+
+    def _write(self, record: Dict[str, Any]):
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def remove(self):
+        """Удаляет журнал после того, как результаты сохранены целиком"""
+        self.close()
+        try:
+            self.path.unlink()
+        except OSError:
+            pass
@@ -0,0 +1,210 @@
+# search_cli.py
+"""Запуск поиска (search.py) из командной строки без GUI.
+
+Ход обработки выводится в stdout строками JSON (по событию на строку), подробный лог — в stderr.
+Код выхода: 0 — найдены все значения, 1 — часть не найдена, 3 — не найдено ни одного,
+4 — обработка не запустилась (конфигурация, API-ключ, провайдер), 5 — остановлено по Ctrl+C
+(частичные результаты сохранены, продолжить можно с --resume); 2 — ошибка в аргументах.
+
+Пример:
+    python search_cli.py --config config.json --provider ollama --model qwen3:14b --concurrency 4
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import search
+from search import AI_CONCURRENCY, API_KEY_FILE, ITEM_DEADLINE, AIInterface, DocumentProcessor
+from search_cancel import CancelToken
+
+EXIT_ALL_FOUND = 0
+EXIT_PARTIAL = 1
+EXIT_NONE_FOUND = 3
+EXIT_ERROR = 4
+EXIT_STOPPED = 5
+
+
+class JsonLinesReporter:
+    """События обработки строками JSON в stdout, лог — в stderr"""
+
+    def __init__(self, out=None, err=None, quiet: bool = False):
+        self.out = out or sys.stdout
+        self.err = err or sys.stderr
+        self.quiet = quiet
+        self.total = 0
+        self.done = 0
+        self._lock = threading.Lock()
+
+    def event(self, name: str, **fields: Any):
+        line = json.dumps(dict(event=name, time=round(time.time(), 3), **fields), ensure_ascii=False)
+        with self._lock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    def log(self, message: str):
+        if self.quiet:
+            return
+        with self._lock:
+            self.err.write(message + "\n")
+            self.err.flush()
+
+    def item(self, index: int, result: Dict[str, Any]):
+        self.done += 1
+        extra = {'metrics': result['metrics']} if 'metrics' in result else {}
+        self.event("item", index=index, done=self.done, total=self.total,
+                   data_name=result.get('data_name', ''), status=result.get('status'),
+                   value=result.get('extracted_value'), source=result.get('source'),
+                   reason=result.get('reason') or None, **extra)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Поиск значений в документах по config.json без GUI")
+    parser.add_argument("--config", type=Path, default=search.CONFIG_FILE, help="файл конфигурации")
+    parser.add_argument("--root", type=Path, help="корневая папка документов вместо root из конфигурации")
+    parser.add_argument("--output", type=Path, default=search.OUTPUT_FILE, help="файл результатов")
+    parser.add_argument("--provider", choices=("ollama", "openrouter"), default="ollama")
+    parser.add_argument("--model", help="модель (по умолчанию — как в GUI для выбранного провайдера)")
+    parser.add_argument("--embed-model", default=search.EMBEDDING_MODEL,
+                        help="модель эмбеддингов Ollama для отбора фрагментов по смыслу (например, bge-m3)")
+    parser.add_argument("--context-tokens", type=int,
+                        help="окно контекста модели в токенах (по умолчанию — по провайдеру и модели)")
+    parser.add_argument("--concurrency", type=int, default=AI_CONCURRENCY,
+                        help="одновременных запросов к модели")
+    parser.add_argument("--rpm", type=float,
+                        help="лимит запросов к модели в минуту (0 — без лимита; по умолчанию 20 для моделей :free)")
+    parser.add_argument("--item-deadline", type=float, default=ITEM_DEADLINE,
+                        help="предел времени на запрос значения к модели, с (0 — без предела)")
+    parser.add_argument("--api-key-file", type=Path, default=API_KEY_FILE,
+                        help="файл с API-ключом OpenRouter (или переменная OPENROUTER_API_KEY)")
+    parser.add_argument("--no-batch", action="store_true", help="запрашивать каждое поле отдельно")
+    parser.add_argument("--incremental", action="store_true",
+                        help="обрабатывать только новые, изменённые и ненайденные элементы")
+    parser.add_argument("--resume", action="store_true",
+                        help="продолжить прерванный запуск по контрольной точке рядом с файлом результатов")
+    parser.add_argument("--no-locate", action="store_true",
+                        help="не искать документ по индексу папки для элементов без файла")
+    parser.add_argument("--metrics", action="store_true",
+                        help="метрики времени в результатах и сводка рядом с файлом результатов")
+    parser.add_argument("--quiet", action="store_true", help="не выводить подробный лог в stderr")
+    args = parser.parse_args(argv)
+    if args.concurrency < 1:
+        parser.error("--concurrency должно быть не меньше 1")
+    return args
+
+
+def read_api_key(api_key_file: Path) -> Optional[str]:
+    """API-ключ OpenRouter из переменной окружения или файла; None, если его нет"""
+    api_key = os.environ.get("OPENROUTER_API_KEY", "").strip()
+    if api_key:
+        return api_key
+    try:
+        return api_key_file.read_text(encoding='utf-8').strip() or None
+    except OSError:
+        return None
+
+
+def exit_code(results: List[Dict[str, Any]]) -> int:
+    found = sum(1 for r in results if r.get('status') == 'found')
+    if results and found == len(results):
+        return EXIT_ALL_FOUND
+    return EXIT_PARTIAL if found else EXIT_NONE_FOUND
+
+
+def run(args: argparse.Namespace, reporter: JsonLinesReporter) -> int:
+    # Пути задаются на уровне модуля — как их использует GUI
+    search.CONFIG_FILE = args.config
+    search.OUTPUT_FILE = args.output
+
+    api_key = None
+    if args.provider == "openrouter":
+        api_key = read_api_key(args.api_key_file)
+        if not api_key:
+            reporter.event("error", message=f"API-ключ OpenRouter не найден ({args.api_key_file}, OPENROUTER_API_KEY)")
+            return EXIT_ERROR
+
+    processor = DocumentProcessor(reporter.log)
+    processor.batch_fields = not args.no_batch
+    processor.incremental = args.incremental
+    processor.resume = args.resume
+    processor.item_deadline = args.item_deadline or None
+    processor.embedding_model = args.embed_model
+    processor.locate_files = not args.no_locate
+    processor.collect_metrics = args.metrics
+    processor.root = args.root
+    processor.on_result = reporter.item
+
+    config = processor.load_config()
+    if config is None:
+        reporter.event("error", message=f"Не удалось загрузить конфигурацию {args.config}")
+        return EXIT_ERROR
+    reporter.total = len(config.get('items', []))
+
+    # Первый Ctrl+C останавливает обработку с сохранением готового, второй — прерывает сразу
+    cancel = CancelToken()
+    previous_handler = None
+
+    def interrupt(signum, frame):
+        if cancel.cancelled:
+            raise KeyboardInterrupt
+        reporter.log("⏹ Остановка обработки (повторный Ctrl+C — прервать сразу)...")
+        cancel.cancel()
+
+    if threading.current_thread() is threading.main_thread():
+        previous_handler = signal.signal(signal.SIGINT, interrupt)
+
+    ai = None
+    started = time.monotonic()
+    try:
+        ai = AIInterface(provider=args.provider, api_key=api_key, model=args.model,
+                         max_concurrency=args.concurrency, requests_per_minute=args.rpm,
+                         context_tokens=args.context_tokens)
+        reporter.event("start", items=reporter.total, provider=ai.provider, model=ai.model,
+                       concurrency=ai.max_concurrency, config=str(args.config))
+        if not ai.start(logger=reporter.log):
+            reporter.event("error", message="Не удалось запустить AI-провайдера")
+            return EXIT_ERROR
+
+        processor.set_ai_interface(ai)
+        results = processor.process_documents(cancel)
+        if not results and reporter.total:
+            reporter.event("error", message="Обработка не выполнена, подробности в логе")
+            return EXIT_ERROR
+        processor.save_results(results)
+        processor.print_report(results)
+    except Exception as e:
+        reporter.event("error", message=str(e))
+        return EXIT_ERROR
+    finally:
+        if ai:
+            ai.stop()
+        if previous_handler is not None:
+            signal.signal(signal.SIGINT, previous_handler)
+
+    found = sum(1 for r in results if r.get('status') == 'found')
+    summary = {}
+    if processor.run_summary is not None:
+        summary = dict(metrics=str(search.metrics_file_for(args.output)),
+                       items_per_second=processor.run_summary.get('items_per_second'))
+    if processor.stopped:
+        summary['stopped'] = True
+    reporter.event("done", total=len(results), found=found, not_found=len(results) - found,
+                   output=str(args.output), seconds=round(time.monotonic() - started, 1), **summary)
+    return EXIT_STOPPED if processor.stopped else exit_code(results)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    return run(args, JsonLinesReporter(quiet=args.quiet))
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
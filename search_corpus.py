@@ -0,0 +1,168 @@
+# search_corpus.py
+"""Индекс всех документов корневой папки для поиска файла элемента (search.py).
+
+Если у элемента конфигурации файл не указан или не существует, подходящие документы ищутся
+по словам ключевых фраз в обратном индексе по текстам всех поддерживаемых файлов под root.
+Индекс хранится на диске и обновляется по размеру и mtime: при следующем запуске заново
+извлекаются только новые и изменённые файлы, удалённые выбрасываются.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from search_checkpoint import write_json_atomic
+from search_index import TermIndex, count_words
+from search_retrieval import keyword_terms
+
+CORPUS_VERSION = 1  # Увеличивать при изменении подсчёта слов или формата индекса
+LOCATE_CANDIDATES = 3  # Сколько лучших документов пробовать для элемента без файла
+LOCATE_MIN_COVERAGE = 0.5  # Доля слов ключевых фраз, которая должна встретиться в документе
+# Тип документа (как в config) по расширению файла
+DOCUMENT_TYPES = {
+    '.docx': 'word', '.docm': 'word',
+    '.xlsx': 'excel', '.xlsm': 'excel', '.xltx': 'excel', '.xltm': 'excel', '.xls': 'excel',
+    '.pdf': 'pdf',
+}
+
+
+def document_type(path: Path) -> Optional[str]:
+    """Тип документа по расширению; None — файл не поддерживается (и временные файлы Office «~$»)"""
+    if path.name.startswith('~$'):
+        return None
+    return DOCUMENT_TYPES.get(path.suffix.lower())
+
+
+def corpus_file_for(directory: Path, root: Path) -> Path:
+    """Файл индекса для корневой папки: у каждой папки документов свой индекс"""
+    digest = hashlib.sha256(str(Path(root).resolve()).encode('utf-8')).hexdigest()[:16]
+    return Path(directory) / f"{digest}.json"
+
+
+class CorpusIndex:
+    """Частоты слов каждого документа папки root (по относительному пути) с поиском BM25.
+
+    Обновление: scan() — какие файлы нужно (пере)индексировать, add() — слова извлечённого
+    текста, save() — запись на диск. search() можно вызывать после обновления.
+    """
+
+    def __init__(self, path: Optional[Path], root: Path):
+        # None — индекс только в памяти (без кэша на диске)
+        self.path = Path(path) if path is not None else None
+        self.root = Path(root)
+        # Относительный путь -> {type, size, mtime, words: {слово: частота}}
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self._terms: Optional[TermIndex] = None
+        self._names: List[str] = []
+        self._lock = threading.Lock()
+
+    def load(self) -> 'CorpusIndex':
+        """Индекс прошлых запусков; устаревший или повреждённый файл — пустой индекс"""
+        if self.path is None:
+            return self
+        try:
+            with self.path.open('r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return self
+        if (isinstance(data, dict) and data.get('version') == CORPUS_VERSION
+                and data.get('root') == str(self.root.resolve()) and isinstance(data.get('documents'), dict)):
+            self.documents = data['documents']
+        return self
+
+    def save(self):
+        if self.path is None:
+            return
+        with self._lock:
+            data = {'version': CORPUS_VERSION, 'root': str(self.root.resolve()), 'documents': self.documents}
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            write_json_atomic(self.path, data, ensure_ascii=False, separators=(',', ':'))
+        except OSError:
+            pass
+
+    def scan(self) -> Tuple[List[Tuple[str, Path, str]], int]:
+        """Обход root: ([(относительный путь, путь, тип)] новых и изменённых файлов, число удалённых)"""
+        changed: List[Tuple[str, Path, str]] = []
+        seen = set()
+        for directory, dirs, names in os.walk(self.root):
+            # Скрытые папки (.git, кэши) не индексируем
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            for name in sorted(names):
+                path = Path(directory, name)
+                file_type = document_type(path)
+                if file_type is None:
+                    continue
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                relative = path.relative_to(self.root).as_posix()
+                seen.add(relative)
+                known = self.documents.get(relative)
+                if not (known and known.get('size') == stat.st_size and known.get('mtime') == stat.st_mtime_ns
+                        and known.get('type') == file_type):
+                    changed.append((relative, path, file_type))
+        with self._lock:
+            removed = [relative for relative in self.documents if relative not in seen]
+            for relative in removed:
+                del self.documents[relative]
+            self._terms = None
+        return changed, len(removed)
+
+    def add(self, relative: str, path: Path, file_type: str, text: str):
+        """Слова извлечённого текста документа (ошибка извлечения — документ без слов).
+
+        Слова имени файла тоже индексируются: «Приказ о назначении.pdf» находится по «приказ».
+        """
+        try:
+            stat = path.stat()
+        except OSError:
+            return
+        words = {} if text.startswith("Ошибка при извлечении") else count_words(text)
+        for word, count in count_words(Path(relative).stem.replace('_', ' ')).items():
+            words[word] = words.get(word, 0) + count
+        with self._lock:
+            self.documents[relative] = {'type': file_type, 'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                                        'words': words}
+            self._terms = None
+
+    def _term_index(self) -> TermIndex:
+        with self._lock:
+            if self._terms is None:
+                self._names = sorted(self.documents)
+                lengths = []
+                postings: Dict[str, List[int]] = {}
+                for n, relative in enumerate(self._names):
+                    words = self.documents[relative].get('words', {})
+                    lengths.append(sum(words.values()))
+                    for word, count in words.items():
+                        postings.setdefault(word, []).extend((n, count))
+                self._terms = TermIndex(lengths, postings)
+            return self._terms
+
+    def search(self, keywords: Sequence[str], top_k: int = LOCATE_CANDIDATES,
+               min_coverage: float = LOCATE_MIN_COVERAGE) -> List[Tuple[str, str, float]]:
+        """Лучшие документы для ключевых фраз: [(относительный путь, тип, оценка)] по убыванию оценки.
+
+        Документ подходит, если в нём встречается не меньше min_coverage слов ключевых фраз.
+        """
+        terms = keyword_terms(keywords)
+        index = self._term_index()
+        if not terms or not index.lengths:
+            return []
+        matched = [0] * len(index.lengths)
+        for term in terms:
+            for n in index.term_frequencies(term):
+                matched[n] += 1
+        scores = index.bm25(keywords)
+        ranked = sorted((n for n in range(len(index.lengths)) if matched[n] >= min_coverage * len(terms)),
+                        key=lambda n: (-scores[n], self._names[n]))
+        return [(self._names[n], self.documents[self._names[n]]['type'], float(scores[n]))
+                for n in ranked[:top_k] if scores[n] > 0]
+
+    def __len__(self) -> int:
+        return len(self.documents)
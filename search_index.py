@@ -0,0 +1,186 @@
+# search_index.py
+"""Индекс частей документа для отбора фрагментов по ключевым словам (search.py).
+
+Текст документа делится на части с перекрытием; части ранжируются по BM25, а если для документа
+есть векторы локальной модели эмбеддингов Ollama — ещё и по косинусной близости к ключевой фразе
+(ранги объединяются методом Reciprocal Rank Fusion). Векторы находят перефразированные подписи
+(«Наименование СРО» — «саморегулируемая организация»), которые не совпадают ни по одному слову.
+"""
+
+import base64
+import math
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from search_retrieval import MIN_TERM_LEN, WORD_RE, chunk_spans, keyword_terms, normalize_word, words_match
+
+INDEX_VERSION = 1  # Увеличивать при изменении разбиения или формата индекса
+INDEX_CHUNK_CHARS = 1200  # Символов в части документа
+INDEX_CHUNK_OVERLAP = 200  # Перекрытие соседних частей
+INDEX_TOP_K = 5  # Не больше частей на один набор ключевых слов
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60  # Сглаживание рангов при объединении BM25 и векторов
+
+
+def count_words(text: str, start: int = 0, end: Optional[int] = None) -> Dict[str, int]:
+    """Частоты значимых слов текста (или его участка [start, end))"""
+    counts: Dict[str, int] = {}
+    for match in WORD_RE.finditer(text, start, len(text) if end is None else end):
+        word = normalize_word(match.group())
+        if len(word) >= MIN_TERM_LEN:
+            counts[word] = counts.get(word, 0) + 1
+    return counts
+
+
+class TermIndex:
+    """Обратный индекс слов по набору текстов (частей документа или целых документов) с оценкой BM25"""
+
+    def __init__(self, lengths: List[int], postings: Dict[str, List[int]]):
+        self.lengths = lengths
+        # Слово -> [номер текста, частота, номер текста, частота, ...]
+        self.postings = postings
+        self._avg_length = (sum(lengths) / len(lengths)) if lengths else 0.0
+        self._term_words: Dict[str, List[str]] = {}
+
+    def _words_for(self, term: str) -> List[str]:
+        """Слова индекса, совпадающие с термином (нечётко, как при поиске фрагментов)"""
+        if term not in self._term_words:
+            self._term_words[term] = [word for word in self.postings if words_match(word, term)]
+        return self._term_words[term]
+
+    def bm25(self, keywords: Sequence[str]) -> np.ndarray:
+        """Оценки BM25 текстов по словам ключевых фраз; формы и опечатки термина считаются одним словом"""
+        scores = np.zeros(len(self.lengths))
+        total = len(self.lengths)
+        for term in keyword_terms(keywords):
+            freqs = self.term_frequencies(term)
+            if not freqs:
+                continue
+            idf = math.log(1 + (total - len(freqs) + 0.5) / (len(freqs) + 0.5))
+            for n, tf in freqs.items():
+                norm = 1 - BM25_B + BM25_B * self.lengths[n] / (self._avg_length or 1)
+                scores[n] += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+        return scores
+
+    def term_frequencies(self, term: str) -> Dict[int, int]:
+        """Частоты термина (всех совпадающих с ним слов) по номерам текстов"""
+        freqs: Dict[int, int] = {}
+        for word in self._words_for(term):
+            posting = self.postings[word]
+            for k in range(0, len(posting), 2):
+                freqs[posting[k]] = freqs.get(posting[k], 0) + posting[k + 1]
+        return freqs
+
+
+class ChunkIndex(TermIndex):
+    """Части документа (границы в тексте) с обратным индексом слов и, возможно, векторами"""
+
+    def __init__(self, spans: List[Tuple[int, int]], lengths: List[int],
+                 postings: Dict[str, List[int]], vectors: Optional[Dict[str, np.ndarray]] = None):
+        super().__init__(lengths, postings)
+        self.spans = spans
+        # Модель эмбеддингов -> нормированные векторы частей (строка на часть)
+        self.vectors: Dict[str, np.ndarray] = vectors or {}
+
+    @classmethod
+    def build(cls, text: str, chunk_chars: int = INDEX_CHUNK_CHARS,
+              overlap: int = INDEX_CHUNK_OVERLAP) -> 'ChunkIndex':
+        spans = chunk_spans(text, chunk_chars, overlap)
+        lengths = []
+        postings: Dict[str, List[int]] = {}
+        for n, (start, end) in enumerate(spans):
+            counts = count_words(text, start, end)
+            lengths.append(sum(counts.values()))
+            for word, count in counts.items():
+                postings.setdefault(word, []).extend((n, count))
+        return cls(spans, lengths, postings)
+
+    def chunk_texts(self, text: str) -> List[str]:
+        return [text[start:end] for start, end in self.spans]
+
+    def set_vectors(self, model: str, vectors: Sequence[Sequence[float]]):
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.vectors[model] = matrix / np.where(norms == 0, 1, norms)
+
+    def rank(self, keywords: Sequence[str], query_vector: Optional[Sequence[float]] = None,
+             model: Optional[str] = None) -> List[int]:
+        """Номера частей по убыванию соответствия ключевым словам (только подходящие части)"""
+        scores = self.bm25(keywords)
+        lexical = [int(n) for n in np.argsort(-scores, kind='stable') if scores[n] > 0]
+        vectors = self.vectors.get(model) if model else None
+        if query_vector is None or vectors is None or not len(vectors):
+            return lexical
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+        semantic = [int(n) for n in np.argsort(-(vectors @ query), kind='stable')]
+        fused: Dict[int, float] = {}
+        for ranking in (lexical, semantic):
+            for rank, n in enumerate(ranking):
+                fused[n] = fused.get(n, 0.0) + 1 / (RRF_K + rank + 1)
+        return sorted(fused, key=lambda n: (-fused[n], n))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'version': INDEX_VERSION,
+            'spans': self.spans,
+            'lengths': self.lengths,
+            'postings': self.postings,
+            'vectors': {model: {'shape': list(matrix.shape),
+                                'data': base64.b64encode(matrix.astype(np.float32).tobytes()).decode('ascii')}
+                        for model, matrix in self.vectors.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> Optional['ChunkIndex']:
+        """Индекс из сохранённого словаря; None, если формат устарел или повреждён"""
+        if not isinstance(data, dict) or data.get('version') != INDEX_VERSION:
+            return None
+        try:
+            vectors = {
+                model: np.frombuffer(base64.b64decode(stored['data']), dtype=np.float32).reshape(stored['shape'])
+                for model, stored in data.get('vectors', {}).items()
+            }
+            return cls([tuple(span) for span in data['spans']], data['lengths'], data['postings'], vectors)
+        except (KeyError, TypeError, ValueError):
+            return None
+
+
+def select_chunks(text: str, index: ChunkIndex, keyword_sets: Sequence[Sequence[str]], max_chars: int,
+                  top_k: int = INDEX_TOP_K, query_vectors: Optional[Sequence[Optional[Sequence[float]]]] = None,
+                  model: Optional[str] = None) -> str:
+    """Лучшие части документа для каждого набора ключевых слов.
+
+    На набор берётся не больше top_k частей и max_chars символов (первая подходящая часть —
+    всегда). Части объединяются и выводятся в порядке документа, как в select_windows.
+    Пустая строка — подходящих частей нет.
+    """
+    intervals: List[Tuple[int, int]] = []
+    for n, keywords in enumerate(keyword_sets):
+        vector = query_vectors[n] if query_vectors else None
+        used = 0
+        chosen = 0
+        for chunk in index.rank(keywords, vector, model):
+            start, end = index.spans[chunk]
+            if chosen and used + end - start > max_chars:
+                break
+            intervals.append((start, end))
+            used += end - start
+            chosen += 1
+            if chosen >= top_k:
+                break
+
+    if not intervals:
+        return ""
+
+    intervals.sort()
+    merged = [list(intervals[0])]
+    for start, end in intervals[1:]:
+        if start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    fragments = (text[start:end].strip() for start, end in merged)
+    return "\n...\n".join(fragment for fragment in fragments if fragment)
@@ -0,0 +1,59 @@
+# search_log.py
+"""Лог конвейера поиска (search.py) для GUI: строки из рабочих потоков через очередь"""
+
+import queue
+from pathlib import Path
+from typing import List, Optional
+
+LOG_BATCH_MAX_LINES = 2000  # Строк лога за один проход потока Tk
+LOG_MAX_LINES = 5000  # Строк, которые хранит окно лога (старые удаляются)
+LOG_POLL_MS = 100  # Как часто поток Tk забирает строки из очереди, мс
+
+
+class QueuedLog:
+    """Очередь строк лога, которую поток Tk выбирает пачками.
+
+    write можно вызывать из любого потока: он только кладёт строку в очередь. drain вызывается
+    одним потоком (Tk) — он забирает накопившиеся строки и дописывает их в файл полного лога,
+    поэтому в файле остаётся всё, даже то, что уже удалено из окна.
+    """
+
+    def __init__(self, log_file: Optional[Path] = None, batch_max_lines: int = LOG_BATCH_MAX_LINES):
+        self.batch_max_lines = batch_max_lines
+        self._queue: "queue.SimpleQueue[str]" = queue.SimpleQueue()
+        self._file = None
+        if log_file is not None:
+            try:
+                self._file = log_file.open('w', encoding='utf-8')
+            except OSError:
+                self._file = None
+
+    def write(self, text: str):
+        self._queue.put(text)
+
+    def pending(self) -> bool:
+        return not self._queue.empty()
+
+    def drain(self) -> List[str]:
+        """Забирает из очереди не больше batch_max_lines записей и дописывает их в файл"""
+        lines: List[str] = []
+        while len(lines) < self.batch_max_lines:
+            try:
+                lines.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if lines and self._file is not None:
+            try:
+                self._file.write("\n".join(lines) + "\n")
+                self._file.flush()
+            except (OSError, ValueError):
+                self._file = None
+        return lines
+
+    def close(self):
+        """Дописывает оставшиеся строки в файл и закрывает его"""
+        while self.pending():
+            self.drain()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
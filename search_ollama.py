@@ -0,0 +1,157 @@
+# search_ollama.py
+"""Жизненный цикл локального сервера Ollama для конвейера поиска (search.py)"""
+
+import json
+import subprocess
+import time
+from typing import Optional
+
+import requests
+
+READY_TIMEOUT = 60  # Секунд ожидания готовности сервера после запуска
+READY_BACKOFF_START = 0.25  # Первая пауза между проверками готовности, с
+READY_BACKOFF_MAX = 4.0  # Наибольшая пауза между проверками, с
+OLLAMA_KEEP_ALIVE = "30m"  # Сколько модель остаётся в памяти после последнего запроса
+WARMUP_TIMEOUT = 600  # Секунд на загрузку модели в память при прогреве
+
+
+class OllamaManager:
+    """Запуск Ollama, ожидание готовности, загрузка и прогрев модели.
+
+    Модель загружается заранее с тем же num_ctx и keep_alive, что и рабочие запросы,
+    поэтому первый элемент не ждёт загрузки и модель не выгружается между элементами.
+    """
+
+    def __init__(self, session: requests.Session, base_url: str, model: str,
+                 keep_alive: str = OLLAMA_KEEP_ALIVE):
+        self.session = session
+        self.base_url = base_url
+        self.model = model
+        self.keep_alive = keep_alive
+        self.process: Optional[subprocess.Popen] = None
+        self.ready = False
+        self.load_seconds: Optional[float] = None
+        self.first_token_seconds: Optional[float] = None
+
+    def is_up(self) -> bool:
+        try:
+            return self.session.get(f"{self.base_url}/api/tags", timeout=2).status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
+    def wait_ready(self, timeout: float = READY_TIMEOUT, logger=None) -> bool:
+        """Ожидание ответа /api/tags с экспоненциально растущей паузой между проверками"""
+        deadline = time.monotonic() + timeout
+        delay = READY_BACKOFF_START
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.is_up():
+                return True
+            if self.process is not None and self.process.poll() is not None:
+                if logger:
+                    logger(f"Процесс Ollama завершился с кодом {self.process.returncode}")
+                return False
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if logger:
+                logger(f"Ожидание Ollama... попытка {attempt}, следующая через {delay:.2f} с")
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, READY_BACKOFF_MAX)
+
+    def start(self, logger=None) -> bool:
+        """Проверяет, запущен ли сервер, и при необходимости запускает `ollama serve`"""
+        def log(msg):
+            if logger:
+                logger(msg)
+
+        if self.is_up():
+            log("Ollama уже запущена")
+            self.ready = True
+            return True
+
+        try:
+            self.process = subprocess.Popen(
+                ["ollama", "serve"],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+        except Exception as e:
+            log(f"Ошибка запуска Ollama: {e}")
+            return False
+
+        started = time.monotonic()
+        if not self.wait_ready(logger=logger):
+            log("Не удалось дождаться запуска Ollama в отведенное время")
+            return False
+        log(f"Ollama успешно запущена за {time.monotonic() - started:.1f} с")
+        self.ready = True
+        return True
+
+    def has_model(self) -> Optional[bool]:
+        """Есть ли модель среди загруженных в Ollama; None, если список получить не удалось"""
+        try:
+            response = self.session.get(f"{self.base_url}/api/tags", timeout=5)
+            names = {m.get('name') for m in response.json().get('models', [])}
+        except Exception:
+            return None
+        return self.model in names or f"{self.model}:latest" in names
+
+    def warm_up(self, num_ctx: int, logger=None) -> Optional[float]:
+        """Загружает модель с заданным окном контекста и измеряет время до первого токена.
+
+        Возвращает время до первого токена, с, или None, если прогрев не удался.
+        """
+        payload = {
+            "model": self.model,
+            "prompt": "Ответь одним словом: готов",
+            "stream": True,
+            "keep_alive": self.keep_alive,
+            "options": {"num_ctx": num_ctx, "num_predict": 1, "temperature": 0},
+        }
+        started = time.monotonic()
+        try:
+            with self.session.post(f"{self.base_url}/api/generate", json=payload, stream=True,
+                                   timeout=(10, WARMUP_TIMEOUT)) as response:
+                if response.status_code != 200:
+                    if logger:
+                        logger(f"Прогрев модели не удался: status={response.status_code}, "
+                               f"body={response.text[:300]}")
+                    return None
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    if data.get("error"):
+                        if logger:
+                            logger(f"Прогрев модели не удался: {data['error']}")
+                        return None
+                    if self.first_token_seconds is None:
+                        self.first_token_seconds = time.monotonic() - started
+                    if data.get("done"):
+                        # load_duration сообщает сама Ollama, в наносекундах
+                        if data.get("load_duration"):
+                            self.load_seconds = data["load_duration"] / 1e9
+                        break
+        except Exception as e:
+            if logger:
+                logger(f"Прогрев модели не удался: {e}")
+            return None
+        return self.first_token_seconds
+
+    def stop(self):
+        """Останавливает сервер, если он был запущен этим процессом"""
+        if self.process is None:
+            return
+        try:
+            self.process.terminate()
+            self.process.wait(timeout=10)
+        except Exception:
+            try:
+                self.process.kill()
+            except Exception:
+                pass
+        finally:
+            self.process = None
+            self.ready = False
@@ -0,0 +1,173 @@
+# search_retrieval.py
+"""Отбор фрагментов документа, относящихся к ключевым словам, для сокращения промптов (search.py)"""
+
+import re
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Sequence, Tuple
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+MIN_TERM_LEN = 3
+# Служебные слова не помогают найти нужное место в тексте
+STOP_WORDS = {
+    'для', 'при', 'или', 'под', 'над', 'без', 'что', 'как', 'это', 'его', 'так', 'она', 'они',
+    'лица', 'лицо', 'года', 'все', 'чем', 'том', 'тот', 'где',
+}
+SIMILARITY = 0.8  # Минимальное сходство слов (учитывает опечатки вроде «подгтавливающего»)
+COMMON_PREFIX = 6  # Слова с общим началом такой длины считаются формами одного слова
+
+
+def normalize_word(word: str) -> str:
+    return word.lower().replace('ё', 'е')
+
+
+def keyword_terms(keywords: Sequence[str]) -> List[str]:
+    """Значимые слова ключевых фраз без повторов"""
+    terms = []
+    for phrase in keywords:
+        for match in WORD_RE.finditer(phrase):
+            word = normalize_word(match.group())
+            if len(word) >= MIN_TERM_LEN and word not in STOP_WORDS and word not in terms:
+                terms.append(word)
+    return terms
+
+
+def words_match(word: str, term: str) -> bool:
+    """Нечёткое сравнение слова текста с термином ключевой фразы"""
+    if word == term:
+        return True
+    prefix = min(COMMON_PREFIX, len(term))
+    if len(term) >= COMMON_PREFIX and word[:prefix] == term[:prefix]:
+        return True
+    if abs(len(word) - len(term)) > 3 or len(term) < 4:
+        return False
+    matcher = SequenceMatcher(None, word, term)
+    return matcher.real_quick_ratio() >= SIMILARITY and matcher.ratio() >= SIMILARITY
+
+
+def find_hits(text: str, terms: Sequence[str]) -> List[Tuple[int, str]]:
+    """Позиции слов текста, совпадающих с терминами: [(позиция, термин)]"""
+    hits = []
+    matched: Dict[str, Optional[str]] = {}
+    for match in WORD_RE.finditer(text):
+        word = normalize_word(match.group())
+        if len(word) < MIN_TERM_LEN:
+            continue
+        if word not in matched:
+            # Словарь документа намного меньше числа слов — сравниваем каждое слово один раз
+            matched[word] = next((term for term in terms if words_match(word, term)), None)
+        term = matched[word]
+        if term is not None:
+            hits.append((match.start(), term))
+    return hits
+
+
+def _rank_hits(hits: List[Tuple[int, str]], radius: int) -> List[Tuple[int, int]]:
+    """Оценка каждого попадания числом разных терминов поблизости: [(оценка, позиция)]"""
+    ranked = []
+    left = 0
+    counts: Dict[str, int] = {}
+    right = 0
+    for pos, _ in hits:
+        while right < len(hits) and hits[right][0] <= pos + radius:
+            counts[hits[right][1]] = counts.get(hits[right][1], 0) + 1
+            right += 1
+        while hits[left][0] < pos - radius:
+            term = hits[left][1]
+            counts[term] -= 1
+            if not counts[term]:
+                del counts[term]
+            left += 1
+        ranked.append((len(counts), pos))
+    ranked.sort(key=lambda r: (-r[0], r[1]))
+    return ranked
+
+
+def _snap(text: str, start: int, end: int) -> Tuple[int, int]:
+    """Сдвигает границы окна к пробелам, чтобы не резать слова"""
+    if start > 0:
+        space = text.find(' ', start, start + 50)
+        start = space + 1 if space != -1 else start
+    if end < len(text):
+        space = text.rfind(' ', end - 50, end)
+        end = space if space > start else end
+    return start, end
+
+
+def select_windows(text: str, keyword_sets: Sequence[Sequence[str]], max_chars: int,
+                   radius: int = 600) -> str:
+    """Фрагменты текста вокруг нечётких совпадений с ключевыми словами.
+
+    На каждый набор ключевых слов отводится не больше max_chars символов; в первую очередь
+    берутся места, где рядом встречается больше разных слов ключевой фразы. Фрагменты
+    объединяются и выводятся в порядке документа. Пустая строка — совпадений нет.
+    """
+    intervals: List[Tuple[int, int]] = []
+    for keywords in keyword_sets:
+        terms = keyword_terms(keywords)
+        if not terms:
+            continue
+        hits = find_hits(text, terms)
+        if not hits:
+            continue
+        used = 0
+        chosen: List[Tuple[int, int]] = []
+        for _, pos in _rank_hits(hits, radius):
+            if any(start <= pos < end for start, end in chosen):
+                continue
+            window = (max(0, pos - radius), min(len(text), pos + radius))
+            if chosen and used + window[1] - window[0] > max_chars:
+                break
+            chosen.append(window)
+            used += window[1] - window[0]
+        intervals.extend(chosen)
+
+    if not intervals:
+        return ""
+
+    intervals.sort()
+    merged = [list(intervals[0])]
+    for start, end in intervals[1:]:
+        if start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    fragments = []
+    for start, end in merged:
+        start, end = _snap(text, start, end)
+        fragments.append(text[start:end].strip())
+    return "\n...\n".join(fragment for fragment in fragments if fragment)
+
+
+def chunk_spans(text: str, size: int, overlap: int = 0) -> List[Tuple[int, int]]:
+    """Границы частей текста не длиннее size символов с перекрытием overlap: [(начало, конец)].
+
+    Граница части сдвигается к ближайшему переводу строки или пробелу, чтобы не резать слова.
+    """
+    if len(text) <= size:
+        return [(0, len(text))]
+    overlap = min(overlap, size // 2)
+    spans = []
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + size)
+        if end < len(text):
+            cut = text.rfind('\n', start + size // 2, end)
+            if cut == -1:
+                cut = text.rfind(' ', start + size // 2, end)
+            if cut != -1:
+                end = cut
+        spans.append((start, end))
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+        # Начало следующей части тоже выравниваем по пробелу
+        space = text.find(' ', start, end)
+        if space != -1:
+            start = space + 1
+    return spans
+
+
+def split_chunks(text: str, size: int, overlap: int = 0) -> List[str]:
+    """Разбиение текста на части не длиннее size символов с перекрытием overlap (см. chunk_spans)"""
+    return [text[start:end] for start, end in chunk_spans(text, size, overlap)]
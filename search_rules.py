@@ -0,0 +1,251 @@
+# search_rules.py
+"""Детерминированный поиск реквизитов (ИНН, ОГРН, КПП, БИК, счета, телефоны) без запроса к модели"""
+
+import re
+from typing import Callable, Dict, List, Optional, Pattern, Sequence, Tuple
+
+from search_retrieval import MIN_TERM_LEN, STOP_WORDS, WORD_RE, keyword_terms, normalize_word, words_match
+
+LABEL_WINDOW = 120  # Сколько символов после подписи просматривать в поисках значения
+LABEL_CONTEXT = 200  # Сколько символов строки перед подписью относится к ней («ИНН заказчика», «Заказчик: ИНН»)
+RULE_CONTEXT_CONFIDENCE = 0.6  # Минимальное сходство строки подписи с ключевой фразой, если подписей несколько
+EXCEL_LABEL_CONFIDENCE = 0.8  # Минимальная уверенность, при которой значение ячейки принимается без модели
+EXCEL_MAX_GAP = 3  # На сколько столбцов правее подписи может стоять значение
+EXCEL_MAX_LABEL_LEN = 300  # Более длинные ячейки подписями не считаем
+
+
+def _digits(value: str) -> List[int]:
+    return [int(ch) for ch in value if ch.isdigit()]
+
+
+def inn_is_valid(value: str) -> bool:
+    """Проверка контрольных цифр ИНН (10 цифр — организация, 12 — физлицо/ИП)"""
+    d = _digits(value)
+
+    def check(weights):
+        return sum(w * x for w, x in zip(weights, d)) % 11 % 10
+
+    if len(d) == 10:
+        return check([2, 4, 10, 3, 5, 9, 4, 6, 8]) == d[9]
+    if len(d) == 12:
+        return (check([7, 2, 4, 10, 3, 5, 9, 4, 6, 8]) == d[10]
+                and check([3, 7, 2, 4, 10, 3, 5, 9, 4, 6, 8]) == d[11])
+    return False
+
+
+def ogrn_is_valid(value: str) -> bool:
+    """Проверка контрольной цифры ОГРН (13 цифр) и ОГРНИП (15 цифр)"""
+    if not value.isdigit():
+        return False
+    if len(value) == 13:
+        return int(value[:12]) % 11 % 10 == int(value[12])
+    if len(value) == 15:
+        return int(value[:14]) % 13 % 10 == int(value[14])
+    return False
+
+
+def bank_account_is_valid(account: str, bik: str, correspondent: bool = False) -> bool:
+    """Проверка ключа расчётного (по 3 последним цифрам БИК) или корр. счёта (по 5-6 цифрам БИК)"""
+    if len(account) != 20 or not account.isdigit() or len(bik) != 9:
+        return False
+    prefix = '0' + bik[4:6] if correspondent else bik[-3:]
+    weights = [7, 1, 3] * 8
+    return sum(int(ch) * w for ch, w in zip(prefix + account, weights)) % 10 == 0
+
+
+class FieldRule:
+    """Правило поиска одного вида реквизита"""
+
+    def __init__(self, name: str, field_re: str, label_re: str, value_re: str,
+                 validate: Optional[Callable[[str, str], bool]] = None):
+        self.name = name
+        # Узнаём поле по наименованию данных и ключевым словам элемента config
+        self.field_re: Pattern = re.compile(field_re, re.IGNORECASE)
+        # Подпись значения в тексте документа
+        self.label_re: Pattern = re.compile(label_re, re.IGNORECASE)
+        self.value_re: Pattern = re.compile(value_re)
+        # validate(значение, весь текст) — проверка контрольных цифр
+        self.validate = validate
+
+    def candidates(self, text: str) -> List[Tuple[str, str]]:
+        """Корректные значения рядом с подписями: [(значение, строка подписи до значения)]"""
+        found = []
+        for label in self.label_re.finditer(text):
+            window = text[label.end():label.end() + LABEL_WINDOW]
+            for match in self.value_re.finditer(window):
+                value = re.sub(r'\s+', ' ', match.group().strip())
+                if self.validate is None or self.validate(value, text):
+                    line_start = max(text.rfind('\n', 0, label.start()) + 1, label.start() - LABEL_CONTEXT)
+                    found.append((value, text[line_start:label.end() + match.start()]))
+                    break
+        return found
+
+    def extract(self, text: str, keywords: Sequence[str] = ()) -> Optional[str]:
+        """Значение рядом с подписью, относящейся к ключевым словам элемента.
+
+        Если во фразе кроме самого реквизита («ИНН») нет уточнения, подходит только единственное
+        значение в документе. Если уточнение есть («ИНН заказчика»), значение берётся лишь из строки
+        подписи, где это уточнение встречается и которая похожа на ключевую фразу, — даже когда
+        значение в документе одно. Иначе None: значение выберет таблица Excel или модель.
+        """
+        found = self.candidates(text)
+        if not found:
+            return None
+        terms = keyword_terms(keywords)
+        qualifiers = [term for term in terms if not self.field_re.search(term)]
+        if not qualifiers:
+            return found[0][0] if len({value for value, _ in found}) == 1 else None
+        scored = sorted(((label_score(context, terms), value) for value, context in found
+                         if any(words_match(word, term) for word in _label_words(context) for term in qualifiers)),
+                        key=lambda h: -h[0])
+        if not scored:
+            return None
+        best_score, best_value = scored[0]
+        if best_score < RULE_CONTEXT_CONFIDENCE:
+            return None
+        if any(value != best_value and score >= best_score - 0.05 for score, value in scored[1:]):
+            return None
+        return best_value
+
+
+def _account_valid(correspondent: bool) -> Callable[[str, str], bool]:
+    def validate(value: str, text: str) -> bool:
+        bik = RULES_BY_NAME['bik'].extract(text)
+        # Без БИК ключ счёта не проверить — достаточно формата
+        return bik is None or bank_account_is_valid(value, bik, correspondent)
+    return validate
+
+
+def _phone_valid(value: str, text: str) -> bool:
+    return len(_digits(value)) in (10, 11)
+
+
+_NOT_LETTER_BEFORE = r'(?<![А-Яа-яЁёA-Za-z])'
+_NOT_LETTER_AFTER = r'(?![А-Яа-яЁёA-Za-z])'
+
+RULES: List[FieldRule] = [
+    FieldRule('inn', r'\bинн\b', _NOT_LETTER_BEFORE + r'ИНН' + _NOT_LETTER_AFTER,
+              r'(?<!\d)(?:\d{12}|\d{10})(?!\d)', lambda value, text: inn_is_valid(value)),
+    FieldRule('ogrn', r'\bогрн(?:ип)?\b', _NOT_LETTER_BEFORE + r'ОГРН(?:ИП)?' + _NOT_LETTER_AFTER,
+              r'(?<!\d)(?:\d{15}|\d{13})(?!\d)', lambda value, text: ogrn_is_valid(value)),
+    FieldRule('kpp', r'\bкпп\b', _NOT_LETTER_BEFORE + r'КПП' + _NOT_LETTER_AFTER,
+              r'(?<![\dA-Z])\d{4}[\dA-Z]{2}\d{3}(?![\dA-Z])'),
+    FieldRule('bik', r'\bбик\b', _NOT_LETTER_BEFORE + r'БИК' + _NOT_LETTER_AFTER,
+              r'(?<!\d)04\d{7}(?!\d)'),
+    FieldRule('correspondent_account', r'корр|к/с|корреспондент',
+              r'к/с|корр?\.?\s*сч[её]т|корреспондентский\s+сч[её]т',
+              r'(?<!\d)301\d{17}(?!\d)', _account_valid(correspondent=True)),
+    FieldRule('settlement_account', r'р/с|расч[её]тн',
+              r'р/с|р\.\s*с\.|расч[её]тный\s+сч[её]т',
+              r'(?<!\d)\d{20}(?!\d)', _account_valid(correspondent=False)),
+    FieldRule('phone', r'телефон|\bтел\b|факс',
+              _NOT_LETTER_BEFORE + r'(?:тел(?:ефон[аы]?)?|факс)' + _NOT_LETTER_AFTER + r'\.?',
+              r'(?<!\d)(?:\+7|8)[\s\-]*\(?\d{3,5}\)?[\s\-]*\d{1,3}[\s\-]*\d{2}[\s\-]*\d{2}(?!\d)', _phone_valid),
+]
+RULES_BY_NAME = {rule.name: rule for rule in RULES}
+
+
+def match_rule(data_name: str, keywords: List[str]) -> Optional[FieldRule]:
+    """Правило для элемента config; None, если поле не распознано или неоднозначно (например «ИНН/КПП»)"""
+    description = ' '.join([data_name] + list(keywords))
+    matched = [rule for rule in RULES if rule.field_re.search(description)]
+    return matched[0] if len(matched) == 1 else None
+
+
+def apply_rules(data_name: str, keywords: List[str], text: str) -> Optional[Tuple[str, str]]:
+    """Значение реквизита по правилам: (имя правила, значение) или None, если нужна модель.
+
+    Из нескольких подписей в документе выбирается та, что относится к ключевым словам элемента.
+    """
+    rule = match_rule(data_name, keywords)
+    if rule is None:
+        return None
+    value = rule.extract(text, keywords)
+    if value is None:
+        return None
+    return rule.name, value
+
+
+ExcelRow = Tuple[str, int, List[Tuple[int, str]]]
+
+
+def _label_words(text: str) -> List[str]:
+    words = []
+    for match in WORD_RE.finditer(text):
+        word = normalize_word(match.group())
+        if len(word) >= MIN_TERM_LEN and word not in STOP_WORDS:
+            words.append(word)
+    return words
+
+
+def label_score(cell_text: str, terms: Sequence[str]) -> float:
+    """Насколько текст ячейки похож на ключевую фразу (F1 по нечётко совпавшим словам)"""
+    words = _label_words(cell_text)
+    if not words or not terms:
+        return 0.0
+    recall = sum(1 for term in terms if any(words_match(word, term) for word in words)) / len(terms)
+    precision = sum(1 for word in words if any(words_match(word, term) for term in terms)) / len(words)
+    if not recall or not precision:
+        return 0.0
+    return 2 * precision * recall / (precision + recall)
+
+
+def resolve_excel_label(rows: Sequence[ExcelRow], keywords: Sequence[str]) -> Optional[Tuple[str, float, str]]:
+    """Значение рядом с подписью в таблице Excel: (значение, уверенность, адрес ячейки) или None.
+
+    Подпись ищется нечётким сравнением с ключевыми словами; значение берётся из ближайшей
+    непустой ячейки справа, а если её нет — из ячейки ниже.
+    """
+    terms = keyword_terms(keywords)
+    if not terms:
+        return None
+
+    grid: Dict[Tuple[str, int, int], str] = {}
+    candidates = []
+    for sheet, row, cells in rows:
+        for col, text in cells:
+            grid[(sheet, row, col)] = text
+            if len(text) <= EXCEL_MAX_LABEL_LEN:
+                score = label_score(text, terms)
+                if score >= EXCEL_LABEL_CONFIDENCE * 0.75:
+                    candidates.append((score, sheet, row, col))
+    if not candidates:
+        return None
+    candidates.sort(key=lambda c: -c[0])
+
+    def neighbour(sheet: str, row: int, col: int) -> Optional[Tuple[str, int, int, bool]]:
+        for next_col in range(col + 1, col + 1 + EXCEL_MAX_GAP):
+            if (sheet, row, next_col) in grid:
+                return grid[(sheet, row, next_col)], row, next_col, True
+        if (sheet, row + 1, col) in grid:
+            return grid[(sheet, row + 1, col)], row + 1, col, False
+        return None
+
+    resolved = []
+    for score, sheet, row, col in candidates:
+        found = neighbour(sheet, row, col)
+        if found is None:
+            continue
+        value, value_row, value_col, to_the_right = found
+        # Соседняя ячейка сама похожа на подпись — это заголовок таблицы, а не значение
+        if label_score(value, terms) >= score:
+            continue
+        confidence = score if to_the_right else score * 0.9
+        resolved.append((confidence, value, f"{sheet}!{_column_letter(value_col)}{value_row}"))
+    if not resolved:
+        return None
+
+    resolved.sort(key=lambda r: -r[0])
+    confidence, value, cell = resolved[0]
+    # Почти такие же подписи с другим значением — ответ неоднозначен
+    if any(other_value != value and other_conf >= confidence - 0.05 for other_conf, other_value, _ in resolved[1:]):
+        confidence *= 0.8
+    return value, round(confidence, 3), cell
+
+
+def _column_letter(col: int) -> str:
+    letters = ''
+    while col:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(ord('A') + rem) + letters
+    return letters
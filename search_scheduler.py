@@ -0,0 +1,201 @@
+# search_scheduler.py
+"""Планировщик запросов к модели с учётом ограничений частоты (search.py)"""
+
+import email.utils
+import random
+import threading
+import time
+from typing import Callable, Optional, TypeVar
+
+import requests
+
+from search_cancel import CancelToken, Cancelled
+
+MAX_ATTEMPTS = 5  # Попыток на один запрос, включая первую
+BACKOFF_BASE = 1.0  # Начальная пауза перед повтором, с (удваивается с каждой попыткой)
+BACKOFF_MAX = 60.0  # Наибольшая пауза перед повтором, с
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+T = TypeVar('T')
+
+
+class RetryableError(Exception):
+    """Временная ошибка провайдера: запрос можно повторить.
+
+    throttled — сработало ограничение частоты (429), retry_after — пауза из заголовка Retry-After, с.
+    """
+
+    def __init__(self, message: str, retry_after: Optional[float] = None, throttled: bool = False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.throttled = throttled
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Заголовок Retry-After в секундах: число секунд или HTTP-дата"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        moment = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, moment.timestamp() - time.time())
+
+
+def check_response(response: requests.Response):
+    """Поднимает RetryableError для ответов 429 и 5xx"""
+    if response.status_code in RETRY_STATUSES:
+        raise RetryableError(f"status={response.status_code}, body={response.text[:300]}",
+                             retry_after=parse_retry_after(response.headers.get('Retry-After')),
+                             throttled=response.status_code == 429)
+
+
+class TokenBucket:
+    """Ведро токенов: не больше rate запросов в секунду в среднем и burst подряд"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, cancel: Optional[CancelToken] = None):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            if cancel is None:
+                time.sleep(wait)
+            elif cancel.wait(wait):
+                raise Cancelled(cancel.reason)
+
+
+class RequestScheduler:
+    """Выполнение запросов с ограничением частоты, адаптивным числом одновременных запросов и повторами.
+
+    Число одновременных запросов растёт на единицу после серии успешных ответов и уменьшается вдвое
+    при 429 (AIMD). Повторы — после паузы из Retry-After или экспоненциальной паузы со случайным
+    разбросом; при 429 пауза действует на все потоки.
+    """
+
+    def __init__(self, max_concurrency: int, requests_per_minute: Optional[float] = None,
+                 max_attempts: int = MAX_ATTEMPTS, backoff_base: float = BACKOFF_BASE,
+                 backoff_max: float = BACKOFF_MAX):
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = float(self.max_concurrency)
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.bucket = TokenBucket(requests_per_minute / 60.0, burst=self.max_concurrency) \
+            if requests_per_minute else None
+        self.retries = 0
+        self.throttled = 0
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+
+    def _acquire(self, cancel: Optional[CancelToken] = None):
+        with self._cond:
+            while True:
+                if cancel is not None and cancel.cancelled:
+                    raise Cancelled(cancel.reason)
+                pause = self._paused_until - time.monotonic()
+                if pause <= 0 and self._in_flight < int(self.limit):
+                    break
+                self._cond.wait(timeout=pause if pause > 0 else None)
+            self._in_flight += 1
+        if self.bucket is not None:
+            try:
+                self.bucket.acquire(cancel)
+            except Cancelled:
+                self._release(success=False)
+                raise
+
+    def _release(self, success: bool, throttled: bool = False):
+        with self._cond:
+            self._in_flight -= 1
+            if throttled:
+                self.limit = max(1.0, self.limit / 2)
+            elif success:
+                # Примерно +1 к пределу за каждые limit успешных запросов
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def _wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def _pause(self, seconds: float):
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def backoff(self, attempt: int) -> float:
+        """Экспоненциальная пауза перед повтором с полным случайным разбросом"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    def run(self, send: Callable[[], T], logger=None, cancel: Optional[CancelToken] = None,
+            on_retry: Optional[Callable[[], None]] = None) -> T:
+        """Выполняет send() в свободном слоте, повторяя при RetryableError и сетевых ошибках.
+
+        После max_attempts неудачных попыток поднимает последнюю ошибку. После отмены cancel
+        ожидание слота и паузы прерываются, а ошибка оборванного запроса не повторяется —
+        поднимается Cancelled. on_retry() вызывается перед каждым повтором.
+        """
+        if cancel is None:
+            return self._run(send, logger, None, on_retry)
+        with cancel.on_cancel(self._wake):
+            return self._run(send, logger, cancel, on_retry)
+
+    def _run(self, send: Callable[[], T], logger, cancel: Optional[CancelToken],
+             on_retry: Optional[Callable[[], None]]) -> T:
+        attempt = 0
+        while True:
+            attempt += 1
+            self._acquire(cancel)
+            try:
+                result = send()
+            except RetryableError as e:
+                error, delay, throttled = e, e.retry_after, e.throttled
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error, delay, throttled = e, None, False
+            except BaseException as e:
+                self._release(success=False)
+                if cancel is not None and cancel.cancelled and not isinstance(e, Cancelled):
+                    raise Cancelled(cancel.reason) from e
+                raise
+            else:
+                self._release(success=True)
+                return result
+
+            self._release(success=False, throttled=throttled)
+            if cancel is not None and cancel.cancelled:
+                raise Cancelled(cancel.reason) from error
+            if attempt >= self.max_attempts:
+                raise error
+            if delay is None:
+                delay = self.backoff(attempt)
+            with self._cond:
+                self.retries += 1
+                if throttled:
+                    self.throttled += 1
+            if on_retry is not None:
+                on_retry()
+            if throttled:
+                self._pause(delay)
+            if logger:
+                reason = "ограничение частоты" if throttled else f"ошибка: {error}"
+                logger(f"  ↻ Повтор запроса через {delay:.1f} с ({reason}), попытка {attempt + 1}/{self.max_attempts}")
+            if cancel is None:
+                time.sleep(delay)
+            elif cancel.wait(delay):
+                raise Cancelled(cancel.reason)
@@ -0,0 +1,1668 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the document search pipeline (search.py) without GUI and AI provider
+"""
+
+import io
+import json
+import os
+import tempfile
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import docx
+import fitz
+from openpyxl import Workbook
+
+import search
+import search_bench
+import search_cli
+from search import AIInterface, DocumentExtractor, DocumentProcessor, extract_files_parallel
+from search_cache import DiskCache, ExtractionCache, TextCache
+from search_cancel import CancelToken, Cancelled
+from search_index import ChunkIndex
+from search_log import QueuedLog
+from search_scheduler import RequestScheduler, TokenBucket, parse_retry_after
+from search_retrieval import select_windows
+from search_rules import apply_rules, inn_is_valid, ogrn_is_valid
+
+
+class CountingExtractor:
+    """Заглушка извлечения текста, считающая обращения к каждому файлу"""
+
+    def __init__(self, text="ИНН 7735525751"):
+        self.text = text
+        self.calls = {}
+
+    def _extract(self, file_path):
+        self.calls[file_path.name] = self.calls.get(file_path.name, 0) + 1
+        return self.text
+
+    extract_from_word = extract_from_excel = extract_from_pdf = _extract
+
+
+class MisbehavingExtractor:
+    """Извлечение для пула процессов: Word падает, PDF зависает, Excel работает"""
+
+    def extract_from_word(self, file_path):
+        os._exit(1)
+
+    def extract_from_pdf(self, file_path):
+        time.sleep(60)
+        return "never"
+
+    def extract_from_excel(self, file_path):
+        return f"text of {file_path.name}"
+
+
+class EchoAI:
+    """Заглушка AIInterface, возвращающая фиксированный ответ"""
+
+    def __init__(self, answer="7735525751"):
+        self.answer = answer
+        self.queries = 0
+
+    def query_model(self, text, keywords, logger=None):
+        self.queries += 1
+        return self.answer
+
+    def query_batch(self, text, fields, logger=None):
+        self.queries += 1
+        return [self.answer] * len(fields)
+
+
+class SlowAI:
+    """Заглушка AIInterface с задержкой ответа и подсчётом одновременных запросов"""
+
+    def __init__(self, delay=0.2, max_concurrency=4):
+        self.delay = delay
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def query_model(self, text, keywords, logger=None):
+        with self._lock:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+        return f"value for {keywords[0]}"
+
+
+class ScriptedAI(AIInterface):
+    """AIInterface с подменённым HTTP-вызовом: ответы берутся из списка"""
+
+    def __init__(self, answers):
+        super().__init__(provider="ollama", use_response_cache=False)
+        self.answers = list(answers)
+        self.prompts = []
+
+    def generate(self, prompt, logger=None, max_tokens=500, json_mode=False):
+        self.prompts.append(prompt)
+        return self.answers.pop(0)
+
+
+def _make_project(items, files):
+    """Создает временный проект с config.json и пустыми файлами"""
+    temp_dir = tempfile.mkdtemp()
+    root = os.path.join(temp_dir, "project")
+    os.makedirs(root)
+    for name in files:
+        Path(root, name).write_bytes(name.encode('utf-8'))
+    config_path = Path(temp_dir, "config.json")
+    config_path.write_text(json.dumps({"root": root, "items": items}, ensure_ascii=False), encoding='utf-8')
+    return temp_dir, config_path
+
+
+def test_text_cache_lru_eviction():
+    """Test that the in-run text cache evicts least recently used entries over budget"""
+    print("Testing TextCache LRU eviction...")
+
+    one = "а" * 1000
+    cache = TextCache(max_bytes=TextCache._size_of(one) * 2)
+    cache.put("a", one)
+    cache.put("b", "б" * 1000)
+    assert cache.get("a") == one
+    cache.put("c", "в" * 1000)
+
+    assert "a" in cache and "c" in cache, "Recently used entries must stay"
+    assert "b" not in cache, "Least recently used entry must be evicted"
+    assert cache.current_bytes <= cache.max_bytes
+
+    cache.put("huge", "г" * 10000)
+    assert "huge" not in cache, "Entry larger than the budget must not be cached"
+
+    print("✓ TextCache LRU eviction test passed")
+
+
+def test_each_file_extracted_once():
+    """Test that items sharing a source file trigger a single extraction"""
+    print("Testing single extraction per unique file...")
+
+    items = [
+        {"data_name": f"Поле {i}", "file": "card.docx" if i % 2 else "Лист.xlsx",
+         "type": "word" if i % 2 else "excel", "keywords": ["инн"]}
+        for i in range(10)
+    ]
+    temp_dir, config_path = _make_project(items, ["card.docx", "Лист.xlsx"])
+    old_config, old_output = search.CONFIG_FILE, search.OUTPUT_FILE
+    search.CONFIG_FILE = config_path
+    search.OUTPUT_FILE = Path(temp_dir, "data.json")
+    try:
+        processor = DocumentProcessor(lambda msg: None, use_disk_cache=False, extraction_workers=0)
+        processor.extractor = CountingExtractor()
+        processor.set_ai_interface(EchoAI())
+        results = processor.process_documents()
+    finally:
+        search.CONFIG_FILE, search.OUTPUT_FILE = old_config, old_output
+        shutil.rmtree(temp_dir)
+
+    assert len(results) == 10
+    assert [r['data_name'] for r in results] == [i['data_name'] for i in items], "Results must keep config order"
+    assert all(r['status'] == 'found' for r in results)
+    assert processor.extractor.calls == {"card.docx": 1, "Лист.xlsx": 1}, processor.extractor.calls
+
+    print("✓ Single extraction per unique file test passed")
+
+
+def test_extraction_cache_persists_between_runs():
+    """Test that unchanged documents are loaded from the on-disk cache on the next run"""
+    print("Testing persistent extraction cache...")
+
+    items = [
+        {"data_name": "ИНН", "file": "card.docx", "type": "word", "keywords": ["инн"]},
+        {"data_name": "КПП", "file": "Лист.xlsx", "type": "excel", "keywords": ["кпп"]},
+    ]
+    temp_dir, config_path = _make_project(items, ["card.docx", "Лист.xlsx"])
+    old = search.CONFIG_FILE, search.OUTPUT_FILE, search.CACHE_DIR
+    search.CONFIG_FILE = config_path
+    search.OUTPUT_FILE = Path(temp_dir, "data.json")
+    search.CACHE_DIR = Path(temp_dir, "cache")
+    logs = []
+    try:
+        first = DocumentProcessor(lambda msg: None, extraction_workers=0)
+        first.extractor = CountingExtractor()
+        first.set_ai_interface(EchoAI())
+        first.process_documents()
+        assert first.extraction_cache.misses == 2 and first.extraction_cache.hits == 0
+
+        second = DocumentProcessor(logs.append, extraction_workers=0)
+        second.extractor = CountingExtractor()
+        second.set_ai_interface(EchoAI())
+        results = second.process_documents()
+        second.print_report(results)
+        assert second.extractor.calls == {}, "Unchanged files must not be re-extracted"
+        assert second.extraction_cache.hits == 2
+
+        # Изменённый файл извлекается заново
+        Path(temp_dir, "project", "card.docx").write_bytes(b"changed contents")
+        third = DocumentProcessor(lambda msg: None, extraction_workers=0)
+        third.extractor = CountingExtractor()
+        third.set_ai_interface(EchoAI())
+        third.process_documents()
+        assert third.extractor.calls == {"card.docx": 1}, third.extractor.calls
+
+        # Файлы без записей в кэше (например, с ошибкой извлечения) не копятся в files.json
+        cache = ExtractionCache(Path(temp_dir, "pruned"), 10 ** 6)
+        kept, dropped = Path(temp_dir, "project", "card.docx"), Path(temp_dir, "project", "Лист.xlsx")
+        cache.put_text(kept, "word", "текст")
+        cache.fingerprint(dropped)
+        cache.flush()
+        assert set(ExtractionCache(Path(temp_dir, "pruned"), 10 ** 6)._files) == {str(kept.resolve())}
+    finally:
+        search.CONFIG_FILE, search.OUTPUT_FILE, search.CACHE_DIR = old
+        shutil.rmtree(temp_dir)
+
+    assert any("Кэш извлечения: попаданий 2, промахов 0" in line for line in logs)
+
+    print("✓ Persistent extraction cache test passed")
+
+
+def test_parallel_extraction_isolates_failures():
+    """Test that a crashing or hanging file does not break extraction of the others"""
+    print("Testing parallel extraction crash isolation and timeout...")
+
+    jobs = [("a.xlsx", "excel"), ("crash.docx", "word"), ("hang.pdf", "pdf"), ("b.xlsx", "excel")]
+    started = time.monotonic()
+    results = {path: text for path, _, text in
+               extract_files_parallel(jobs, workers=2, timeout=3, extractor=MisbehavingExtractor())}
+    elapsed = time.monotonic() - started
+
+    assert set(results) == {"a.xlsx", "crash.docx", "hang.pdf", "b.xlsx"}, results
+    assert results["a.xlsx"] == "text of a.xlsx"
+    assert results["b.xlsx"] == "text of b.xlsx"
+    assert results["crash.docx"].startswith("Ошибка при извлечении"), results["crash.docx"]
+    assert results["hang.pdf"].startswith("Ошибка при извлечении"), results["hang.pdf"]
+    assert elapsed < 30, f"Hanging file must be cut off by timeout, took {elapsed:.1f}s"
+
+    # Единственный файл запуска тоже извлекается в процессе пула с таймаутом
+    processor = DocumentProcessor(lambda msg: None, use_disk_cache=False, extraction_workers=1,
+                                  extraction_timeout=2)
+    processor.extractor = MisbehavingExtractor()
+    started = time.monotonic()
+    [(_, _, text)] = list(processor._extraction_stage([(Path("hang.pdf"), "pdf")]))
+    assert text.startswith("Ошибка при извлечении"), text
+    assert time.monotonic() - started < 20
+
+    print("✓ Parallel extraction crash isolation test passed")
+
+
+def test_concurrent_queries_keep_config_order():
+    """Test that model queries run concurrently within the limit and results keep config order"""
+    print("Testing concurrent model queries...")
+
+    items = [{"data_name": f"Поле {i}", "file": "card.docx", "type": "word", "keywords": [f"kw{i}"]}
+             for i in range(8)]
+    temp_dir, config_path = _make_project(items, ["card.docx"])
+    old_config, old_output = search.CONFIG_FILE, search.OUTPUT_FILE
+    search.CONFIG_FILE = config_path
+    search.OUTPUT_FILE = Path(temp_dir, "data.json")
+    try:
+        processor = DocumentProcessor(lambda msg: None, use_disk_cache=False, extraction_workers=0,
+                                      batch_fields=False)
+        processor.extractor = CountingExtractor()
+        ai = SlowAI(delay=0.2, max_concurrency=4)
+        processor.set_ai_interface(ai)
+        started = time.monotonic()
+        results = processor.process_documents()
+        elapsed = time.monotonic() - started
+    finally:
+        search.CONFIG_FILE, search.OUTPUT_FILE = old_config, old_output
+        shutil.rmtree(temp_dir)
+
+    assert [r['extracted_value'] for r in results] == [f"value for kw{i}" for i in range(8)]
+    assert ai.peak <= 4, f"In-flight requests exceeded the limit: {ai.peak}"
+    assert ai.peak > 1, "Queries must run concurrently"
+    assert elapsed < 8 * 0.2, f"Concurrent run must be faster than sequential, took {elapsed:.2f}s"
+
+    print("✓ Concurrent model queries test passed")
+
+
+def test_batched_prompt_with_single_retry():
+    """Test that fields of one file share a prompt and only unparsed fields are re-asked"""
+    print("Testing batched multi-field prompts...")
+
+    items = [
+        {"data_name": "Наименование", "file": "card.docx", "type": "word", "keywords": ["наименование"]},
+        {"data_name": "Наименование (копия)", "file": "card.docx", "type": "word", "keywords": ["наименование"]},
+        {"data_name": "Адрес", "file": "card.docx", "type": "word", "keywords": ["адрес"]},
+        {"data_name": "Директор", "file": "card.docx", "type": "word", "keywords": ["директор"]},
+    ]
+    temp_dir, config_path = _make_project(items, ["card.docx"])
+    old_config, old_output = search.CONFIG_FILE, search.OUTPUT_FILE
+    search.CONFIG_FILE = config_path
+    search.OUTPUT_FILE = Path(temp_dir, "data.json")
+    ai = ScriptedAI([
+        '<think>...</think>```json\n{"1": "ООО «АБЕОНА»", "2": null}\n```',
+        "Иванов И.И.",
+    ])
+    try:
+        processor = DocumentProcessor(lambda msg: None, use_disk_cache=False, extraction_workers=0)
+        processor.extractor = CountingExtractor()
+        processor.set_ai_interface(ai)
+        results = processor.process_documents()
+    finally:
+        search.CONFIG_FILE, search.OUTPUT_FILE = old_config, old_output
+        shutil.rmtree(temp_dir)
+        ai.stop()
+
+    assert len(ai.prompts) == 2, f"Expected one batch prompt and one retry, got {len(ai.prompts)}"
+    assert '"наименование"' in ai.prompts[0] and '"адрес"' in ai.prompts[0] and '"директор"' in ai.prompts[0]
+    assert ai.prompts[0].count('"наименование"') == 1, "Duplicate (file, keywords) pairs must be collapsed"
+    assert "директор" in ai.prompts[1] and "адрес" not in ai.prompts[1]
+    assert [r['extracted_value'] for r in results] == ["ООО «АБЕОНА»", "ООО «АБЕОНА»", "null", "Иванов И.И."]
+    assert [r['status'] for r in results] == ['found', 'found', 'not_found', 'found']
+
+    print("✓ Batched multi-field prompts test passed")
+
+
+def test_keyword_windows_shrink_prompt():
+    """Test that only fragments around fuzzy keyword hits are sent to the model"""
+    print("Testing keyword-window retrieval...")
+
+    text = ("Общие положения договора. " * 2000
+            + "Полное наименование организации лица подготавливающего проектную документацию: ООО «Ромашка». "
+            + "Прочие условия. " * 3000)
+    keywords = ["Полное наименование организации лица подгтавливающего проектную документацию"]
+
+    context = select_windows(text, [keywords], max_chars=2000, radius=600)
+    assert "ООО «Ромашка»" in context, "Fragment with the typo'd keyword must be found"
+    assert len(context) <= 2000, f"Context exceeds budget: {len(context)}"
+    assert select_windows(text, [["совершенно отсутствующее словосочетание"]], max_chars=2000) == ""
+
+    processor = DocumentProcessor(lambda msg: None, use_disk_cache=False, retrieval_max_chars=2000,
+                                  use_index=False)
+    lines = []
+    assert processor._select_context(text, [tuple(keywords)], lines.append) == context
+    assert processor._select_context(text, [("отсутствующее словосочетание",)], lines.append) == text, \
+        "Without hits the whole text must be sent"
+
+    print("✓ Keyword-window retrieval test passed")
+
+
+def test_rules_answer_pattern_fields_without_model():
+    """Test that INN/OGRN/KPP/phone fields are answered by rules and marked in results"""
+    print("Testing deterministic rules for pattern-shaped fields...")
+
+    card = ("Полное наименование: ООО «АБЕОНА»\n"
+            "ИНН/КПП 7735525751/773501001\n"
+            "ОГРН | 1027700132195\n"
+            "Телефон/факс: +7 (495) 123-45-67\n")
+    assert inn_is_valid("7735525751") and not inn_is_valid("7735525752")
+    assert ogrn_is_valid("1027700132195") and not ogrn_is_valid("1027700132196")
+    assert apply_rules("ИНН ПГ", ["инн"], card) == ("inn", "7735525751")
+    assert apply_rules("КПП ПГ", ["кпп"], card) == ("kpp", "773501001")
+    assert apply_rules("Тел ПГ", ["Телефон/факс"], card) == ("phone", "+7 (495) 123-45-67")
+    assert apply_rules("Тел ПГ", ["Телефон/факс лица подгтавливающего"], card) is None, \
+        "A party named in the keywords must appear in the label line"
+    assert apply_rules("ИНН ПГ", ["инн"], "ИНН 7735525752") is None, "Invalid checksum must be rejected"
+    assert apply_rules("Наименование", ["наименование"], card) is None
+
+    # Реквизиты нескольких сторон: значение берётся из строки, подпись которой совпадает с ключевой фразой
+    parties = ("ИНН лица подготавливающего проектную документацию | 7735525751\n"
+               "ИНН организации представителя заказчика | 7707083893\n"
+               "ИНН саморегулируемой организации представителя заказчика | 7702070139\n")
+    assert apply_rules("ИНН ДЗ", ["ИНН организации представителя заказчика"], parties) == ("inn", "7707083893")
+    assert apply_rules("ИНН ПГ", ["ИНН лица подгтавливающего проектную документацию"], parties) == \
+        ("inn", "7735525751")
+    assert apply_rules("ИНН СРО ДЗ", ["ИНН саморгулироемой организации представителя заказчика"], parties) == \
+        ("inn", "7702070139")
+    assert apply_rules("ИНН", ["инн"], parties) is None, "Several parties without a qualifier are ambiguous"
+    assert apply_rules("ИНН ДС", ["ИНН Представитель лица", "осуществляющего строительство"], parties) is None
+    assert apply_rules("ИНН СРО", ["ИНН СРО лица подготавливающего проектную документацию"], card) is None, \
+        "The only INN in the document belongs to another party"
+    # «тел» внутри слова («Представитель») — не подпись телефона, часть ОГРН — не номер
+    assert apply_rules("Тел ДС", ["Телефон/факс Представитель лица"],
+                       "ОГРН Представитель лица | 1187746123456\n") is None
+    assert apply_rules("Тел", ["телефон"], "Тел. 8 (495) 123-45-67, ОГРН 1187746123456") == \
+        ("phone", "8 (495) 123-45-67")
+
+    items = [
+        {"data_name": "ИНН ПГ", "file": "card.docx", "type": "word", "keywords": ["инн"]},
+        {"data_name": "ОГРН ПГ", "file": "card.docx", "type": "word", "keywords": ["огрн"]},
+        {"data_name": "Наименование", "file": "card.docx", "type": "word", "keywords": ["наименование"]},
+    ]
+    temp_dir, config_path = _make_project(items, ["card.docx"])
+    old_config, old_output = search.CONFIG_FILE, search.OUTPUT_FILE
+    search.CONFIG_FILE = config_path
+    search.OUTPUT_FILE = Path(temp_dir, "data.json")
+    logs = []
+    try:
+        processor = DocumentProcessor(logs.append, use_disk_cache=False, extraction_workers=0)
+        processor.extractor = CountingExtractor(card)
+        ai = EchoAI("ООО «АБЕОНА»")
+        processor.set_ai_interface(ai)
+        results = processor.process_documents()
+        processor.print_report(results)
+    finally:
+        search.CONFIG_FILE, search.OUTPUT_FILE = old_config, old_output
+        shutil.rmtree(temp_dir)
+
+    assert ai.queries == 1, f"Only the name must go to the model, got {ai.queries} queries"
+    assert [r.get('source') for r in results] == ['rule', 'rule', 'model']
+    assert results[0]['rule'] == 'inn' and results[1]['extracted_value'] == '1027700132195'
+    assert any("Найдено правилами без запроса к модели: 2" in line for line in logs)
+
+    print("✓ Deterministic rules test passed")
+
+
+def test_response_cache_returns_unchanged_prompts():
+    """Test that repeated prompts are answered from the on-disk response cache"""
+    print("Testing persistent model response cache...")
+
+    class CountingAI(AIInterface):
+        requests_sent = 0
+
+        def _request(self, prompt, logger=None, max_tokens=500, json_mode=False):
+            CountingAI.requests_sent += 1
+            return "ООО «АБЕОНА»"
+
+    temp_dir = tempfile.mkdtemp()
+    old_cache_dir = search.CACHE_DIR
+    search.CACHE_DIR = Path(temp_dir)
+    try:
+        first = CountingAI(provider="ollama")
+        assert first.query_model("текст", ["наименование"]) == "ООО «АБЕОНА»"
+        assert first.response_cache.misses == 1
+        # Индекс кэша пишется на диск не на каждую запись, а при остановке провайдера
+        assert not Path(temp_dir, "responses", "index.json").exists()
+        first.stop()
+        assert Path(temp_dir, "responses", "index.json").exists()
+
+        second = CountingAI(provider="ollama")
+        assert second.query_model("текст", ["наименование"]) == "ООО «АБЕОНА»"
+        assert second.response_cache.hits == 1
+        assert CountingAI.requests_sent == 1, "Cached prompt must not reach the model"
+
+        # Другая модель или другой промпт — промах
+        CountingAI(provider="ollama", model="other").query_model("текст", ["наименование"])
+        second.query_model("другой текст", ["наименование"])
+        assert CountingAI.requests_sent == 3
+
+        second.response_cache.clear()
+        assert len(CountingAI(provider="ollama").response_cache) == 0
+
+        # Размер кэша учитывается без пересчёта: вытесняются самые давние записи
+        small = DiskCache(Path(temp_dir, "small"), max_bytes=200)
+        for n in range(20):
+            small.put(f"k{n}", os.urandom(40).hex())
+        assert small.current_bytes == sum(meta['bytes'] for meta in small._index.values()) <= 200
+        assert "k19" in small._index and "k0" not in small._index
+    finally:
+        search.CACHE_DIR = old_cache_dir
+        shutil.rmtree(temp_dir)
+
+    print("✓ Persistent model response cache test passed")
+
+
+def test_incremental_run_reprocesses_only_changes():
+    """Test that an incremental run carries forward unchanged found items"""
+    print("Testing incremental re-extraction...")
+
+    items = [
+        {"data_name": "Наименование", "file": "card.docx", "type": "word", "keywords": ["наименование"]},
+        {"data_name": "Адрес", "file": "card.docx", "type": "word", "keywords": ["адрес"]},
+        {"data_name": "Директор", "file": "list.xlsx", "type": "excel", "keywords": ["директор"]},
+    ]
+    temp_dir, config_path = _make_project(items, ["card.docx", "list.xlsx"])
+    old = search.CONFIG_FILE, search.OUTPUT_FILE, search.CACHE_DIR
+    search.CONFIG_FILE = config_path
+    search.OUTPUT_FILE = Path(temp_dir, "data.json")
+    search.CACHE_DIR = Path(temp_dir, "cache")
+
+    def run(ai):
+        processor = DocumentProcessor(lambda msg: None, extraction_workers=0, batch_fields=False,
+                                      incremental=True)
+        processor.extractor = CountingExtractor()
+        processor.set_ai_interface(ai)
+        results = processor.process_documents()
+        processor.save_results(results)
+        return processor, results
+
+    try:
+        _, first = run(EchoAI("значение"))
+        assert all(r['status'] == 'found' and r.get('file_fingerprint') for r in first)
+
+        # Ничего не изменилось — модель не вызывается, извлечения нет
+        ai = EchoAI("значение")
+        processor, second = run(ai)
+        assert ai.queries == 0 and processor.extractor.calls == {}
+        assert second == first
+
+        # Изменились ключевые слова одного элемента и содержимое другого файла
+        items[1]["keywords"] = ["юридический адрес"]
+        config_path.write_text(json.dumps({"root": os.path.join(temp_dir, "project"), "items": items},
+                                          ensure_ascii=False), encoding='utf-8')
+        Path(temp_dir, "project", "list.xlsx").write_bytes(b"new registry")
+        ai = EchoAI("новое значение")
+        processor, third = run(ai)
+        assert ai.queries == 2, ai.queries
+        assert [r['extracted_value'] for r in third] == ["значение", "новое значение", "новое значение"]
+    finally:
+        search.CONFIG_FILE, search.OUTPUT_FILE, search.CACHE_DIR = old
+        shutil.rmtree(temp_dir)
+
+    print("✓ Incremental re-extraction test passed")
+
+
+class StreamingOllamaHandler(BaseHTTPRequestHandler):
+    """Ollama /api/generate в потоковом режиме: длинный <think>, ответ и бесконечное продолжение"""
+
+    tokens_sent = 0
+    tokens = (["<think>"] + ["рассуждение "] * 50 + ["</think>", "ООО ", "«АБЕОНА»", "\n"]
+              + ["Объяснение: значение взято из таблицы. "] * 10000)
+    first_delay = 0.0  # Обработка промпта до первого токена, с
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        time.sleep(self.first_delay)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        try:
+            for token in self.tokens:
+                self.wfile.write(json.dumps({"response": token, "done": False}).encode() + b"\n")
+                self.wfile.flush()
+                StreamingOllamaHandler.tokens_sent += 1
+                time.sleep(0.001)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def test_streaming_stops_at_first_answer_line():
+    """Test that streamed Ollama generation is cut off once the answer line is complete"""
+    print("Testing streaming Ollama responses with early cutoff...")
+
+    assert not AIInterface.answer_complete("<think>ООО\n")
+    assert AIInterface.answer_complete("<think>...</think>ООО «АБЕОНА»\n")
+    assert not AIInterface.answer_complete('{"1": "a}b"', json_mode=True)
+    assert AIInterface.answer_complete('{"1": "a}b", "2": null}', json_mode=True)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StreamingOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    ai = AIInterface(provider="ollama", use_response_cache=False)
+    ai.base_url = f"http://127.0.0.1:{server.server_port}"
+    try:
+        started = time.monotonic()
+        answer = ai.query_model("текст", ["наименование"])
+        elapsed = time.monotonic() - started
+    finally:
+        ai.stop()
+        server.shutdown()
+        server.server_close()
+
+    assert answer == "ООО «АБЕОНА»", answer
+    assert elapsed < 5, f"Generation must stop at the first answer line, took {elapsed:.1f}s"
+    assert StreamingOllamaHandler.tokens_sent < 1000, StreamingOllamaHandler.tokens_sent
+
+    # Рассуждение, оборванное пределом токенов, — не ответ и в кэш не попадает
+    temp_dir = tempfile.mkdtemp()
+    old_cache_dir = search.CACHE_DIR
+    search.CACHE_DIR = Path(temp_dir)
+    StreamingOllamaHandler.tokens = ["<think>\n", "Хорошо, мне нужно найти ИНН.\n"] + ["рассуждение\n"] * 10000
+    # Первый токен дольше бюджета генерации: бюджет отсчитывается с первого токена
+    StreamingOllamaHandler.first_delay = 1.5
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StreamingOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    ai = AIInterface(provider="ollama")
+    ai.base_url = f"http://127.0.0.1:{server.server_port}"
+    ai.stream_max_tokens = 50
+    ai.stream_max_seconds = 1
+    logs = []
+    try:
+        assert ai.query_model("текст", ["ИНН"], logger=logs.append) == "null"
+        assert len(ai.response_cache) == 0, "A cut-off answer must not be cached"
+        assert ai.scheduler.retries == 0, logs
+    finally:
+        ai.stop()
+        server.shutdown()
+        server.server_close()
+        search.CACHE_DIR = old_cache_dir
+        shutil.rmtree(temp_dir)
+    assert any("предел 50 токенов" in line for line in logs), logs
+
+    print("✓ Streaming Ollama responses test passed")
+
+
+def test_excel_rows_streamed_without_dataframes():
+    """Test that Excel extraction keeps every row (including the first) with cells joined per row"""
+    print("Testing streaming Excel extraction...")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.title = "КП ПГ"
+        sheet.append(["Телефон/факс", "+7 (495) 123-45-67"])
+        sheet.append([None, None])
+        sheet.append(["ИНН", 7735525751.0, None, "примечание\nв две строки"])
+        workbook.create_sheet("Пустой")
+        file_path = Path(temp_dir, "Лист Microsoft Excel.xlsx")
+        workbook.save(file_path)
+
+        text = DocumentExtractor.extract_from_excel(file_path)
+        rows = list(DocumentExtractor.iter_excel_rows(file_path))
+    finally:
+        shutil.rmtree(temp_dir)
+
+    assert text == ("[КП ПГ]\n"
+                    "Телефон/факс | +7 (495) 123-45-67\n"
+                    "ИНН | 7735525751 | примечание в две строки"), text
+    assert rows[1] == ("КП ПГ", 3, [(1, "ИНН"), (2, "7735525751"), (4, "примечание\nв две строки")])
+
+    print("✓ Streaming Excel extraction test passed")
+
+
+def test_excel_label_resolver_skips_model():
+    """Test that Excel values next to a fuzzy-matched label are taken without the model"""
+    print("Testing Excel label-to-value resolver...")
+
+    items = [
+        {"data_name": "Полное наименоване ПГ", "file": "Лист.xlsx", "type": "excel",
+         "keywords": ["Полное наименование организации лица подгтавливающего проектную документацию"]},
+        {"data_name": "Сокращенное наименование ПГ", "file": "Лист.xlsx", "type": "excel",
+         "keywords": ["Сокращенное наименование организации лица подгтавливающего проектную документацию"]},
+        {"data_name": "Юр адрес ПГ", "file": "Лист.xlsx", "type": "excel",
+         "keywords": ["Юридический адес лица подгтавливающего проектную документацию"]},
+        {"data_name": "Номер СРО", "file": "Лист.xlsx", "type": "excel", "keywords": ["Номер свидетельства СРО"]},
+        {"data_name": "ИНН ПГ", "file": "Лист.xlsx", "type": "excel",
+         "keywords": ["ИНН лица подгтавливающего проектную документацию"]},
+        {"data_name": "ИНН ДЗ", "file": "Лист.xlsx", "type": "excel",
+         "keywords": ["ИНН организации представителя заказчика"]},
+    ]
+    temp_dir, config_path = _make_project(items, [])
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(["Полное наименование организации лица, подготавливающего проектную документацию",
+                  "ООО «Проект»"])
+    sheet.append(["Сокращенное наименование организации лица, подготавливающего проектную документацию",
+                  None, "«Проект»"])
+    sheet.append(["Юридический адрес лица, подготавливающего проектную документацию"])
+    sheet.append(["г. Москва, ул. Ленина, 1"])
+    sheet.append(["ИНН лица, подготавливающего проектную документацию", "7735525751"])
+    sheet.append(["ИНН организации представителя заказчика", "7707083893"])
+    workbook.save(Path(temp_dir, "project", "Лист.xlsx"))
+    old = search.CONFIG_FILE, search.OUTPUT_FILE, search.CACHE_DIR, DocumentExtractor.iter_excel_rows
+    search.CONFIG_FILE = config_path
+    search.OUTPUT_FILE = Path(temp_dir, "data.json")
+    search.CACHE_DIR = Path(temp_dir, "cache")
+    reads = []
+
+    def counting_rows(file_path):
+        reads.append(file_path)
+        return old[3](file_path)
+
+    try:
+        processor = DocumentProcessor(lambda msg: None, extraction_workers=0)
+        ai = EchoAI("null")
+        processor.set_ai_interface(ai)
+        results = processor.process_documents()
+
+        # Повторный запуск: текст и ячейки книги берутся из кэша извлечения, книга не разбирается
+        DocumentExtractor.iter_excel_rows = staticmethod(counting_rows)
+        processor = DocumentProcessor(lambda msg: None, extraction_workers=0)
+        processor.set_ai_interface(EchoAI("null"))
+        assert processor.process_documents() == results
+        assert reads == [], reads
+    finally:
+        search.CONFIG_FILE, search.OUTPUT_FILE, search.CACHE_DIR = old[:3]
+        DocumentExtractor.iter_excel_rows = staticmethod(old[3])
+        shutil.rmtree(temp_dir)
+
+    assert [r['extracted_value'] for r in results] == ["ООО «Проект»", "«Проект»", "г. Москва, ул. Ленина, 1", "null",
+                                                       "7735525751", "7707083893"]
+    # Ячейка рядом с подписью проверяется раньше правил, которые не знают, чей это ИНН
+    assert [r.get('source') for r in results] == ['excel', 'excel', 'excel', None, 'excel', 'excel']
+    assert results[0]['cell'].endswith("!B1") and results[2]['cell'].endswith("!A4")
+    assert results[5]['cell'].endswith("!B6")
+    assert ai.queries == 1, "Only the unmatched item must go to the model"
+
+    print("✓ Excel label-to-value resolver test passed")
+
+
+def _make_pdf(file_path, pages):
+    """PDF с заданным текстом на каждой странице (шрифт с кириллицей)"""
+    font = fitz.Font("cjk")
+    with fitz.open() as doc:
+        for text in pages:
+            page = doc.new_page()
+            writer = fitz.TextWriter(page.rect)
+            writer.append((50, 72), text, font=font, fontsize=11)
+            writer.write_text(page)
+        doc.save(file_path)
+
+
+def test_pdf_extracts_only_pages_with_keywords():
+    """Test that only the pages of a long PDF that mention the keywords are passed on"""
+    print("Testing page-targeted PDF extraction...")
+
+    temp_dir = tempfile.mkdtemp()
+    old_cache_dir = search.CACHE_DIR
+    search.CACHE_DIR = Path(temp_dir, "cache")
+    try:
+        pages = [f"Раздел {n}. Общие положения договора" for n in range(1, 16)]
+        pages[7] = "Наименование организации: ООО Ромашка"
+        file_path = Path(temp_dir, "договор.pdf")
+        _make_pdf(file_path, pages)
+
+        text = DocumentExtractor.extract_from_pdf(file_path)
+        targeted = DocumentExtractor.select_pdf_pages(text, [("наименование организации",)])
+        whole = DocumentExtractor.select_pdf_pages(text)
+        # Ключевых слов нет ни на одной странице — передаётся весь документ
+        fallback = DocumentExtractor.select_pdf_pages(text, [("банковские реквизиты",)])
+
+        # Текст кэшируется целиком: другие ключевые слова не требуют повторного извлечения
+        key = (file_path, "pdf")
+        first = DocumentProcessor(lambda msg: None, extraction_workers=0)
+        first.extractor = CountingExtractor(text)
+        [(_, _, first_text)] = first._extraction_stage([key], {key: [("наименование организации",)]})
+        first.extraction_cache.flush()
+        second = DocumentProcessor(lambda msg: None, extraction_workers=0)
+        second.extractor = CountingExtractor(text)
+        [(_, _, second_text)] = second._extraction_stage([key], {key: [("общие положения",)]})
+    finally:
+        search.CACHE_DIR = old_cache_dir
+        shutil.rmtree(temp_dir)
+
+    assert text.count(search.PDF_PAGE_BREAK) == 14
+    assert "ООО Ромашка" in targeted
+    assert "[стр. 7]" in targeted and "[стр. 9]" in targeted
+    assert "Раздел 1." not in targeted and "Раздел 15." not in targeted
+    assert len(targeted) < len(whole) / 3
+    assert fallback == whole == text.replace(search.PDF_PAGE_BREAK, "\n")
+    assert first_text == targeted
+    assert second.extractor.calls == {}, second.extractor.calls
+    assert second_text == DocumentExtractor.select_pdf_pages(text, [("общие положения",)]) != first_text
+
+    print("✓ Page-targeted PDF extraction test passed")
+
+
+def test_word_xml_keeps_order_without_merged_duplicates():
+    """Test that DOCX is read in document order and merged table cells are not repeated"""
+    print("Testing streaming DOCX extraction...")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        document = docx.Document()
+        document.add_paragraph("Договор поставки")
+        table = document.add_table(rows=3, cols=3)
+        table.cell(0, 0).merge(table.cell(0, 2)).text = "Реквизиты сторон"
+        table.cell(1, 0).merge(table.cell(2, 0)).text = "Поставщик"
+        table.cell(1, 1).text, table.cell(1, 2).text = "ИНН", "7735525751"
+        table.cell(2, 1).text, table.cell(2, 2).text = "КПП", "773501001"
+        document.add_paragraph("Подписи сторон")
+        file_path = Path(temp_dir, "договор.docx")
+        document.save(file_path)
+        broken_path = Path(temp_dir, "сломанный.docx")
+        broken_path.write_bytes(b"not a zip")
+
+        text = DocumentExtractor.extract_from_word(file_path)
+        broken = DocumentExtractor.extract_from_word(broken_path)
+    finally:
+        shutil.rmtree(temp_dir)
+
+    assert text == ("Договор поставки\n"
+                    "Реквизиты сторон\n"
+                    "Поставщик | ИНН | 7735525751\n"
+                    "КПП | 773501001\n"
+                    "Подписи сторон"), text
+    assert broken.startswith("Ошибка при извлечении из Word файла"), broken
+
+    print("✓ Streaming DOCX extraction test passed")
+
+
+class ChunkAwareAI(AIInterface):
+    """AIInterface с маленьким окном контекста: отвечает значением, только если оно есть в промпте"""
+
+    def __init__(self, needle, context_tokens=1200):
+        super().__init__(provider="ollama", use_response_cache=False, stream=False, context_tokens=context_tokens)
+        self.needle = needle
+        self.prompts = []
+        self._lock = threading.Lock()
+
+    def generate(self, prompt, logger=None, max_tokens=500, json_mode=False):
+        with self._lock:
+            self.prompts.append(prompt)
+        return self.needle if self.needle in prompt else "null"
+
+
+def test_oversized_document_is_queried_in_chunks():
+    """Test that text longer than the model context is split, queried per chunk and reduced"""
+    print("Testing map-reduce over document chunks...")
+
+    filler = " ".join(f"Пункт {n}. Стороны обязуются исполнять условия договора." for n in range(400))
+    text = filler + " Генеральный директор: Иванов И.И. " + filler
+    items = [{"data_name": "Директор", "file": "contract.docx", "type": "word", "keywords": ["директор"]}]
+    temp_dir, config_path = _make_project(items, ["contract.docx"])
+    old_config, old_output = search.CONFIG_FILE, search.OUTPUT_FILE
+    search.CONFIG_FILE = config_path
+    search.OUTPUT_FILE = Path(temp_dir, "data.json")
+    ai = ChunkAwareAI("Иванов И.И.")
+    try:
+        processor = DocumentProcessor(lambda msg: None, use_disk_cache=False, extraction_workers=0,
+                                      retrieval_max_chars=None)
+        processor.extractor = CountingExtractor(text)
+        processor.set_ai_interface(ai)
+        results = processor.process_documents()
+    finally:
+        search.CONFIG_FILE, search.OUTPUT_FILE = old_config, old_output
+        shutil.rmtree(temp_dir)
+        ai.stop()
+
+    budget = ai.text_budget([["директор"]])
+    assert len(ai.prompts) > 1, "Oversized text must be split into several prompts"
+    assert all(len(prompt) < budget + 500 for prompt in ai.prompts)
+    assert results[0]['extracted_value'] == "Иванов И.И."
+
+    reduce = DocumentProcessor._reduce_chunk_answers
+    assert reduce(["null", "А", "Б", "Б"]) == "Б"
+    assert reduce(["null", "А", "Б", "Б"], rule="first") == "А"
+    assert reduce(["null", None]) == "null" and reduce([None, None]) is None
+
+    # Окно контекста модели OpenRouter берётся из списка моделей: этот же текст идёт одним запросом
+    server = ThreadingHTTPServer(('127.0.0.1', 0), OpenRouterModelsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    remote = AIInterface(provider="openrouter", api_key="test", model="vendor/long:free", use_response_cache=False)
+    remote.base_url = f"http://127.0.0.1:{server.server_port}"
+    try:
+        assert remote.start()
+    finally:
+        remote.stop()
+        server.shutdown()
+        server.server_close()
+    assert remote.context_tokens == 131072
+    assert len(text) <= remote.text_budget([["директор"]])
+    assert AIInterface(provider="openrouter", api_key="test", context_tokens=4096).context_tokens == 4096
+
+    print("✓ Map-reduce over document chunks test passed")
+
+
+class OpenRouterModelsHandler(BaseHTTPRequestHandler):
+    """OpenRouter /models с окном контекста одной модели"""
+
+    def do_GET(self):
+        body = json.dumps({"data": [{"id": "vendor/long:free", "context_length": 131072}]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class LifecycleOllamaHandler(BaseHTTPRequestHandler):
+    """Ollama с /api/tags и /api/generate, запоминающая тела запросов"""
+
+    payloads = []
+
+    def do_GET(self):
+        body = json.dumps({"models": [{"name": "qwen3:14b"}]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        LifecycleOllamaHandler.payloads.append(payload)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        lines = [{"response": "Иванов И.И.\n", "done": False},
+                 {"response": "", "done": True, "load_duration": 1500000000}]
+        for line in lines:
+            self.wfile.write(json.dumps(line).encode() + b"\n")
+
+    def log_message(self, *args):
+        pass
+
+
+def test_model_is_warmed_up_before_first_item():
+    """Test that the model is preloaded with the same num_ctx and keep_alive as the real queries"""
+    print("Testing Ollama readiness and warm-up...")
+
+    items = [{"data_name": "Директор", "file": "card.docx", "type": "word", "keywords": ["директор"]}]
+    temp_dir, config_path = _make_project(items, ["card.docx"])
+    old_config, old_output = search.CONFIG_FILE, search.OUTPUT_FILE
+    search.CONFIG_FILE = config_path
+    search.OUTPUT_FILE = Path(temp_dir, "data.json")
+    server = ThreadingHTTPServer(('127.0.0.1', 0), LifecycleOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    ai = AIInterface(provider="ollama", use_response_cache=False)
+    ai.base_url = f"http://127.0.0.1:{server.server_port}"
+    messages = []
+    try:
+        assert ai.start(logger=messages.append)
+        processor = DocumentProcessor(messages.append, use_disk_cache=False, extraction_workers=0,
+                                      retrieval_max_chars=1000)
+        processor.extractor = CountingExtractor("Директор: Иванов И.И.")
+        processor.set_ai_interface(ai)
+        results = processor.process_documents()
+        processor.print_report(results)
+    finally:
+        search.CONFIG_FILE, search.OUTPUT_FILE = old_config, old_output
+        shutil.rmtree(temp_dir)
+        ai.stop()
+        server.shutdown()
+        server.server_close()
+
+    warm_up, query = LifecycleOllamaHandler.payloads
+    assert warm_up["options"]["num_predict"] == 1
+    assert warm_up["options"]["num_ctx"] == query["options"]["num_ctx"] == 4096
+    assert warm_up["keep_alive"] == query["keep_alive"] == search.OLLAMA_KEEP_ALIVE
+    assert results[0]['extracted_value'] == "Иванов И.И."
+    assert any("время до первого токена" in m for m in messages)
+    assert any(m.startswith("Время до первого токена") for m in messages)
+
+    print("✓ Ollama readiness and warm-up test passed")
+
+
+def test_cli_reports_json_lines_and_exit_code():
+    """Test the headless entry point: JSON-lines events, saved results and exit code"""
+    print("Testing headless command-line run...")
+
+    # Консольный запуск не должен требовать Tk
+    blocked = subprocess.run([sys.executable, "-c", "import sys; sys.modules['tkinter'] = None; import search_cli"],
+                             capture_output=True, text=True, cwd=Path(__file__).parent)
+    assert blocked.returncode == 0, blocked.stderr
+
+    items = [
+        {"data_name": "Директор", "file": "card.docx", "type": "word", "keywords": ["директор"]},
+        {"data_name": "Договор", "file": "missing.docx", "type": "word", "keywords": ["договор"]},
+    ]
+    temp_dir, config_path = _make_project(items, [])
+    document = docx.Document()
+    document.add_paragraph("Генеральный директор: Иванов И.И.")
+    document.save(Path(temp_dir, "project", "card.docx"))
+    server = ThreadingHTTPServer(('127.0.0.1', 0), LifecycleOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    old_config, old_output, old_ai = search.CONFIG_FILE, search.OUTPUT_FILE, search_cli.AIInterface
+    old_cache_dir = search.CACHE_DIR
+    search.CACHE_DIR = Path(temp_dir, "cache")
+
+    class LocalAI(AIInterface):
+        def __init__(self, **kwargs):
+            super().__init__(use_response_cache=False, **kwargs)
+            self.base_url = f"http://127.0.0.1:{server.server_port}"
+
+    out, err = io.StringIO(), io.StringIO()
+    output_path = Path(temp_dir, "data.json")
+    search_cli.AIInterface = LocalAI
+    try:
+        args = search_cli.parse_args(["--config", str(config_path), "--output", str(output_path),
+                                      "--concurrency", "2"])
+        code = search_cli.run(args, search_cli.JsonLinesReporter(out=out, err=err))
+        saved = json.loads(output_path.read_text(encoding='utf-8'))
+    finally:
+        search.CONFIG_FILE, search.OUTPUT_FILE, search_cli.AIInterface = old_config, old_output, old_ai
+        search.CACHE_DIR = old_cache_dir
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(temp_dir)
+
+    events = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [e['event'] for e in events] == ["start", "item", "item", "done"], events
+    assert events[0]['concurrency'] == 2
+    assert {(e['data_name'], e['status']) for e in events[1:3]} == {("Директор", "found"), ("Договор", "not_found")}
+    assert events[-1]['found'] == 1 and events[-1]['not_found'] == 1
+    assert code == search_cli.EXIT_PARTIAL
+    assert [r['extracted_value'] for r in saved] == ["Иванов И.И.", "null"]
+    assert "ОТЧЕТ" in err.getvalue()
+    assert search_cli.exit_code([{'status': 'found'}]) == search_cli.EXIT_ALL_FOUND
+    assert search_cli.exit_code([{'status': 'not_found'}]) == search_cli.EXIT_NONE_FOUND
+
+    print("✓ Headless command-line run test passed")
+
+
+def test_metrics_recorded_per_item_and_summarised():
+    """Test that results carry timing/token metrics and a run summary is saved next to data.json"""
+    print("Testing per-item metrics and run summary...")
+
+    items = [
+        {"data_name": "Директор", "file": "card.docx", "type": "word", "keywords": ["директор"]},
+        {"data_name": "Адрес", "file": "card.docx", "type": "word", "keywords": ["адрес"]},
+        {"data_name": "ИНН", "file": "card.docx", "type": "word", "keywords": ["ИНН"]},
+    ]
+    temp_dir, config_path = _make_project(items, ["card.docx"])
+    old_config, old_output = search.CONFIG_FILE, search.OUTPUT_FILE
+    search.CONFIG_FILE = config_path
+    search.OUTPUT_FILE = Path(temp_dir, "data.json")
+    server = ThreadingHTTPServer(('127.0.0.1', 0), LifecycleOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    ai = AIInterface(provider="ollama", use_response_cache=False)
+    ai.base_url = f"http://127.0.0.1:{server.server_port}"
+    try:
+        processor = DocumentProcessor(lambda msg: None, use_disk_cache=False, extraction_workers=0,
+                                      collect_metrics=True)
+        processor.extractor = CountingExtractor("Директор: Иванов И.И., ИНН 7735525751")
+        processor.set_ai_interface(ai)
+        results = processor.process_documents()
+        processor.save_results(results)
+        saved = json.loads(search.OUTPUT_FILE.read_text(encoding='utf-8'))
+        summary = json.loads(Path(temp_dir, "data.metrics.json").read_text(encoding='utf-8'))
+    finally:
+        search.CONFIG_FILE, search.OUTPUT_FILE = old_config, old_output
+        shutil.rmtree(temp_dir)
+        ai.stop()
+        server.shutdown()
+        server.server_close()
+
+    director, _, inn = (r['metrics'] for r in saved)
+    # Пакетный ответ не разобран (это не JSON) — оба поля запрошены повторно
+    assert director['fields_in_prompt'] == 2 and director['retries'] == 2 and director['requests'] == 3
+    assert director['extraction_cache'] == 'miss' and director['extraction_ms'] is not None
+    assert director['prompt_tokens'] > 0 and director['model_ms'] > 0
+    assert director['first_token_ms'] is not None
+    assert 'requests' not in inn, "Items answered by rules make no model requests"
+    assert summary['items'] == 3 and summary['found_by_source'] == {'model': 2, 'rule': 1}
+    assert summary['model']['requests'] == 3 and summary['model']['retries'] == 2
+    assert set(summary['model']['latency_ms']) == {'p50', 'p90', 'p99', 'mean', 'max'}
+    assert search.percentiles([5, 1, 3, 2, 4])['p50'] == 3
+
+    print("✓ Per-item metrics and run summary test passed")
+
+
+def test_benchmark_runs_offline_against_mock_server():
+    """Test the offline benchmark: synthetic corpus, mock Ollama/OpenRouter server, full pipeline"""
+    print("Testing offline benchmark with mock LLM server...")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        corpus = search_bench.generate_corpus(Path(temp_dir), files=3, fields_per_file=3, pages=3)
+        with search_bench.MockLLMServer(latency=0.01) as server:
+            reports = [search_bench.run_benchmark(corpus, server, provider, concurrency=2, workers=2)
+                       for provider in ("ollama", "openrouter")]
+            # Как в Windows без psutil: ни psutil, ни /proc — пик памяти даёт tracemalloc
+            old_psutil, old_statm = search_bench.psutil, search_bench.PROC_STATM
+            search_bench.psutil, search_bench.PROC_STATM = None, str(Path(temp_dir, "нет", "statm"))
+            try:
+                portable = search_bench.run_benchmark(corpus, server, "ollama", concurrency=2, workers=1)
+            finally:
+                search_bench.psutil, search_bench.PROC_STATM = old_psutil, old_statm
+        extraction = search_bench.benchmark_extraction(corpus, workers=1)
+    finally:
+        shutil.rmtree(temp_dir)
+
+    for report in reports:
+        assert report['items'] == 9 and report['correct'] == 9, report
+        assert report['model_requests'] > 0 and report['items_per_second'] > 0
+    assert reports[0]['memory_source'][0] == search_bench.rss_source() and reports[0]['peak_rss_mb']
+    assert portable['correct'] == 9 and portable['memory_source'] == ['tracemalloc']
+    assert portable['peak_rss_mb'] is None and portable['peak_python_mb'] > 0
+    assert extraction['files'] == 3 and extraction['chars_per_second'] > 0
+    assert search_bench.answer_from_prompt('найти "адрес" в тексте: "Адрес: г. Тверь"') == 'г. Тверь'
+
+    print("✓ Offline benchmark test passed")
+
+
+class FlakyOpenRouterHandler(BaseHTTPRequestHandler):
+    """OpenRouter /chat/completions: два ответа 429 с Retry-After, затем успех; «broken» — всегда 503"""
+
+    calls = 0
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        FlakyOpenRouterHandler.calls += 1
+        if "broken" in payload["messages"][0]["content"]:
+            self.send_response(503)
+            self.end_headers()
+            return
+        if FlakyOpenRouterHandler.calls <= 2:
+            self.send_response(429)
+            self.send_header('Retry-After', '0.1')
+            self.end_headers()
+            return
+        body = json.dumps({"choices": [{"message": {"content": "ООО «АБЕОНА»"}}]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_rate_limited_requests_are_retried():
+    """Test that 429/5xx responses are retried with Retry-After/backoff and attempts are capped"""
+    print("Testing rate-limit-aware request scheduler...")
+
+    assert parse_retry_after("2") == 2.0 and parse_retry_after(None) is None
+    bucket = TokenBucket(rate=20, burst=1)
+    started = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    assert time.monotonic() - started >= 0.18, "Token bucket must space requests out"
+    scheduler = RequestScheduler(4)
+    scheduler.run(lambda: None)
+    scheduler._acquire()
+    scheduler._release(success=False, throttled=True)
+    assert scheduler.limit == 2, "429 must halve the concurrency limit"
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FlakyOpenRouterHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    ai = AIInterface(provider="openrouter", api_key="test", use_response_cache=False)
+    ai.base_url = f"http://127.0.0.1:{server.server_port}"
+    ai.scheduler = RequestScheduler(2, max_attempts=3, backoff_base=0.01)
+    messages = []
+    calls = []
+    try:
+        with ai.recording(calls):
+            answer = ai.query_model("текст", ["наименование"], logger=messages.append)
+        calls_before = FlakyOpenRouterHandler.calls
+        broken = ai.query_model("broken", ["наименование"], logger=messages.append)
+        broken_calls = FlakyOpenRouterHandler.calls - calls_before
+    finally:
+        ai.stop()
+        server.shutdown()
+        server.server_close()
+
+    assert answer == "ООО «АБЕОНА»", answer
+    assert ai.scheduler.throttled == 2 and ai.scheduler.retries == 4
+    assert broken == "null" and broken_calls == 3, "Attempts per request must be capped"
+    assert sum("Повтор запроса" in m for m in messages) == 4
+    # Повторы после 429 входят в метрики элемента
+    assert calls[0]['retries'] == 2, calls
+    assert DocumentProcessor._group_metrics(calls, fields=1, retries=0)['retries'] == 2
+
+    print("✓ Rate-limit-aware request scheduler test passed")
+
+
+class CrashingAI(EchoAI):
+    """Заглушка AIInterface, у которой запрос с номером crash_at завершается исключением error"""
+
+    def __init__(self, crash_at, answer="значение", error=KeyboardInterrupt):
+        super().__init__(answer)
+        self.crash_at = crash_at
+        self.error = error
+
+    def query_model(self, text, keywords, logger=None):
+        if self.queries + 1 == self.crash_at:
+            self.queries += 1
+            raise self.error("Ollama недоступна")
+        return super().query_model(text, keywords, logger)
+
+
+def test_interrupted_run_resumes_from_checkpoint():
+    """Test that finished items survive a crash in the JSONL checkpoint and a resumed run skips them"""
+    print("Testing checkpoint and resume...")
+
+    items = [
+        {"data_name": "Наименование", "file": "a.docx", "type": "word", "keywords": ["наименование"]},
+        {"data_name": "Адрес", "file": "b.docx", "type": "word", "keywords": ["адрес"]},
+        {"data_name": "Директор", "file": "missing.docx", "type": "word", "keywords": ["директор"]},
+        {"data_name": "Телефон", "file": "c.docx", "type": "word", "keywords": ["телефон"]},
+        {"data_name": "Банк", "file": "d.docx", "type": "word", "keywords": ["банк"]},
+    ]
+    temp_dir, config_path = _make_project(items, ["a.docx", "b.docx", "c.docx", "d.docx"])
+    old = search.CONFIG_FILE, search.OUTPUT_FILE, search.CACHE_DIR
+    search.CONFIG_FILE = config_path
+    search.OUTPUT_FILE = Path(temp_dir, "data.json")
+    search.CACHE_DIR = Path(temp_dir, "cache")
+    checkpoint = search.checkpoint_file_for(search.OUTPUT_FILE)
+
+    def run(ai, resume):
+        processor = DocumentProcessor(lambda msg: None, extraction_workers=0, batch_fields=False,
+                                      use_rules=False, resume=resume, locate_files=False)
+        processor.extractor = CountingExtractor("текст документа")
+        processor.set_ai_interface(ai)
+        results = processor.process_documents()
+        processor.save_results(results)
+        return results
+
+    try:
+        # Ошибка одного запроса запуск не прерывает, поэтому сбой — прерывание процесса (Ctrl+C)
+        try:
+            run(CrashingAI(crash_at=3), resume=False)
+            assert False, "The interruption must stop the run"
+        except KeyboardInterrupt:
+            pass
+        assert not search.OUTPUT_FILE.exists()
+        lines = checkpoint.read_text(encoding='utf-8').splitlines()
+        # Заголовок, элемент без файла и два ответа до сбоя
+        assert len(lines) == 4, lines
+        assert sorted(json.loads(line)['index'] for line in lines[1:]) == [0, 1, 2]
+        # Строка, оборванная при падении
+        with checkpoint.open('a', encoding='utf-8') as f:
+            f.write('{"index": 3, "res')
+
+        ai = EchoAI("значение")
+        results = run(ai, resume=True)
+        assert ai.queries == 2, ai.queries
+        assert [r['status'] for r in results] == ['found', 'found', 'not_found', 'found', 'found']
+        assert json.loads(search.OUTPUT_FILE.read_text(encoding='utf-8')) == results
+        assert not checkpoint.exists(), "Checkpoint must be removed once data.json is saved"
+        assert not Path(temp_dir, "data.json.tmp").exists()
+
+        # Контрольная точка другой конфигурации не используется
+        try:
+            run(CrashingAI(crash_at=3), resume=False)
+        except KeyboardInterrupt:
+            pass
+        items[0]["keywords"] = ["полное наименование"]
+        config_path.write_text(json.dumps({"root": os.path.join(temp_dir, "project"), "items": items},
+                                          ensure_ascii=False), encoding='utf-8')
+        ai = EchoAI("значение")
+        run(ai, resume=True)
+        assert ai.queries == 4, ai.queries
+    finally:
+        search.CONFIG_FILE, search.OUTPUT_FILE, search.CACHE_DIR = old
+        shutil.rmtree(temp_dir)
+
+    print("✓ Checkpoint and resume test passed")
+
+
+def test_failed_query_group_does_not_stop_run():
+    """Test that an error in one query group marks only its items not found and the run is saved"""
+    print("Testing failed query group...")
+
+    items = [{"data_name": f"Поле {i}", "file": f"{i}.docx", "type": "word", "keywords": [f"kw{i}"]}
+             for i in range(4)]
+    temp_dir, config_path = _make_project(items, [f"{i}.docx" for i in range(4)])
+    old_config, old_output = search.CONFIG_FILE, search.OUTPUT_FILE
+    search.CONFIG_FILE = config_path
+    search.OUTPUT_FILE = Path(temp_dir, "data.json")
+    try:
+        processor = DocumentProcessor(lambda msg: None, use_disk_cache=False, extraction_workers=0,
+                                      batch_fields=False, use_rules=False, locate_files=False)
+        processor.extractor = CountingExtractor("текст документа")
+        processor.set_ai_interface(CrashingAI(crash_at=2, error=RuntimeError))
+        results = processor.process_documents()
+        processor.save_results(results)
+        saved = json.loads(search.OUTPUT_FILE.read_text(encoding='utf-8'))
+    finally:
+        search.CONFIG_FILE, search.OUTPUT_FILE = old_config, old_output
+        shutil.rmtree(temp_dir)
+
+    assert [r['status'] for r in results].count('found') == 3, results
+    failed = [r for r in results if r['status'] == 'not_found']
+    assert failed[0]['reason'] == 'Ошибка при запросе к модели: Ollama недоступна', failed
+    assert [item['reason'] for item in processor.not_found_items] == [failed[0]['reason']]
+    assert not processor.stopped and saved == results
+
+    print("✓ Failed query group test passed")
+
+
+class HangingOllamaHandler(BaseHTTPRequestHandler):
+    """Ollama, которая не отвечает на промпты с ключевым словом «зависание»"""
+
+    release = threading.Event()
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if "зависание" in payload["prompt"]:
+            HangingOllamaHandler.release.wait(30)
+            return
+        body = json.dumps({"response": "Иванов И.И.", "done": True}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_stop_and_deadline_abort_hanging_requests():
+    """Test that stopping a run and per-item deadlines abort hung model requests and extraction"""
+    print("Testing cancellation and per-item deadlines...")
+
+    items = [
+        {"data_name": "Директор", "file": "a.docx", "type": "word", "keywords": ["директор"]},
+        {"data_name": "Подпись", "file": "b.docx", "type": "word", "keywords": ["зависание"]},
+    ]
+    temp_dir, config_path = _make_project(items, ["a.docx", "b.docx", "c.pdf", "d.xlsx"])
+    old = search.CONFIG_FILE, search.OUTPUT_FILE
+    search.CONFIG_FILE = config_path
+    search.OUTPUT_FILE = Path(temp_dir, "data.json")
+    server = ThreadingHTTPServer(('127.0.0.1', 0), HangingOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    ai = AIInterface(provider="ollama", use_response_cache=False, stream=False)
+    ai.base_url = f"http://127.0.0.1:{server.server_port}"
+    messages = []
+
+    def run(cancel=None, item_deadline=None):
+        processor = DocumentProcessor(messages.append, use_disk_cache=False, extraction_workers=0,
+                                      batch_fields=False, item_deadline=item_deadline)
+        processor.extractor = CountingExtractor("Директор: Иванов И.И.")
+        processor.set_ai_interface(ai)
+        started = time.monotonic()
+        results = processor.process_documents(cancel)
+        return processor, results, time.monotonic() - started
+
+    try:
+        # Предел времени: зависший элемент не найден, остальные обработаны
+        _, results, seconds = run(item_deadline=0.5)
+        assert seconds < 5, seconds
+        assert results[0]['extracted_value'] == "Иванов И.И."
+        assert results[1]['status'] == 'not_found'
+        assert results[1]['reason'].startswith('Превышен предел времени'), results[1]
+
+        # Остановка: зависшие запросы обрываются, частичные результаты сохраняются
+        items[0]["keywords"] = ["зависание", "директор"]
+        config_path.write_text(json.dumps({"root": os.path.join(temp_dir, "project"), "items": items},
+                                          ensure_ascii=False), encoding='utf-8')
+        cancel = CancelToken()
+        threading.Timer(0.5, cancel.cancel).start()
+        processor, results, seconds = run(cancel)
+        assert seconds < 2, seconds
+        assert processor.stopped
+        assert [r['reason'] for r in results] == ['Обработка остановлена'] * 2
+        assert not any("Повтор запроса" in m for m in messages), "Aborted requests must not be retried"
+        processor.save_results(results)
+        assert json.loads(search.OUTPUT_FILE.read_text(encoding='utf-8')) == results
+        assert search.checkpoint_file_for(search.OUTPUT_FILE).exists(), "Checkpoint must be kept to resume"
+
+        # Зависший процесс извлечения завершается при остановке
+        project = Path(temp_dir, "project")
+        cancel = CancelToken()
+        threading.Timer(0.5, cancel.cancel).start()
+        started = time.monotonic()
+        try:
+            list(extract_files_parallel([(str(project / "c.pdf"), "pdf"), (str(project / "d.xlsx"), "excel")],
+                                        2, 30, MisbehavingExtractor(), cancel=cancel))
+            assert False, "Extraction must be cancelled"
+        except Cancelled:
+            pass
+        assert time.monotonic() - started < 3
+    finally:
+        search.CONFIG_FILE, search.OUTPUT_FILE = old
+        HangingOllamaHandler.release.set()
+        ai.stop()
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(temp_dir)
+
+    print("✓ Cancellation and per-item deadlines test passed")
+
+
+def test_log_queue_batches_lines_from_worker_threads():
+    """Test that log lines from worker threads are drained in bounded batches and all reach the log file"""
+    print("Testing queued GUI log...")
+
+    temp_dir = tempfile.mkdtemp()
+    log_file = Path(temp_dir, "search.log")
+    try:
+        log = QueuedLog(log_file, batch_max_lines=1000)
+        writers = [threading.Thread(target=lambda n=n: [log.write(f"{n}:{k}") for k in range(2500)])
+                   for n in range(4)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+
+        batches = []
+        while log.pending():
+            batches.append(log.drain())
+        assert [len(b) for b in batches] == [1000] * 10, [len(b) for b in batches]
+        assert log.drain() == []
+
+        log.write("последняя строка")
+        log.close()
+        lines = log_file.read_text(encoding='utf-8').splitlines()
+        assert len(lines) == 10001 and lines[-1] == "последняя строка"
+        for n in range(4):
+            assert [line for line in lines if line.startswith(f"{n}:")] == [f"{n}:{k}" for k in range(2500)]
+    finally:
+        shutil.rmtree(temp_dir)
+
+    print("✓ Queued GUI log test passed")
+
+
+class FakeTkRoot:
+    """Заглушка корня Tk: after() копит вызовы, которые тест выполняет вместо mainloop"""
+
+    def __init__(self):
+        self.pending = []
+        self.destroyed = False
+
+    def after(self, ms, callback, *args):
+        self.pending.append((callback, args))
+
+    def destroy(self):
+        self.destroyed = True
+
+
+class FakeButton:
+    def config(self, **options):
+        pass
+
+
+def test_closing_window_waits_for_results_to_be_saved():
+    """Test closing the GUI while processing: the worker is cancelled and saves before the window goes"""
+    print("Testing window close during processing...")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        app = search.GUIApp.__new__(search.GUIApp)
+        app.root = FakeTkRoot()
+        app.log = QueuedLog(Path(temp_dir, "search.log"))
+        app.start_button = app.stop_button = FakeButton()
+        app.cancel_token = CancelToken()
+        app.closing = False
+        saved = []
+
+        def work():
+            app.cancel_token.wait(5)
+            time.sleep(0.2)  # save_results после отмены
+            saved.append(app.cancel_token.cancelled)
+
+        app.worker = threading.Thread(target=work, daemon=True)
+        app.worker.start()
+        app.close()
+        app.close()  # повторное нажатие крестика не запускает второй опрос
+        assert app.cancel_token.cancelled and not app.root.destroyed
+        assert len(app.root.pending) == 1
+
+        while app.root.pending and not app.root.destroyed:
+            callback, args = app.root.pending.pop(0)
+            time.sleep(0.01)
+            callback(*args)
+        assert app.root.destroyed and saved == [True]
+        assert "сохранение результатов" in Path(temp_dir, "search.log").read_text(encoding='utf-8')
+
+        # Без обработки окно закрывается сразу
+        idle = search.GUIApp.__new__(search.GUIApp)
+        idle.root, idle.log, idle.worker, idle.closing = FakeTkRoot(), QueuedLog(None), None, False
+        idle.close()
+        assert idle.root.destroyed
+    finally:
+        shutil.rmtree(temp_dir)
+
+    print("✓ Window close test passed")
+
+
+class EmbeddingOllamaHandler(BaseHTTPRequestHandler):
+    """Ollama /api/embed: первая координата — «про саморегулируемые организации» ли текст"""
+
+    inputs = 0
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        EmbeddingOllamaHandler.inputs += len(payload["input"])
+        vectors = [[1.0 if ("СРО" in t or "саморегулируем" in t.lower()) else 0.0, 1.0] for t in payload["input"]]
+        body = json.dumps({"model": payload["model"], "embeddings": vectors}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_chunk_index_selects_relevant_passages():
+    """Test that the persisted chunk index picks passages by BM25 and by embeddings for paraphrases"""
+    print("Testing chunk index retrieval...")
+
+    text = ("Общие положения договора. " * 2000
+            + "Полное наименование организации лица подготавливающего проектную документацию: ООО «Ромашка». "
+            + "Прочие условия. " * 1500
+            + "Наименование СРО: Ассоциация «Объединение строителей». "
+            + "Прочие условия. " * 1500)
+    typo = ("Полное наименование организации лица подгтавливающего проектную документацию",)
+    paraphrase = ("саморегулируемая",)
+
+    index = ChunkIndex.build(text)
+    assert ChunkIndex.from_dict(json.loads(json.dumps(index.to_dict()))).spans == index.spans
+    best = index.rank(typo)[0]
+    assert "ООО «Ромашка»" in text[slice(*index.spans[best])]
+
+    temp_dir = tempfile.mkdtemp()
+    old_cache_dir = search.CACHE_DIR
+    search.CACHE_DIR = Path(temp_dir, "cache")
+    server = ThreadingHTTPServer(('127.0.0.1', 0), EmbeddingOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    ai = AIInterface(provider="ollama", use_response_cache=False)
+    ai.base_url = f"http://127.0.0.1:{server.server_port}"
+    try:
+        processor = DocumentProcessor(lambda msg: None, retrieval_max_chars=2000)
+        processor.set_ai_interface(ai)
+        lines = []
+        context = processor._select_context(text, [typo], lines.append)
+        assert "ООО «Ромашка»" in context and len(context) <= 2000, len(context)
+        # Перефразированная подпись по словам не находится — уходит весь текст
+        assert processor._select_context(text, [paraphrase], lines.append) == text
+
+        processor = DocumentProcessor(lambda msg: None, retrieval_max_chars=2000, embedding_model="bge-m3")
+        processor.set_ai_interface(ai)
+        context = processor._select_context(text, [paraphrase], lines.append)
+        assert "Ассоциация «Объединение строителей»" in context and len(context) <= 2000, len(context)
+        chunk_inputs = EmbeddingOllamaHandler.inputs
+        assert chunk_inputs == len(index.spans) + 1
+        processor.index_cache.flush()  # Конец запуска (process_documents)
+
+        # Следующий запуск: индекс с векторами берётся с диска, эмбеддинги частей не запрашиваются
+        processor = DocumentProcessor(lambda msg: None, retrieval_max_chars=2000, embedding_model="bge-m3")
+        processor.set_ai_interface(ai)
+        assert processor._select_context(text, [paraphrase], lines.append) == context
+        assert processor.index_cache.hits == 1
+        assert EmbeddingOllamaHandler.inputs == chunk_inputs + 1
+    finally:
+        search.CACHE_DIR = old_cache_dir
+        ai.stop()
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(temp_dir)
+
+    print("✓ Chunk index retrieval test passed")
+
+
+class FolderExtractor(CountingExtractor):
+    """Заглушка извлечения: текст каждого файла задаётся по имени"""
+
+    def __init__(self, texts):
+        super().__init__()
+        self.texts = texts
+
+    def _extract(self, file_path):
+        super()._extract(file_path)
+        return self.texts[file_path.name]
+
+    extract_from_word = extract_from_excel = extract_from_pdf = _extract
+
+
+class LookupAI(EchoAI):
+    """Заглушка AIInterface: значение для ключевого слова, если в тексте есть его метка, иначе «null»"""
+
+    def __init__(self, answers):
+        super().__init__()
+        # (слово ключевой фразы, метка в тексте) -> значение
+        self.answers = answers
+
+    def query_model(self, text, keywords, logger=None):
+        self.queries += 1
+        return next((value for (word, marker), value in self.answers.items()
+                     if word in keywords[0] and marker in text), "null")
+
+
+def test_items_without_file_are_located_by_corpus_index():
+    """Test that items with a missing file are answered from documents found in the folder index"""
+    print("Testing document location by folder index...")
+
+    texts = {
+        "приказ 12.docx": "Приказ № 12-П о назначении ответственного за строительный контроль: Петров П.П.",
+        "приказ 7.docx": "Приказ № 7 о назначении ответственного за пожарную безопасность",
+        "Договор.docx": "Договор подряда № 5. Заказчик: ООО «Ромашка». Предмет договора: ремонт кровли",
+        "Смета.docx": "Локальная смета на кровельные работы",
+    }
+    items = [
+        {"data_name": "Номер приказа", "file": "Приказы/вмнесто приказа.pdf", "type": "pdf",
+         "keywords": ["Номер приказа о назначении ответственного за строительный контроль"]},
+        {"data_name": "Заказчик", "file": "", "type": "word", "keywords": ["Заказчик по договору подряда"]},
+        {"data_name": "Директор", "keywords": ["генеральный директор"]},
+        {"data_name": "Предмет", "file": "Договор.docx", "type": "word", "keywords": ["Предмет договора"]},
+    ]
+    temp_dir, config_path = _make_project(items, ["Договор.docx", "Смета.docx"])
+    project = Path(temp_dir, "project")
+    Path(project, "Приказы").mkdir()
+    for name in ("приказ 12.docx", "приказ 7.docx"):
+        Path(project, "Приказы", name).write_bytes(name.encode('utf-8'))
+    Path(project, "~$приказ 12.docx").write_bytes(b"lock")
+    answers = {
+        ("приказа", "12-П"): "№ 12-П",
+        ("Заказчик", "Ромашка"): "ООО «Ромашка»",
+        ("Предмет", "ремонт"): "ремонт кровли",
+    }
+    old = search.CONFIG_FILE, search.OUTPUT_FILE, search.CACHE_DIR
+    search.CONFIG_FILE = config_path
+    search.OUTPUT_FILE = Path(temp_dir, "data.json")
+    search.CACHE_DIR = Path(temp_dir, "cache")
+
+    def run(incremental=False):
+        processor = DocumentProcessor(lambda msg: None, extraction_workers=0, batch_fields=False,
+                                      use_rules=False, incremental=incremental, collect_metrics=True)
+        processor.extractor = FolderExtractor(texts)
+        ai = LookupAI(answers)
+        processor.set_ai_interface(ai)
+        results = processor.process_documents()
+        processor.save_results(results)
+        return processor, ai, results
+
+    try:
+        processor, ai, results = run()
+        assert [r['status'] for r in results] == ['found', 'found', 'not_found', 'found'], results
+        assert results[0]['extracted_value'] == "№ 12-П"
+        assert results[0]['located_file'] == "Приказы/приказ 12.docx"
+        assert results[0]['file'] == "Приказы/вмнесто приказа.pdf"
+        assert results[1]['located_file'] == "Договор.docx"
+        assert results[2]['reason'] == 'Файл не указан или не найден'
+        assert 'located_file' not in results[3]
+        # Каждый документ папки извлечён один раз: для индекса и для элементов
+        assert processor.extractor.calls == {"Договор.docx": 1, "приказ 12.docx": 1, "приказ 7.docx": 1,
+                                             "Смета.docx": 1}, processor.extractor.calls
+        # В метрики запуска попадают только файлы элементов и кандидаты, а не весь индекс папки
+        assert "Смета.docx" not in {file_path.name for file_path, _ in processor._file_metrics}
+        assert processor.run_summary['extraction']['files'] == len(processor._file_metrics) < 4
+
+        # Индекс папки сохранён: повторный запуск ничего не извлекает, найденное переносится
+        processor, ai, results = run(incremental=True)
+        assert processor.extractor.calls == {}, processor.extractor.calls
+        assert ai.queries == 0, ai.queries
+        assert results[0]['located_file'] == "Приказы/приказ 12.docx"
+
+        # Изменённый файл переиндексируется, остальные — нет
+        texts["приказ 7.docx"] = "Приказ № 7 о назначении ответственного за охрану труда"
+        Path(project, "Приказы", "приказ 7.docx").write_bytes(b"changed order")
+        Path(project, "Договор.docx").unlink()
+        items[3]["file"] = ""
+        config_path.write_text(json.dumps({"root": str(project), "items": items}, ensure_ascii=False),
+                               encoding='utf-8')
+        processor, ai, results = run(incremental=True)
+        assert processor.extractor.calls == {"приказ 7.docx": 1}, processor.extractor.calls
+        assert results[0]['located_file'] == "Приказы/приказ 12.docx"
+        assert [r['status'] for r in results] == ['found', 'not_found', 'not_found', 'not_found'], results
+    finally:
+        search.CONFIG_FILE, search.OUTPUT_FILE, search.CACHE_DIR = old
+        shutil.rmtree(temp_dir)
+
+    print("✓ Document location by folder index test passed")
+
+
+if __name__ == "__main__":
+    try:
+        test_text_cache_lru_eviction()
+        test_each_file_extracted_once()
+        test_extraction_cache_persists_between_runs()
+        test_parallel_extraction_isolates_failures()
+        test_concurrent_queries_keep_config_order()
+        test_batched_prompt_with_single_retry()
+        test_keyword_windows_shrink_prompt()
+        test_rules_answer_pattern_fields_without_model()
+        test_response_cache_returns_unchanged_prompts()
+        test_incremental_run_reprocesses_only_changes()
+        test_streaming_stops_at_first_answer_line()
+        test_excel_rows_streamed_without_dataframes()
+        test_excel_label_resolver_skips_model()
+        test_pdf_extracts_only_pages_with_keywords()
+        test_word_xml_keeps_order_without_merged_duplicates()
+        test_oversized_document_is_queried_in_chunks()
+        test_model_is_warmed_up_before_first_item()
+        test_cli_reports_json_lines_and_exit_code()
+        test_metrics_recorded_per_item_and_summarised()
+        test_benchmark_runs_offline_against_mock_server()
+        test_rate_limited_requests_are_retried()
+        test_interrupted_run_resumes_from_checkpoint()
+        test_failed_query_group_does_not_stop_run()
+        test_stop_and_deadline_abort_hanging_requests()
+        test_log_queue_batches_lines_from_worker_threads()
+        test_closing_window_waits_for_results_to_be_saved()
+        test_chunk_index_selects_relevant_passages()
+        test_items_without_file_are_located_by_corpus_index()
+        print("\n🎉 All tests passed! Search pipeline is working correctly.")
+    except Exception as e:
+        print(f"\n❌ Test failed with error: {e}")
+        raise